@@ -11,9 +11,14 @@
 #   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
-#import spidev -- We import below so spidev is only a requirement if using dryer master
+#import spidev -- imported by spidevSlot so spidev is only a requirement if using dryer master
+import logging
 from conversion import evalConversion
 
+# ADC readings taken per sensor, the highest and lowest are dropped
+DEFAULT_SAMPLES = 18
+SPI_MAX_SPEED_HZ = 100000
+
 def processDMMCCommands(JSON):
 	cmds = []
 	# This uses SPI ADC Mikro Click on Pi, Port is spi device slot, address is adc channel
@@ -25,43 +30,137 @@ def processDMMCCommands(JSON):
 				slot=json_grp['port'],
 				channel=json_grp['addy'],
 				convertPy=json_grp['convert'],
-			    bias=json_grp['bias'])
-			cmd.execute()
+				bias=json_grp['bias'],
+				samples=json_grp.get('samples',DEFAULT_SAMPLES))
 			cmds.append(cmd)
+		SAMPLER.sample(cmds)
+		for cmd in cmds:
+			cmd.convert()
 	return cmds
 
+def spidevSlot(slot):
+	import spidev
+	spi = spidev.SpiDev(0, slot)
+	spi.max_speed_hz = SPI_MAX_SPEED_HZ
+	return spi
+
+def trimmedMean(values):
+	"""Mean of values without (one of) the highest and lowest."""
+	total = 0; lo = hi = values[0]
+	for v in values:
+		total += v
+		if v < lo:
+			lo = v
+		elif v > hi:
+			hi = v
+	if len(values) <= 2:
+		return float(total)/len(values)
+	return float(total - lo - hi)/(len(values) - 2)
+
+def median(values):
+	values = sorted(values)
+	mid = len(values)//2
+	if len(values) % 2:
+		return float(values[mid])
+	return (values[mid-1] + values[mid])/2.
+
+class SPISampler:
+	"""
+	Reads the MCP320x ADCs on the SPI slots, each slot opened (by openSlot,
+	spidevSlot by default) the first time it is used and then kept.  All
+	the channels on a slot are sampled round-robin, one conversion each per
+	round, until each has its sensor's samples.  The ADC starts a
+	conversion on chip select, so each one is its own 3 byte xfer2.  A slot
+	that fails is closed, its sensors marked in error, and reopened on the
+	next sample.
+	"""
+	def __init__(self,openSlot=spidevSlot):
+		self.openSlot = openSlot
+		self.slots = {}
+
+	def sample(self,cmds):
+		slots = {}
+		for cmd in cmds:
+			slots.setdefault(cmd.slot,[]).append(cmd)
+		for (slot,slotCmds) in slots.items():
+			try:
+				self._sampleSlot(slot,slotCmds)
+			except (IOError,OSError) as e:
+				logging.error("SPI slot "+str(slot)+" failed: "+str(e))
+				self.close(slot)
+				for cmd in slotCmds:
+					cmd.error = True
+
+	def close(self,slot=None):
+		for s in [s for s in self.slots.keys() if slot is None or s == slot]:
+			try:
+				self.slots.pop(s).close()
+			except (IOError,OSError):
+				pass
+
+	def _sampleSlot(self,slot,cmds):
+		spi = self.slots.get(slot)
+		if spi is None:
+			spi = self.slots[slot] = self.openSlot(slot)
+		frames = [cmd.frame() for cmd in cmds]
+		samples = [[] for cmd in cmds]
+		for i in range(max([cmd.samples for cmd in cmds])):
+			for (j,cmd) in enumerate(cmds):
+				if i < cmd.samples:
+					buffer = spi.xfer2(list(frames[j]))
+					samples[j].append(((buffer[1] & 0x0F) << 8) + buffer[2])
+		for (cmd,values) in zip(cmds,samples):
+			cmd.setSamples(values)
+
+class FakeSpiDev:
+	"""
+	SpiDev stand-in answering MCP320x conversions with readings(slot,channel),
+	for running without the Click board: SPISampler(lambda slot: FakeSpiDev(slot,readings)).
+	"""
+	def __init__(self,slot,readings):
+		self.slot = slot
+		self.readings = readings
+		self.transfers = 0
+		self.closed_p = False
+
+	def xfer2(self,data):
+		self.transfers += 1
+		channel = ((data[0] & 0x01) << 2) | (data[1] >> 6)
+		value = int(self.readings(self.slot,channel)) & 0x0FFF
+		return [0,value >> 8,value & 0xFF]
+
+	def close(self):
+		self.closed_p = True
+
+SAMPLER = SPISampler()
 
 class DMMCCmd:
-	def __init__(self, sensorID=-1, slot=0, channel=1, convertPy="x", bias=0.0):
+	def __init__(self, sensorID=-1, slot=0, channel=1, convertPy="x", bias=0.0, samples=DEFAULT_SAMPLES, reduce=trimmedMean):
 		self.sensorID = sensorID
 		self.slot = slot
 		self.channel = channel-1
 		self.convertPy = convertPy
 		self.bias = bias
+		self.samples = max(1,int(samples))
+		self.reduce = reduce
 		self.value=-1
 		self.raw_data = -1
 		self.error = False
 
-	def _readADC(self):
-		import spidev
-		spi = spidev.SpiDev(0, self.slot)
-                spi.max_speed_hz = 100000
-		values = []
-		for i in range(0, 18):
-			buffer = spi.xfer2([0x06, self.channel<<6, 0])
-			value = ((buffer[1] & 0x0F) << 8) + buffer[2]
-			print value
-			values.append(value)
-		values.remove(max(values))
-		values.remove(min(values))
-
-		value = float(sum(values))/len(values)
-		spi.close()
-		return value
+	def frame(self):
+		"""MCP320x single ended conversion request for the channel."""
+		return (0x06 | (self.channel >> 2), (self.channel & 0x03) << 6, 0)
+
+	def setSamples(self,values):
+		self.raw_data = self.reduce(values)
+
+	def convert(self):
+		if not self.error:
+			self.value = evalConversion(self.convertPy, self.raw_data) + float(self.bias)
 
 	def execute(self):
-		self.raw_data = self._readADC()
-		self.value = evalConversion(self.convertPy, self.raw_data) + float(self.bias)
+		SAMPLER.sample([self])
+		self.convert()
 
 	def to_JSON_WWW_data(self, readingTime):
 		if self.error:
@@ -14,6 +14,9 @@
 from pymodbus.client.sync import ModbusTcpClient
 import logging
 import math
+import select
+import threading
+import time
 
 PV_ID = 20
 SP_ID = 21
@@ -28,6 +31,11 @@ DEVICES = (HoneywellUDC2500_ID,
            DUMMY)
 SENSORS = (PV_ID,SP_ID,OUTPUT_ID)
 
+HOLDING_REGISTERS = "holding"
+INPUT_REGISTERS = "input"
+# the most registers one Modbus read may return
+MAX_READ_REGISTERS = 125
+
 def check(deviceID,sensorTypeID):
     return (deviceID in DEVICES and sensorTypeID in SENSORS)
 
@@ -41,6 +49,8 @@ def factory(deviceID,sensorTypeID,sensorID,IPaddr,value=None):
                 return Honeywell_UDC3500_setSP(sensorID,IPaddr,value)
             else:
                 return Honeywell_UDC3500_getSP(sensorID,IPaddr)
+        elif sensorTypeID == OUTPUT_ID:
+            return Honeywell_UDC3500_getOutput(sensorID,IPaddr)
     elif deviceID == HoneywellUDC2500_ID:
         if sensorTypeID == PV_ID:
             return Honeywell_UDC2500_getPV(sensorID,IPaddr)
@@ -49,6 +59,8 @@ def factory(deviceID,sensorTypeID,sensorID,IPaddr,value=None):
                 return Honeywell_UDC2500_setSP(sensorID,IPaddr,value)
             else:
                 return Honeywell_UDC2500_getSP(sensorID,IPaddr)
+        elif sensorTypeID == OUTPUT_ID:
+            return Honeywell_UDC2500_getOutput(sensorID,IPaddr)
     elif deviceID == DUMMY:
         if sensorTypeID == PV_ID:
             return Dummy_getPV(sensorID,IPaddr)
@@ -58,17 +70,197 @@ def factory(deviceID,sensorTypeID,sensorID,IPaddr,value=None):
             else:
                 return Dummy_getSP(sensorID,IPaddr)
 
+class ModbusConnectError(Exception):
+    def __init__(self, IPaddr, message):
+        Exception.__init__(self, IPaddr+": "+message)
+        self.IPaddr = IPaddr
+
+class PooledConnection:
+    def __init__(self, client):
+        self.client = client
+        self.lastUsed = time.time()
+
+class ModbusPool:
+    """
+    Open Modbus TCP connections kept across cycles, one per controller IP.
+
+    borrow() hands out the connection for an IP, connecting only if there
+    is none or the one there is found dead: closed, or readable while idle,
+    which for Modbus means the controller hung up (or sent something stale).
+    release(IPaddr,failed=True) drops a connection that errored so the next
+    borrow reconnects.  After a failed connect, borrows of that IP raise
+    ModbusConnectError straight away until a backoff, doubling from
+    minBackoff up to maxBackoff, has passed.  evictIdle() closes
+    connections unused for idleTimeout, e.g. controllers taken out of the
+    config.  Connecting, which can block until the client's timeout, is
+    done holding only that IP's lock so other controllers aren't held up.
+    """
+    def __init__(self, idleTimeout=900.0, minBackoff=5.0, maxBackoff=300.0, clientFactory=ModbusTcpClient):
+        self.idleTimeout = idleTimeout
+        self.minBackoff = minBackoff
+        self.maxBackoff = maxBackoff
+        self.clientFactory = clientFactory
+        self.conns = {}
+        self.backoff = {}   # IP -> (retry time, current backoff)
+        self.lock = threading.Lock()
+        self.connectLocks = {}  # IP -> lock held while connecting to it
+
+    def borrow(self, IPaddr):
+        with self.lock:
+            connectLock = self.connectLocks.setdefault(IPaddr, threading.Lock())
+        with connectLock:
+            with self.lock:
+                conn = self.conns.get(IPaddr)
+                if conn is not None and not alive_p(conn.client):
+                    logging.info("Modbus connection to "+IPaddr+" went stale, reconnecting")
+                    conn.client.close()
+                    conn = None
+                    del self.conns[IPaddr]
+                if conn is not None:
+                    conn.lastUsed = time.time()
+                    return conn.client
+                (retryAt, backoff) = self.backoff.get(IPaddr, (0, 0))
+                if time.time() < retryAt:
+                    raise ModbusConnectError(IPaddr, "backing off for "+str(int(retryAt-time.time()+0.5))+"s after failed connect")
+            return self._connect(IPaddr, backoff).client
+
+    def release(self, IPaddr, failed=False):
+        with self.lock:
+            conn = self.conns.get(IPaddr)
+            if conn is None:
+                return
+            conn.lastUsed = time.time()
+            if failed:
+                conn.client.close()
+                del self.conns[IPaddr]
+
+    def evictIdle(self):
+        with self.lock:
+            now = time.time()
+            for (IPaddr, conn) in self.conns.items():
+                if now - conn.lastUsed >= self.idleTimeout:
+                    logging.info("Closing idle Modbus connection to "+IPaddr)
+                    conn.client.close()
+                    del self.conns[IPaddr]
+
+    def closeAll(self):
+        with self.lock:
+            for conn in self.conns.values():
+                conn.client.close()
+            self.conns = {}
+            self.backoff = {}
+
+    def _connect(self, IPaddr, backoff):
+        """Connect to IPaddr, holding its connect lock but not the pool lock."""
+        client = self.clientFactory(host=IPaddr)
+        connected = client.connect()
+        if not connected:
+            client.close()
+        with self.lock:
+            if not connected:
+                backoff = min(max(backoff*2, self.minBackoff), self.maxBackoff)
+                self.backoff[IPaddr] = (time.time()+backoff, backoff)
+                raise ModbusConnectError(IPaddr, "connect failed, next try in "+str(backoff)+"s")
+            self.backoff.pop(IPaddr, None)
+            conn = PooledConnection(client)
+            self.conns[IPaddr] = conn
+            return conn
+
+def alive_p(client):
+    sock = getattr(client, "socket", None)
+    if sock is None:
+        return False
+    try:
+        (r, w, x) = select.select([sock], [], [], 0)
+    except (select.error, ValueError, TypeError):
+        return False
+    return not r
+
+POOL = ModbusPool()
+
+def executeCmds(cmds, maxGap=0):
+    """
+    Execute cmds, reading the registers of the EthModbusReadCmds among them
+    with as few Modbus requests as planReads can manage.
+    """
+    for read in planReads([cmd for cmd in cmds if isinstance(cmd, EthModbusReadCmd)], maxGap):
+        read.execute()
+    for cmd in cmds:
+        if not isinstance(cmd, EthModbusReadCmd):
+            cmd.execute()
+
+def planReads(cmds, maxGap=0):
+    """
+    Group register read commands by controller and register space and
+    merge runs of registers at most maxGap apart into one RegisterRead of
+    up to MAX_READ_REGISTERS registers.
+    """
+    groups = {}
+    for cmd in cmds:
+        groups.setdefault((cmd.slaveAddr, cmd.space), []).append(cmd)
+    reads = []
+    for ((IPaddr, space), group) in sorted(groups.items()):
+        group.sort(key=lambda cmd: cmd.register)
+        run = [group[0]]
+        for cmd in group[1:]:
+            if cmd.register - run[-1].register <= maxGap + 1 and cmd.register - run[0].register < MAX_READ_REGISTERS:
+                run.append(cmd)
+            else:
+                reads.append(RegisterRead(IPaddr, space, run))
+                run = [cmd]
+        reads.append(RegisterRead(IPaddr, space, run))
+    return reads
+
+class RegisterRead:
+    """One Modbus read of the registers of cmds, all on the same controller and in the same space."""
+    def __init__(self, IPaddr, space, cmds):
+        self.IPaddr = IPaddr
+        self.space = space
+        self.cmds = cmds
+        self.start = cmds[0].register
+        self.count = cmds[-1].register - self.start + 1
+        self.pool = cmds[0].pool
+
+    def execute(self):
+        try:
+            client = self.pool.borrow(self.IPaddr)
+        except ModbusConnectError as e:
+            logging.error(self.shortDesc()+" failed: "+str(e))
+            return
+        try:
+            if self.space == HOLDING_REGISTERS:
+                rsp = client.read_holding_registers(self.start, self.count)
+            else:
+                rsp = client.read_input_registers(self.start, self.count)
+        except Exception as e:
+            self.pool.release(self.IPaddr, failed=True)
+            logging.error(self.shortDesc()+" failed: "+str(e))
+            return
+        # the controller answered, so the connection is fine even if the
+        # answer is a Modbus exception response
+        self.pool.release(self.IPaddr)
+        if rsp.isError():
+            logging.error(self.shortDesc()+" failed: "+str(rsp))
+            return
+        try:
+            for cmd in self.cmds:
+                cmd.setRegister(rsp.getRegister(cmd.register - self.start))
+        except Exception as e:
+            logging.error(self.shortDesc()+" failed: "+str(e))
+
+    def shortDesc(self):
+        return "Read of "+self.space+" registers "+str(self.start)+"-"+str(self.start+self.count-1)+" for "+", ".join([cmd.shortDesc() for cmd in self.cmds])
+
 class EthModbusCmd:
     def __init__(self, sensorID, IPaddr):
         self.sensorID=sensorID
         self.slaveAddr=IPaddr
-        self.client = ModbusTcpClient(host=self.slaveAddr)
+        self.pool = POOL
     def getClient(self):
-        self.client.close()             # kinda a POS
-        if not self.client.connect(): # make sure it can be re-opened
-            # TODO: throw exception
-            pass
-        return self.client
+        """The open connection to the controller, from the pool.  Follow with releaseClient."""
+        return self.pool.borrow(self.slaveAddr)
+    def releaseClient(self, failed=False):
+        self.pool.release(self.slaveAddr, failed)
 
     def execute(self):
         # doesn't do anything
@@ -76,21 +268,24 @@ class EthModbusCmd:
     def to_JSON_WWW_data(self,readingTime):
         # TODO: not supposed to be here, throw an exception
         return []
-    def __del__(self):
-        self.client.close()
 
-class Honeywell_UDC3500_getSP(EthModbusCmd):
+class EthModbusReadCmd(EthModbusCmd):
+    """Read of the single register at register in space, handed to setRegister."""
+    space = HOLDING_REGISTERS
+    register = 0x0000
+    def execute(self):
+        RegisterRead(self.slaveAddr, self.space, [self]).execute()
+    def setRegister(self, raw):
+        pass
+
+class Honeywell_UDC3500_getSP(EthModbusReadCmd):
+    space = INPUT_REGISTERS
+    register = 0x0002
     def __init__(self,sensorID,IPaddr):
         EthModbusCmd.__init__(self,sensorID,IPaddr)
         self.SP = None
-    def execute(self):
-        try:
-            client = self.getClient()
-            rsp = client.read_input_registers(0x0002,1)
-            self.SP = rsp.getRegister(0) / 10.
-            client.close()
-        except Exception as e:
-            logging.error("UDC3500 getSP failed: "+str(e))
+    def setRegister(self,raw):
+        self.SP = raw / 10.
     def to_JSON_WWW_data(self,readingTime):
         if self.SP:
             return [{"sensor_id":self.sensorID,
@@ -103,18 +298,14 @@ class Honeywell_UDC3500_getSP(EthModbusCmd):
     def shortDesc(self):
         return "UDC35000 get SP cmd, addr: "+self.slaveAddr
 
-class Honeywell_UDC3500_getPV(EthModbusCmd):
+class Honeywell_UDC3500_getPV(EthModbusReadCmd):
+    space = HOLDING_REGISTERS
+    register = 0x0000
     def __init__(self,sensorID,IPaddr):
         EthModbusCmd.__init__(self,sensorID,IPaddr)
         self.PV = None
-    def execute(self):
-        try:
-            client = self.getClient()
-            rsp = client.read_holding_registers(0x0000,1)
-            self.PV = rsp.getRegister(0) / 10.
-            client.close()
-        except Exception as e:
-            logging.error("UDC3500 getPV failed: "+str(e))
+    def setRegister(self,raw):
+        self.PV = raw / 10.
     def to_JSON_WWW_data(self,readingTime):
         if self.PV:
             return [{"sensor_id":self.sensorID,
@@ -127,18 +318,42 @@ class Honeywell_UDC3500_getPV(EthModbusCmd):
     def shortDesc(self):
         return "UDC35000 get PV cmd, addr: "+self.slaveAddr
 
+class Honeywell_UDC3500_getOutput(EthModbusReadCmd):
+    space = INPUT_REGISTERS
+    register = 0x0003
+    def __init__(self,sensorID,IPaddr):
+        EthModbusCmd.__init__(self,sensorID,IPaddr)
+        self.output = None
+    def setRegister(self,raw):
+        self.output = raw / 2.
+    def to_JSON_WWW_data(self,readingTime):
+        if self.output is not None:
+            return [{"sensor_id":self.sensorID,
+                     "type":"output",
+                     "value":self.output,
+                     "raw_data":self.output,
+                     "datetime":readingTime.isoformat()}]
+        else:
+            return []
+    def shortDesc(self):
+        return "UDC3500 get output cmd, addr: "+self.slaveAddr
+
 class Honeywell_UDC3500_setSP(EthModbusCmd):
     def __init__(self,sensorID,IPaddr,value):
         EthModbusCmd.__init__(self,sensorID,IPaddr)
         self.newSP = value
     def execute(self):
+        """Write the setpoint, raising if it wasn't, so the caller can report that to WWW."""
+        intSP = int(math.floor(self.newSP * 10.))
+        client = self.getClient()
         try:
-            intSP = int(math.floor(self.newSP * 10.))
-            client = self.getClient()
             rsp = client.write_register(0x0002,intSP)
-            client.close()
-        except Exception as e:
-            logging.error("UDC3500 getSP failed: "+str(e))
+        except Exception:
+            self.releaseClient(failed=True)
+            raise
+        self.releaseClient()
+        if rsp.isError():
+            raise Exception(self.shortDesc()+" refused: "+str(rsp))
     def to_JSON_WWW_data(self,readingTime):
         return []
     def shortDesc(self):
@@ -156,6 +371,12 @@ class Honeywell_UDC2500_getPV(Honeywell_UDC3500_getPV):
     def shortDesc(self):
         return "UDC2500 get PV cmd, addr: "+self.slaveAddr
 
+class Honeywell_UDC2500_getOutput(Honeywell_UDC3500_getOutput):
+    def __init__(self,sensorID,IPaddr):
+        Honeywell_UDC3500_getOutput.__init__(self,sensorID,IPaddr)
+    def shortDesc(self):
+        return "UDC2500 get output cmd, addr: "+self.slaveAddr
+
 class Honeywell_UDC2500_setSP(Honeywell_UDC3500_setSP):
     def __init__(self,sensorID,IPaddr,value):
         EthModbusCmd.__init__(self,sensorID,IPaddr)
@@ -15,13 +15,12 @@ import serial
 import struct
 import math
 import sys
-from crc_algorithms import Crc
+import crc
 import serialComm
 from EA_RCcmd import EA_RCcmd
 from EAMIDexception import EAMIDexception
 
 # TODO: fold some of this into a general MODBUS class
-# TODO: add CRC check when processing replies
 # TODO: add exceptions
 
 class FujiPXR4Cmd:
@@ -30,12 +29,9 @@ class FujiPXR4Cmd:
 		self.slaveAddy = slaveAddy
 		self.functionCode = functionCode
 		self.rplyFunctionCode = 0
-		self.crc = Crc(width=16,poly=0x8005,reflect_in=True,
-					   xor_in=0xFFFF,reflect_out=True,
-					   xor_out=0x0000)
 		
 	def performCRC(self,data):
-		return self.crc.bit_by_bit(data)
+		return crc.crc16Modbus(data)
 
 	def createPacket(self,doCRC=False):
 		buffer = struct.pack("B",self.slaveAddy)
@@ -48,6 +44,8 @@ class FujiPXR4Cmd:
 		startPos = rplyBuf.tell()
 		if len(rplyBuf.getvalue()) == 0:
 				raise serialComm.EmptyRplyError(self,rplyBuf.getvalue())
+		if not crc.modbusCRC_p(rplyBuf.getvalue()[startPos:]):
+			raise FujiPXR4RplyCRCError(self,rplyBuf.getvalue())
 		rplySlaveAddy = rplyBuf.read(1)
 		self.rplyFunctionCode = struct.unpack("B",rplyBuf.read(1))[0]
 		if self.rplyFunctionCode != self.functionCode:
@@ -55,7 +53,7 @@ class FujiPXR4Cmd:
 			raise FujiPXR4RplyFuncErorr(self,rplyBuf.getvalue())
 
 	def __str__(self):
-			return "slave addy: " + str(self.slaveAddy) + "\n" + "function code: " + str(self.functionCode) + "\n" + "rplyFunctionCode: " + str(self.rplyFunctionCode) + "\n" + "crc: " + str(self.crc)
+			return "slave addy: " + str(self.slaveAddy) + "\n" + "function code: " + str(self.functionCode) + "\n" + "rplyFunctionCode: " + str(self.rplyFunctionCode)
 
 class FujiPXR4ReadWordCmd(FujiPXR4Cmd):
 	"""blah blah blah"""
@@ -185,6 +183,11 @@ class FujiPXR4RplyFuncErorr(EAMIDexception):
 				self.cmd=cmd
 				self.rply=rply
 
+class FujiPXR4RplyCRCError(EAMIDexception):
+		def __init__(self,cmd,rply):
+				self.cmd=cmd
+				self.rply=rply
+
 class FujiPXR4WriteError(EAMIDexception):
 		def __init__(self,cmd):
 				self.cmd = cmd
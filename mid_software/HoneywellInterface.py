@@ -13,10 +13,10 @@
 #   limitations under the License.
 import serial
 import struct
-from crc_algorithms import Crc
+import crc
+from EAMIDexception import EAMIDexception
 
 # TODO: fold some of this into a general MODBUS class
-# TODO: add CRC check when processing replies
 
 class Honeywell3300ReadRegisterCmd:
 	"""Only class in this interface thus far.  We are only reading from these units."""
@@ -25,26 +25,24 @@ class Honeywell3300ReadRegisterCmd:
 		self.functionCode = functionCode
 		self.registerAddy = registerAddy
 		self.numRegisters = numRegisters
-		self.crc = Crc(width=16,poly=0x8005,reflect_in=True,
-					   xor_in=0xFFFF,reflect_out=True,
-					   xor_out=0x0000)
 		self.rplyBytes = 0
 		self.rplyData = list()	# list of 16 bit integer data
 
 	def performCRC(self,data):
-		return self.crc.bit_by_bit(data)
+		return crc.crc16Modbus(data)
 
 	def createPacket(self):
 		buffer = struct.pack("B",self.slaveAddy)
 		buffer += struct.pack("B",self.functionCode)
 		buffer += struct.pack("BB",self.registerAddy[0],self.registerAddy[1])
 		buffer += struct.pack(">H",self.numRegisters)
-		buffer += struct.pack(">H",self.performCRC(buffer))
+		buffer += struct.pack("<H",self.performCRC(buffer))
 		return buffer
 
 	def processReply(self,rplyBuf):
 		startPos = rplyBuf.tell()
-		
+		if not crc.modbusCRC_p(rplyBuf.getvalue()[startPos:]):
+			raise Honeywell3300RplyCRCError(self,rplyBuf.getvalue())
 		rplySaveAddy = ord(rplyBuf.read(1))
 		rplyFunctionCode = ord(rplyBuf.read(1))
 		# TODO: addy and function code
@@ -71,6 +69,11 @@ class Honeywell3300ReadSP_PVcmd(Honeywell3300ReadRegisterCmd):
 			str(self.getPV())+ ","+str(self.getSV()))
 
 
+class Honeywell3300RplyCRCError(EAMIDexception):
+	def __init__(self,cmd,rply):
+		self.cmd=cmd
+		self.rply=rply
+
 # Local Variables:
 # indent-tabs-mode: t
 # python-indent: 4
@@ -17,9 +17,11 @@ import FujiInterface
 import hubComm
 import WWWcomm
 import EthModbusComm
+import backlogStore
+import devicePoller
+import metrics
 # 3rd party modules
 import serialComm
-import restkit
 from daemon import Daemon
 import pytz
 # std lib modules
@@ -37,7 +39,12 @@ import DMMCCmd
 
 CONFIG_LOC = '../MID.cfg'
 LAST_WWW_CONFIG_LOC = 'MID_WWW'
+# pickled readings left by older versions, moved into the backlog on start
 DATA_BACKUP_LOC = "DATA_BAK"
+DATA_BACKLOG_LOC = "DATA_BACKLOG"
+# replay the backlog this many readings at a time, for at most this long per cycle
+BACKLOG_REPLAY_BATCH = 50
+BACKLOG_REPLAY_SECONDS = 60
 
 class MyDaemon(Daemon):
 	def run(self):
@@ -47,7 +54,6 @@ class MyDaemon(Daemon):
 			lastWWWcfgDateTime = None
 			lastReadingDateTime = None
 			lastUploadDateTime = None
-			errorState = False
 			log_level = logging.INFO
 
 			# load configuration
@@ -66,10 +72,13 @@ class MyDaemon(Daemon):
 			logging.basicConfig(filename='./MID.log', level=log_level, format='%(asctime)s %(message)s')
 
 			# read last WWW configuration saved to disk
+			WWWcfg = None
 			try:
 				WWWcfg = readLatestWWWcfg()
 			except:
 				logging.warning("No WWW config found at " + LAST_WWW_CONFIG_LOC + ".")
+			# hub commands are only rebuilt when the WWW config changes
+			cmdPlan = hubComm.CommandPlan(WWWcfg)
 
 			# establish sensor hub connection
 			try:
@@ -85,14 +94,42 @@ class MyDaemon(Daemon):
 				logging.critical(str(e))
 				raise
 
+			# schedule hub commands by port
+			hubPipelineDepth = 1
+			if config.has_option("MID","hub_pipeline_depth"):
+				hubPipelineDepth = config.getint("MID","hub_pipeline_depth")
+			hubPoller = hubComm.HubPoller(hubCon,hubPipelineDepth)
+
+			# Ethernet devices are polled in parallel, alongside the hub
+			ethWorkers = 8
+			if config.has_option("MID","eth_workers"):
+				ethWorkers = config.getint("MID","eth_workers")
+			ethPoller = devicePoller.DevicePoller(ethWorkers)
+			# cycle timings, written to metrics_file if it is set
+			metricsFile = None
+			if config.has_option("MID","metrics_file"):
+				metricsFile = config.get("MID","metrics_file")
+				metrics.configure(True)
+			# RS485 bus, opened once it is configured
+			rs485Bus = None
+
 			# establish WWW connection
 			WWWcon = createWWWcon(config)
 
+			# readings waiting to be uploaded
+			backlogMaxBytes = 256*1024*1024
+			if config.has_option("MID","backlog_max_mb"):
+				backlogMaxBytes = config.getint("MID","backlog_max_mb")*1024*1024
+			backlog = backlogStore.BacklogStore(DATA_BACKLOG_LOC,maxBytes=backlogMaxBytes)
+			if os.path.exists(DATA_BACKUP_LOC):
+				importStoredData(backlog)
+
 			# 
 			# THE MAIN LOOP
 			# 
 			while(True):
 				readingStartTime = datetime.datetime.now()
+				cycleStartTime = time.time()
 				# 
 				# reload local configuration
 				# 
@@ -105,11 +142,13 @@ class MyDaemon(Daemon):
 					# update config from WWW
 					# 
 					try:
-						newWWWcfg = WWWcon.getConfig()
+						with metrics.span("config"):
+							newWWWcfg = WWWcon.getConfig()
 						if newWWWcfg:
 							# website config updates occured
 							WWWcfg = newWWWcfg; logging.debug(str(WWWcfg));
 							logging.info("WWW cfg file received.")
+							cmdPlan.setConfig(WWWcfg)
 							lastWWWcfgDateTime = time.time()
 							# write new cfg to file
 							try:
@@ -126,60 +165,41 @@ class MyDaemon(Daemon):
 					# buid commands from JSON
 					allCmds=[]
 					try:
-						logging.info("Creating commands from JSON received from WWW.")
-						allCmds = hubComm.allCmdsFromJSON(WWWcfg)
+						with metrics.span("hub.commands"):
+							allCmds = cmdPlan.commands()
 					except Exception as e:
 						logging.error("Error occured while creating commands: "+str(e))
+					# start Ethernet device I/O, it runs while the hub is polled
+					ethCmds = ([],[],[])
+					try:
+						with metrics.span("eth.start"):
+							ethCmds = startEthCommands(WWWcfg,config,ethPoller)
+					except Exception as e:
+						logging.error("Error occured while creating Ethernet device commands: "+str(e))
 					# process commands and record errors
-					allErrs = []		# storage place for all errors 
-					for cmdi,cmd in enumerate(allCmds):
-						try:
-							logging.info("Processing command "+
-										 str(cmdi+1)+" of "+str(len(allCmds))+"...")
-							allErrs += [hubCon.processCommand(cmd)]
-						except hubComm.BadHubReplyError:
-							logging.warning("Bad hub reply, reporting error to WWW for all sensors in cmd.")
-							# report error for all sensor IDs, will be the only one reported
-							allErrs += [hubPackets.HubErrorResponse()]
-							allErrs[-1].addParseErrors(cmd.getSensorIDs())
-							# clean up communications
-							hubCon.clearComm()
-						except hubPackets.HubTimeoutError:
-							logging.warning("Timed out waiting for hub reply, reporting error to WWW for all sensors in cmd.")
-							# report error for all sensor IDs, it will be the only one reported
-							allErrs += [hubPackets.HubErrorResponse()]
-							allErrs[-1].addTimeoutError(cmd.getSensorIDs())
-							# clean up communications
-							hubCon.clearComm()
-						# log command
-						# logging.debug(str(cmd))
+					logging.info("Processing "+str(len(allCmds))+" hub commands...")
+					with metrics.span("hub"):
+						allErrs = [errorResp for (cmd,errorResp) in hubPoller.run(allCmds)]
+					logging.info("Hub time per port: "+hubPoller.portTimesStr())
+					logging.debug("Hub reply latency: "+hubCon.latency.statsStr())
 
 					# 
-					# create and process commands for Ethernet devices
+					# collect the Ethernet device commands
 					# 
-					successfulEthCmds = processEthCommands(WWWcfg,config,WWWcon)
-					allCmds += successfulEthCmds
+					with metrics.span("eth.wait"):
+						allCmds += finishEthCommands(ethPoller,ethCmds,WWWcon)
 					# 
 					# create and process read commands for RS485 devices
 					# 
-					# TODO: FIX THIS!!!
-					successfulRS485Cmds = processRS485Commands(WWWcfg,config,WWWcon)
+					if rs485Bus is None and config.has_option("MID","RS485_PORT"):
+						rs485Bus = openRS485Bus(config)
+					with metrics.span("rs485"):
+						successfulRS485Cmds = processRS485Commands(WWWcfg,rs485Bus,WWWcon)
 					allCmds += successfulRS485Cmds
-					# 
-					# handle the special case AB EtherNet/IP hack
-					# 
-					try:
-						logging.info("Attempting the A-B VFD hack.")
-						AB_VFDs = VFDinterface.ABinterfaceFactory(WWWcfg)
-						for i in AB_VFDs:
-							i.update()
-						allCmds.extend(AB_VFDs)
-					except Exception as e:
-						logging.error("Error occured while reading the AB VFD parameters:"+str(e))
-
 
 					try:
-						dmcmds = DMMCCmd.processDMMCCommands(WWWcfg["commandInfo"])
+						with metrics.span("dryermaster"):
+							dmcmds = DMMCCmd.processDMMCCommands(WWWcfg["commandInfo"])
 						allCmds += dmcmds
 						logging.info('Read from DryerMaster: '+str(len(dmcmds)))
 					except Exception as e:
@@ -191,38 +211,46 @@ class MyDaemon(Daemon):
 					# 
 					# send data to WWW
 					# 
+					readingTime = datetime.datetime.now(pytz.utc)
+					readingData = None
 					try:
 						midPasswd = config.get("MID","MIDpassword")
-						WWWcon.uploadReading(midPasswd,datetime.datetime.now(pytz.utc),allCmds,allErrs)
+						with metrics.span("json"):
+							readingData = WWWcomm.readingData(readingTime,allCmds)
+						with metrics.span("upload"):
+							WWWcon.uploadReadingData(midPasswd,readingTime.isoformat(),readingData)
 						logging.info("SUCCESSFULLY UPLOADED DATA")
 						lastUploadDateTime = time.time()
-						if errorState:
+						if not backlog.empty_p():
 							try:
-								# send all readings stored in backup file
-								postStoredData(WWWcon)
-								logging.info("SUCCESSFULLY UPLOADED STORED DATA")
-								# purge data backup file
-								purgeStoredData()
-								# indicate error state is over
-								errorState = False
+								# send readings stored while cut off, a batch at a time
+								with metrics.span("backlog"):
+									n = postStoredData(WWWcon,backlog,midPasswd)
+								logging.info("SUCCESSFULLY UPLOADED "+str(n)+" STORED READINGS")
 							except Exception as e:
-								logging.critical("An error occured while trying to upload data from error state: "+str(e))
+								logging.critical("An error occured while trying to upload stored readings: "+str(e))
 					except Exception as e:
 						logging.error("Error occured while uploading results to server: "+str(e))
-						# indicate MID is cut off from WWW server
-						errorState = True
-						# save latest reading to backup file
-						try:
-							storeReading(allCmds,DATA_BACKUP_LOC)
-						except:
-							logging.error("Cannot write to backup data location.")
+						# save latest reading to the backlog
+						if readingData is not None:
+							try:
+								backlog.append(readingTime,readingData)
+							except Exception as e:
+								logging.error("Cannot write to backlog data location: "+str(e))
 						# re-instantiate WWW
+						WWWcon.close()
 						WWWcon = createWWWcon(config)
 					# TODO:send errors to WWW
 					lastRun=time.time()
 					# store raw data if instructed to do so
 					if config.getboolean("MID","STORE_RAW_DATA_MODE"):
 						storeReading(allCmds,config.get("MID","RAW_DATA_LOC"))
+					metrics.record("cycle",time.time() - cycleStartTime)
+					if metricsFile is not None:
+						try:
+							metrics.METRICS.write(metricsFile)
+						except Exception as e:
+							logging.error("Cannot write metrics to "+metricsFile+": "+str(e))
 				else:
 					logging.info("Turn off flag set to TRUE")
 				# END BLOCK FOR TURN-OFF FLAG CHECK
@@ -253,12 +281,16 @@ def createWWWcon(config):
 		MIDname = config.get("MID","MIDname")
 	except:
 		MIDname = None
+	bulkUploadPath = None
+	if config.has_option("MID","bulkuploadpath"):
+		bulkUploadPath = config.get("MID","bulkuploadpath")
 	return WWWcomm.WWWcomm(config.get("MID","MIDpassword"),
 						   config.get("MID","configpath"),
 						   config.get("MID","baseurl"),
 						   config.get("MID","uploadpath"),
 						   config.get("MID","RCstatusPath"),
-						   MIDname)
+						   MIDname,
+						   bulkUploadPath)
 
 def storeReading(allCmds,fileLoc):
 	if os.path.exists(fileLoc):
@@ -268,30 +300,76 @@ def storeReading(allCmds,fileLoc):
 	cPickle.dump([datetime.datetime.now(pytz.utc),allCmds],theFile)
 	theFile.close()
 
-def postStoredData(WWWcon):
+def postStoredData(WWWcon,backlog,passwd,batchSize=BACKLOG_REPLAY_BATCH,maxSeconds=BACKLOG_REPLAY_SECONDS):
+	"""
+	Upload backlog readings, oldest first, batchSize at a time until the
+	backlog is empty or maxSeconds have passed.  Returns the number
+	uploaded.  Each batch goes up in one bulk request if WWWcon has a bulk
+	upload path, otherwise a reading at a time.  Each batch is acknowledged
+	once it is up, and on a failure whatever made it up is acknowledged so
+	only the rest stays queued.
+	"""
+	startTime = time.time()
+	n = 0
+	while time.time() - startTime < maxSeconds:
+		(readings,position) = backlog.readBatch(batchSize)
+		if position == backlog.acked:
+			break
+		if not readings:
+			# only unreadable readings, nothing to upload
+			backlog.ack(position)
+			continue
+		if WWWcon.bulkUploadPath:
+			WWWcon.uploadReadingsBulk(passwd,[(readingTimeStr,data) for (readingTimeStr,data,readingEnd) in readings])
+			backlog.ack(position)
+			n += len(readings)
+			continue
+		uploaded = None
+		try:
+			for (readingTimeStr,data,readingEnd) in readings:
+				WWWcon.uploadReadingData(passwd,readingTimeStr,data)
+				uploaded = readingEnd
+				n += 1
+		except:
+			# acknowledge what made it up before the failure
+			if uploaded is not None:
+				backlog.ack(uploaded)
+			raise
+		backlog.ack(position)
+	return n
+
+def importStoredData(backlog):
+	"""Move readings pickled to DATA_BACKUP_LOC by older versions into backlog."""
 	try:
 		theFile = gzip.open(DATA_BACKUP_LOC,"rb")
 	except:
 		logging.error("Data backup file could not be opened.")
-		raise
+		return
+	n = 0
 	while True:
 		try:
-			allCmds = cPickle.load(theFile)
-			WWWcon.uploadData(allCmds[1],allCmds[0])
-			# TODO: examine response code for success indicator
+			(readingTime,allCmds) = cPickle.load(theFile)
+			backlog.append(readingTime,WWWcomm.readingData(readingTime,allCmds))
+			n += 1
 		except EOFError:
 			break						# we have reached the end of the file
 		except Exception as e:
-			logging.critical("Another error.  This time while sending data stored during a previous error.  I am exasperated!"+str(e))
+			logging.error("Giving up on the rest of the data backup file: "+str(e))
+			break
 	theFile.close()
-
-def purgeStoredData():
+	backlog.sync()
+	logging.info("Moved "+str(n)+" readings from "+DATA_BACKUP_LOC+" to the backlog.")
 	try:
 		os.remove(DATA_BACKUP_LOC)
 	except:
 		print >> sys.stderr, "I confess to almighty God and to you, my brother or sister, that I have failed to delete the file of stored data."
 
-def processEthCommands(WWWcfg,localConfig,WWWcon):
+def startEthCommands(WWWcfg,localConfig,ethPoller):
+	"""
+	Create the commands for Ethernet devices, Modbus controllers and the
+	A-B VFD hack, and start them on ethPoller, one task per device.
+	Returns (RCcmds,ROcmds,AB_VFDs) for finishEthCommands.
+	"""
 	RCcmds = [];ROcmds = []
 	# create RC cmds
 	RCcmds = [EthModbusComm.factory(cmd["device_type_id"],
@@ -310,25 +388,64 @@ def processEthCommands(WWWcfg,localConfig,WWWcon):
 	logging.info("Created "+str(len(ROcmds))+" RO Eth cmds.")
 	for roc in ROcmds:
 		logging.info(roc.shortDesc())
-	# execute commands
-	for rc in RCcmds:
-		rc.execute()
+	# handle the special case AB EtherNet/IP hack
+	AB_VFDs = []
+	try:
+		AB_VFDs = VFDinterface.ABinterfaceFactory(WWWcfg)
+		logging.info("Attempting the A-B VFD hack with "+str(len(AB_VFDs))+" VFDs.")
+	except Exception as e:
+		logging.error("Error occured while creating the AB VFD interfaces:"+str(e))
+	# per controller, RC cmds first then the RO reads
+	for IPaddr in set([cmd.slaveAddr for cmd in RCcmds + ROcmds]):
+		calls = [rc.execute for rc in RCcmds if rc.slaveAddr == IPaddr]
+		reads = [ro for ro in ROcmds if ro.slaveAddr == IPaddr]
+		calls.append(lambda reads=reads: EthModbusComm.executeCmds(reads))
+		ethPoller.start(IPaddr,calls,"eth.modbus")
+	for vfd in AB_VFDs:
+		ethPoller.start(vfd.VFD_IP,[vfd.update],"eth.ab_vfd")
+	return (RCcmds,ROcmds,AB_VFDs)
+
+def finishEthCommands(ethPoller,ethCmds,WWWcon):
+	"""
+	Wait for the commands from startEthCommands, report RC command statuses
+	to WWW and return the RO commands and VFDs that were read.
+	"""
+	(RCcmds,ROcmds,AB_VFDs) = ethCmds
+	tasks = ethPoller.wait()
+	ok = set([task.device for task in tasks if task.ok_p()])
+	# a failed RC cmd doesn't spoil the reads that follow it
+	finished = set([task.device for task in tasks if task.done_p and not task.timedOut_p])
+	EthModbusComm.POOL.evictIdle()
 	# report RC command statuses to WWW
 	for rc in RCcmds:
 		try:
-			WWWcon.RC_cmd_status(rc.sensorID,True)
+			WWWcon.RC_cmd_status(rc.sensorID,int(rc.slaveAddr in ok))
 		except Exception as e:
 			logging.error("Failed to report status of RC command: " + rc.shortDesc() + "\n" + str(e))
-	for ro in ROcmds:
-		ro.execute()
-		# time.sleep(5)
 	# return list of RO commands
-	return ROcmds
+	return [ro for ro in ROcmds if ro.slaveAddr in finished] + [vfd for vfd in AB_VFDs if vfd.VFD_IP in ok]
 
-def processRS485Commands(WWWcfg,localConfig,WWWcon):
+def openRS485Bus(localConfig):
+	"""The RS485 bus described by localConfig, or None if it cannot be opened."""
+	parity = serialComm.serial.PARITY_ODD
+	if localConfig.has_option("MID","RS485_PARITY"):
+		parity = localConfig.get("MID","RS485_PARITY")[0].upper()
+	baudrate = 9600
+	if localConfig.has_option("MID","RS485_BAUD"):
+		baudrate = localConfig.getint("MID","RS485_BAUD")
+	timeout = 5
+	if localConfig.has_option("MID","RS485_TIMEOUT"):
+		timeout = localConfig.getfloat("MID","RS485_TIMEOUT")
+	try:
+		return serialComm.SerialComm(port=localConfig.get("MID","RS485_PORT"),
+									 baudrate=baudrate,parity=parity,timeout=timeout)
+	except Exception as e:
+		logging.error("Unable to open RS485 port: "+str(e))
+		return None
+
+def processRS485Commands(WWWcfg,rs485Bus,WWWcon):
 		allRS485Cmds = []
 		successfulCmds = []
-		# put RC cmds in front of queue
 		for dev in WWWcfg["RC"]:
 			if not EthModbusComm.check(dev["device_type_id"],dev["sensor_type_id"]): # if not ETH, must be RS485
 				allRS485Cmds += [serialComm.cmdFactory(dev["device_type_id"],
@@ -343,32 +460,18 @@ def processRS485Commands(WWWcfg,localConfig,WWWcon):
 													   dev["type"],
 													   dev["sensor_id"],
 													   dev["addy"])]
-		# process RS485 commands
-		if localConfig.has_option("MID", "RS485_PORT"):
-			sc = serialComm.SerialComm(port=localConfig.get("MID","RS485_PORT"))
-			for cmd in allRS485Cmds:
-				try:
-						sc.processCommand(cmd)
-						# if RC cmd, inform web server and don't save the cmd
-						if isinstance(cmd,FujiInterface.FujiPXR4SetSVCmd):
-								try:
-									WWWcon.RC_cmd_status(cmd.ctl_id,1)
-								except WWWcomm.MID_RCstatusError:
-									logging.error("RC status error")
-									pass
-						else:
-								successfulCmds += [cmd]
-				except:
-						# todo: write exception info to log file
-						# if RC cmd, inform web server and don't save the cmd
-						if isinstance(cmd,FujiInterface.FujiPXR4SetSVCmd):
-								try:
-										WWWcon.RC_cmd_status(cmd.ctl_id,0)
-								except WWWcomm.MID_RCstatusError:
-										# todo: log this event
-										pass
-			# done, close serial connection
-			sc.closeSer()
+		allRS485Cmds = [cmd for cmd in allRS485Cmds if cmd is not None]
+		# process RS485 commands, the bus puts RC cmds in front of the queue
+		if rs485Bus is not None:
+			for (cmd,error) in rs485Bus.runCmds(allRS485Cmds):
+				# if RC cmd, inform web server and don't save the cmd
+				if isinstance(cmd,FujiInterface.FujiPXR4SetSVCmd):
+					try:
+						WWWcon.RC_cmd_status(cmd.ctl_id,int(error is None))
+					except WWWcomm.MID_RCstatusError:
+						logging.error("RC status error")
+				elif error is None:
+					successfulCmds += [cmd]
 		return successfulCmds
 
 # Local Variables:
@@ -14,8 +14,8 @@
 # EA modules
 import WWWcomm
 import EthModbusComm
+import devicePoller
 # 3rd party modules
-import restkit
 from daemon import Daemon
 import pytz
 # std lib modules
@@ -80,6 +80,8 @@ class MyDaemon(Daemon):
 									 MIDname)
 			# get Eth subnet
 			ethSubnet = config.get("HONEYWELL_TEMP_CTRL","eth_subnet")
+			# controllers are talked to in parallel
+			ethPoller = devicePoller.DevicePoller()
 
 			# 
 			# THE MAIN LOOP
@@ -160,24 +162,22 @@ class MyDaemon(Daemon):
 								ROcmds += [EthModbusComm.Honeywell_UDC3500_getPV(rost[0],
 																				 ethSubnet+"."+str(rost[3]))]
 					# 
-					# process all RC cmds and send status updates
+					# process all RC then RO cmds, each controller on its own
+					# 
+					for IPaddr in set([cmd.slaveAddr for cmd in RCcmds + ROcmds]):
+						calls = [rcc.execute for rcc in RCcmds if rcc.slaveAddr == IPaddr]
+						reads = [roc for roc in ROcmds if roc.slaveAddr == IPaddr]
+						calls.append(lambda reads=reads: EthModbusComm.executeCmds(reads))
+						ethPoller.start(IPaddr,calls)
+					ok = set([task.device for task in ethPoller.wait() if task.ok_p()])
+					# 
+					# send RC status updates
 					# 
 					for rcc in RCcmds:
 						try:
-							logging.debug("Executing RC cmd: "+rcc.shortDesc())
-							rcc.execute()
-							WWWcon.RC_cmd_status(rcc.sensorID,True)
+							WWWcon.RC_cmd_status(rcc.sensorID,int(rcc.slaveAddr in ok))
 						except Exception as e:
-							logging.error("Unable to process RC cmd: "+rcc.shortDesc())
-							# TODO: try a few more times before giving up
-							WWWcon.RC_cmd_status(rcc.sensorID,False)
-						time.sleep(4.)
-					# 
-					# process all RO cmds
-					# 
-					for roc in ROcmds:
-						roc.execute()
-						time.sleep(2.) # TODO: is there a way to remove this?
+							logging.error("Unable to report status of RC cmd: "+rcc.shortDesc())
 					# 
 					# send data to WWW
 					# 
@@ -277,12 +277,17 @@ def processEthCommands(WWWcfg,localConfig,WWWcon):
 	for roc in ROcmds:
 		logging.info(roc.shortDesc())
 	# execute commands
+	failed = set()
 	for rc in RCcmds:
-		rc.execute()
+		try:
+			rc.execute()
+		except Exception as e:
+			logging.error("RC command failed: " + rc.shortDesc() + "\n" + str(e))
+			failed.add(rc)
 	# report RC command statuses to WWW
 	for rc in RCcmds:
 		try:
-			WWWcon.RC_cmd_status(rc.sensorID,True)
+			WWWcon.RC_cmd_status(rc.sensorID,int(rc not in failed))
 		except Exception as e:
 			logging.error("Failed to report status of RC command: " + rc.shortDesc() + "\n" + str(e))
 	for ro in ROcmds:
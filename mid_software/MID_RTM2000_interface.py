@@ -102,8 +102,10 @@ class MyDaemon(Daemon):
                 RTMcmds = RTMcmd.createCommands(WWWcfg["commandInfo"],
                                                 config.get("MID","RS485_PORT"),
                                                 logging)
-                for cmd in RTMcmds:
-                    cmd._readTemps()
+                # one pass over the bus, port opened once
+                RTMbus = RTMcmd.RTM2000Bus(config.get("MID","RS485_PORT"),logging=logging)
+                nFailed = RTMbus.readAll(RTMcmds)
+                logging.info("Read "+str(len(RTMcmds)-nFailed)+" of "+str(len(RTMcmds))+" RTM2000 boards")
                 # END READ FROM RTM2000
                 # ##################################################
                 # ##################################################
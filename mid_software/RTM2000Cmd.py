@@ -11,125 +11,147 @@
 #   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
-import serial, struct, StringIO, json
-from conversion import evalConversion
+import serial, struct, json
+from EAMIDexception import EAMIDexception
 
 BOARD_NUMBERS = range(1,9)
+# reply: start char, slave addr, 't', board number, 65 temperatures (0.1K), checksum, CR
+N_TEMPS = 64+1
+RPLY_HEADER_SIZE = 4
+RPLY_SIZE = RPLY_HEADER_SIZE + 2*N_TEMPS + 2
+TEMPS_FORMAT = "<%dH" % N_TEMPS
 
 def createCommands(JSON,serialPort,logging):
-        RTM2000_json = filter(lambda x: x["type"]=="rtm2000",JSON)
-        #
-        # grab unique slave addresses
-        #
-        try:
-                uniqueSlaveAddrs = list(set([json.loads(x["device_name"])["slaveAddr"] for x in RTM2000_json]))
-        except Exception as e:
-                logging.error("Problem when parsing JSON for a RTM2000 temperature point!")
-                logging.error(str(e))
-        #
-        # for each slave addr and board number, grab all positions (keep in JSON)
-        # make RTM2000Cmd objects
-        # 
-        RTM2000Cmds = []
-        for slaveAddr in uniqueSlaveAddrs:
-                for boardNum in BOARD_NUMBERS:
-                        def testIncl(y,x):
-                                jsonx = json.loads(x["device_name"])
-                                if jsonx["slaveAddr"] == slaveAddr and jsonx["boardNum"] == boardNum:
-                                        return y+[(x["sensor_id"],jsonx["position"])]
-                                else:
-                                        return y
-                        sensorID_position_pairs = reduce(testIncl, RTM2000_json,[])
-                        # make RTM2000Cmd objects
-                        if sensorID_position_pairs:
-                                RTM2000Cmds += [RTM2000Cmd([spp[0] for spp in sensorID_position_pairs],
-                                                           slaveAddr,
-                                                           boardNum,
-                                                           [spp[1] for spp in sensorID_position_pairs],
-                                                           serialPort,
-                                                           logging)]
-        return RTM2000Cmds
+	"""One RTM2000Cmd per slave address and board number with points in JSON, in that order."""
+	points = {}		# (slaveAddr,boardNum) -> [(sensorID,position)]
+	for x in JSON:
+		if x["type"] != "rtm2000":
+			continue
+		try:
+			jsonx = json.loads(x["device_name"])
+			key = (jsonx["slaveAddr"],jsonx["boardNum"])
+			point = (x["sensor_id"],jsonx["position"])
+		except Exception as e:
+			logging.error("Problem when parsing JSON for a RTM2000 temperature point!")
+			logging.error(str(e))
+			continue
+		if key[1] in BOARD_NUMBERS:
+			points.setdefault(key,[]).append(point)
+	return [RTM2000Cmd([spp[0] for spp in pairs],
+					   slaveAddr,
+					   boardNum,
+					   [spp[1] for spp in pairs],
+					   serialPort,
+					   logging) for ((slaveAddr,boardNum),pairs) in sorted(points.items())]
+
+def checksum(data):
+	"""Low byte of the sum of data's bytes."""
+	return sum(bytearray(data)) & 0xFF
+
+class RTM2000Bus:
+	"""
+	The RS485 port to the RTM2000s, opened once per cycle by readAll, which
+	sends every command's request in turn and hands it its reply.  Replies
+	are checked for the slave address, board number and CR terminator, and
+	for the checksum if verifyChecksum (the units we have are set, with DIP
+	switch 6, to ignore request checksums and the reply's is unverified).
+	"""
+	def __init__(self,serialPort="/dev/ttyUSB0",timeout=5,verifyChecksum=False,logging=None,serialDevice=None):
+		self.serialPort = serialPort
+		self.timeout = timeout
+		self.verifyChecksum = verifyChecksum
+		self.logging = logging
+		self.serialDevice = serialDevice
+
+	def open(self):
+		if self.serialDevice is not None:
+			return self.serialDevice
+		return serial.Serial(port=self.serialPort,
+							 parity=serial.PARITY_NONE,
+							 baudrate=9600,
+							 stopbits=serial.STOPBITS_ONE,
+							 timeout=self.timeout)
+
+	def readAll(self,cmds):
+		"""Read the temperatures for every command in cmds.  Returns the number that failed."""
+		ser = self.open()
+		nFailed = 0
+		try:
+			for cmd in cmds:
+				ser.flushInput()
+				ser.write(cmd.makeRequest())
+				try:
+					cmd.processReply(ser.read(RPLY_SIZE),self.verifyChecksum)
+				except RTM2000RplyError as e:
+					nFailed += 1
+					if self.logging:
+						self.logging.error("Bad reply from RTM2000 slave %d board %d: %s" % (cmd.slaveAddr,cmd.boardNum,str(e)))
+		finally:
+			if self.serialDevice is None:
+				ser.close()
+		return nFailed
 
 class RTM2000Cmd:
 	def __init__(self, sensorIDs=None, slaveAddr=0, boardNum=2, positions=None, serialPort="/dev/ttyUSB0", logging=None):
-	        self.sensorIDs = sensorIDs
+		self.sensorIDs = sensorIDs
 		self.slaveAddr = slaveAddr
 		self.boardNum = boardNum
-                self.positions = positions
-                self.serialPort = serialPort
-                self.K_all = []
-                self.F_all = []
+		self.positions = positions
+		self.serialPort = serialPort
+		self.K_all = []
+		self.F_all = []
 		self.error = False
-                self.logging = logging
+		self.logging = logging
 
-        def _makeMODBUSCmd(self):
-                buffer = struct.pack("B",ord("$"))
-                buffer += struct.pack("B",self.slaveAddr)
-                buffer += struct.pack("B",ord("t"))
-                buffer += struct.pack("B",self.boardNum)
-                buffer += struct.pack("B",0x66) # checksum is ignored b/c of DIP switch 6 setting
-                buffer += struct.pack("B",ord("\r"))
-                return buffer
+	def makeRequest(self):
+		# checksum is ignored b/c of DIP switch 6 setting
+		return struct.pack("BBBBBB",ord("$"),self.slaveAddr,ord("t"),self.boardNum,0x66,ord("\r"))
+
+	def processReply(self,rply,verifyChecksum=False):
+		"""Decode rply, the whole reply frame, into K_all and F_all for positions."""
+		self.K_all = []; self.F_all = []
+		self.error = True
+		if len(rply) != RPLY_SIZE:
+			raise RTM2000RplyError("got "+str(len(rply))+"B of "+str(RPLY_SIZE)+"B reply")
+		(addr,cmdChr,board) = struct.unpack_from("BcB",rply,1)
+		if addr != self.slaveAddr or board != self.boardNum or cmdChr != "t":
+			raise RTM2000RplyError("reply is for slave %d board %d" % (addr,board))
+		if rply[-1] != "\r":
+			raise RTM2000RplyError("no CR terminator")
+		if verifyChecksum and checksum(rply[:-2]) != ord(rply[-2]):
+			raise RTM2000RplyError("bad checksum")
+		temps = struct.unpack_from(TEMPS_FORMAT,rply,RPLY_HEADER_SIZE)
+		self.K_all = [temps[pos] for pos in self.positions]
+		self.F_all = [1.8 * (float(K)/10.-273.2) + 32. for K in self.K_all]
+		self.error = False
 
-        def _readMODBUSRply(self,ser):
-                tmp_K_all = []
-                rplyVal = []
-                rplyBuf = StringIO.StringIO(ser.read(136))
-                self.logging.info("data recieved from RTM2000 (or timed out)")
-                asciiChr = rplyBuf.read(1)
-                ret_id = struct.unpack("B",rplyBuf.read(1))
-                ret_cmd = rplyBuf.read(1)
-                board_id = struct.unpack("B",rplyBuf.read(1))
-                self.logging.debug("Beginning info from RTM2000: "+asciiChr+","+str(ret_id)+","+str(ret_cmd)+","+str(board_id))
-                self.logging.info("reading temperatures from RTM2000")
-                for tempi in range(64+1):
-                    K = struct.unpack("<H",rplyBuf.read(2))[0]
-                    # C = float(K)/10.-273.2
-                    # F = 1.8 * C + 32.
-                    # self.logging.debug(str(tempi)+" "+str(K)+" "+str(C)+" "+str(F))
-                    tmp_K_all += [K]
-                CC = struct.unpack("B",rplyBuf.read(1))
-                CR = struct.unpack("B",rplyBuf.read(1))
-                self.logging.debug("end of response: "+str(CC)+" "+str(CR))
-                self.logging.info("Finished reading RTM2000 temperatures")
-                return (tmp_K_all)
-                
 	def _readTemps(self):
-                ser = serial.Serial(port=self.serialPort,
-                                    parity=serial.PARITY_NONE,
-                                    baudrate=9600,
-                                    stopbits=serial.STOPBITS_ONE,
-                                    timeout=30)
-                self.logging.debug("serial connection created")
-                self.logging.debug(("%02x" % self.slaveAddr) + ("%02x" % self.boardNum))
-                buffer = self._makeMODBUSCmd()
-                ser.write(buffer)
-                self.logging.info("command sent to RTM2000")
-                try:
-                        tmp_K_all = self._readMODBUSRply(ser)
-                except Exception as e:
-                        self.logging.error("Exception occured while reading from RTM2000: "+str(e))
-                self.logging.info("copying values to object variables")
-                self.K_all = []; self.F_all = [];
-                for pos in self.positions:
-                        K = tmp_K_all[pos]
-                        C = float(K)/10.-273.2
-                        F = 1.8 * C + 32.
-                        self.K_all += [K]
-                        self.F_all += [F]
-                ser.close()
+		"""Read this command on its own."""
+		RTM2000Bus(self.serialPort,logging=self.logging).readAll([self])
 
 	def to_JSON_WWW_data(self, readingTime):
 		return [{"sensor_id": sid,
-			 "type": 'rtm2000',
-			 "value": F,
-			 "raw_data": K,
-			 "datetime": readingTime.isoformat()} for (sid,F,K) in zip(self.sensorIDs,
-                                                                                   self.F_all,
-                                                                                   self.K_all)]
-        def __str__(self):
-                return "RTM2000 cmd\n==============\nslave addr: %i \nboard number: %i" % (self.slaveAddr,self.boardNum)+\
-                        "\nsensorIDs: "+str(self.sensorIDs) +\
-                        "\npositions: "+str(self.positions) +\
-                        "\nraw: "+str(self.K_all)+\
-                        "\neng: "+str(self.F_all)
+				 "type": 'rtm2000',
+				 "value": F,
+				 "raw_data": K,
+				 "datetime": readingTime.isoformat()} for (sid,F,K) in zip(self.sensorIDs,
+																		   self.F_all,
+																		   self.K_all)]
+	def __str__(self):
+		return "RTM2000 cmd\n==============\nslave addr: %i \nboard number: %i" % (self.slaveAddr,self.boardNum)+\
+			"\nsensorIDs: "+str(self.sensorIDs) +\
+			"\npositions: "+str(self.positions) +\
+			"\nraw: "+str(self.K_all)+\
+			"\neng: "+str(self.F_all)
+
+class RTM2000RplyError(EAMIDexception):
+	def __init__(self,message):
+		self.message = message
+	def __str__(self):
+		return self.message
+
+# Local Variables:
+# indent-tabs-mode: t
+# python-indent: 4
+# tab-width: 4
+# End:
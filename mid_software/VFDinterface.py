@@ -16,6 +16,9 @@ import serial
 # import standard lib modules
 import struct
 import httplib
+import socket
+import re
+import threading
 from types import NoneType
 
 class VFDinterface():
@@ -203,8 +206,9 @@ class AllenBradleyP70VFD(VFDinterface):
 	DEVICE_TYPE = 14
 	LAN_PSEUDO_PORT = 0
 
-	def __init__(self,IPaddy,sensorIDs,URL="diagnostics_5.html",HzTagName="Datalink A1 Out",AmpsTagName="Datalink A2 Out",RPMsTagName="Datalink A3 Out",RPMfeedbackTagName="Datalink A4 Out"):
+	def __init__(self,IPaddy,sensorIDs,URL="diagnostics_5.html",HzTagName="Datalink A1 Out",AmpsTagName="Datalink A2 Out",RPMsTagName="Datalink A3 Out",RPMfeedbackTagName="Datalink A4 Out",timeout=10.0):
 		VFDinterface.__init__(self,sensorIDs)
+		self.timeout = timeout
 		self.VFD_IP = IPaddy
 		self.VFD_URL = URL
 		self.HzTagName = HzTagName
@@ -225,16 +229,175 @@ class AllenBradleyP70VFD(VFDinterface):
 
 	def scrapeHTML(self):
 		""" A-B sucks """
-		# obtain HTML from VFD webpage
-		httpC=httplib.HTTPConnection(self.VFD_IP)
-		httpC.request("GET","/" + self.VFD_URL)
-		httpR = httpC.getresponse()
-
-		theDoc=httpR.read()
-		self._Hz = int(self.getTDValue(theDoc, self.HzTagName))
-		self._Amps = int(self.getTDValue(theDoc, self.AmpsTagName))
-		self._RPMs = int(self.getTDValue(theDoc, self.RPMsTagName))
-		self._RPMfeedback = int(self.getTDValue(theDoc, self.RPMfeedbackTagName))
+		# obtain the tag values from the VFD webpage
+		values = ABclient(self.VFD_IP,self.timeout).fetchTags("/" + self.VFD_URL,
+															  (self.HzTagName,self.AmpsTagName,
+															   self.RPMsTagName,self.RPMfeedbackTagName))
+		self._Hz = int(values[self.HzTagName])
+		self._Amps = int(values[self.AmpsTagName])
+		self._RPMs = int(values[self.RPMsTagName])
+		self._RPMfeedback = int(values[self.RPMfeedbackTagName])
+
+class TagScanner:
+	"""
+	Finds, in one pass over a page fed to it a chunk at a time, the text of
+	the first <td> after the first occurrence of each of tags, as
+	AllenBradleyP70VFD.getTDValue does.  base is the page offset of the
+	first byte fed, scanning starts at page offset skipTo.
+	"""
+	def __init__(self,tags,base=0,skipTo=0):
+		self.tags = tags
+		self.base = base
+		self.buf = ""
+		self.pos = max(0,skipTo - base)
+		self.values = {}
+		self.start = None
+		self.end = None
+		self.tagRE = re.compile("|".join([re.escape(tag) for tag in tags]))
+		self.maxTagLen = max([len(tag) for tag in tags])
+
+	def done_p(self):
+		return len(self.values) == len(self.tags)
+
+	def feed(self,data):
+		self.buf += data
+		while not self.done_p():
+			m = self.tagRE.search(self.buf,self.pos)
+			if m is None:
+				# a tag may be cut off at the end of what has come so far
+				self.pos = max(self.pos,len(self.buf) - self.maxTagLen + 1)
+				return
+			idx2 = self.buf.find('<td>',m.end())
+			idx3 = -1
+			if idx2 >= 0:
+				idx3 = self.buf.find('</td>',idx2+4)
+			if idx3 < 0:
+				# wait for the rest of the cell
+				self.pos = m.start()
+				return
+			if m.group() not in self.values:
+				self.values[m.group()] = self.buf[idx2+4:idx3]
+				if self.start is None:
+					self.start = self.base + m.start()
+				self.end = self.base + idx3 + 5
+			self.pos = m.end()
+
+	def span(self,slack):
+		"""Page byte range, padded by slack, covering all the tags found."""
+		return (max(0,self.start - slack),self.end + slack)
+
+# bytes of a page left unread after the tags that are read anyway to keep the connection
+AB_DRAIN_LIMIT = 16*1024
+# padding around the cached span of tags when fetching only that range
+AB_SPAN_SLACK = 256
+
+class ABVFDclient:
+	"""
+	HTTP/1.1 keep-alive connection to one A-B drive's web server, kept across
+	cycles (see ABclient), reconnecting if the drive has dropped it.
+
+	fetchTags reads the page in chunks only until every tag is found.  The
+	byte range the tags were found in is remembered, and the next fetch asks
+	for just that range.  If the drive ignores Range requests the page is
+	still only scanned from there.  Should the tags have moved, the whole
+	page is fetched and the range learnt again.
+	"""
+	def __init__(self,IPaddy,timeout=10.0,chunkSize=4096):
+		self.IPaddy = IPaddy
+		self.timeout = timeout
+		self.chunkSize = chunkSize
+		self.conn = None
+		self.spans = {}			# URL -> cached (start,end)
+		self.rangeOK_p = None
+
+	def fetchTags(self,URL,tags):
+		"""{tag: text of its <td>} for each of tags, "0" for any not on the page."""
+		span = self.spans.get(URL)
+		if span is not None:
+			values = self._fetch(URL,tags,span)
+			if values is not None:
+				return values
+		values = self._fetch(URL,tags,None)
+		for tag in tags:
+			values.setdefault(tag,"0")
+		return values
+
+	def close(self):
+		if self.conn is not None:
+			self.conn.close()
+		self.conn = None
+
+	def _fetch(self,URL,tags,span):
+		"""Values of tags, None if span was given and they were not all in it."""
+		headers = {}
+		if span is not None and self.rangeOK_p is not False:
+			headers["Range"] = "bytes=%d-%d" % span
+		resp = self._request(URL,headers)
+		base = 0
+		if resp.status == httplib.PARTIAL_CONTENT:
+			self.rangeOK_p = True
+			base = span[0]
+		elif resp.status == httplib.OK:
+			if "Range" in headers:
+				self.rangeOK_p = False
+		elif resp.status == httplib.REQUESTED_RANGE_NOT_SATISFIABLE and span is not None:
+			# the page got shorter
+			self._finish(resp)
+			return None
+		else:
+			self.close()
+			raise VFDHTTPError(self.IPaddy,resp.status)
+		skipTo = 0
+		if span is not None:
+			skipTo = span[0]
+		scanner = TagScanner(tags,base,skipTo)
+		while not scanner.done_p():
+			chunk = resp.read(self.chunkSize)
+			if not chunk:
+				break
+			scanner.feed(chunk)
+		self._finish(resp)
+		if scanner.done_p():
+			self.spans[URL] = scanner.span(AB_SPAN_SLACK)
+		elif span is not None:
+			return None
+		return scanner.values
+
+	def _request(self,URL,headers):
+		# a kept connection the drive has since closed fails on first use
+		for attempt in (0,1):
+			if self.conn is None:
+				self.conn = httplib.HTTPConnection(self.IPaddy,timeout=self.timeout)
+			try:
+				self.conn.request("GET",URL,headers=headers)
+				return self.conn.getresponse()
+			except (httplib.HTTPException,socket.error):
+				self.close()
+				if attempt:
+					raise
+
+	def _finish(self,resp):
+		"""Leave the connection ready for the next request, or close it."""
+		if resp.will_close or resp.length is None or resp.length > AB_DRAIN_LIMIT:
+			resp.close()
+			self.close()
+		else:
+			resp.read()
+
+AB_CLIENTS = {}
+AB_CLIENTS_LOCK = threading.Lock()
+
+def ABclient(IPaddy,timeout=10.0):
+	"""The ABVFDclient for the drive at IPaddy, kept across cycles."""
+	with AB_CLIENTS_LOCK:
+		if IPaddy not in AB_CLIENTS:
+			AB_CLIENTS[IPaddy] = ABVFDclient(IPaddy,timeout)
+		return AB_CLIENTS[IPaddy]
+
+class VFDHTTPError(Exception):
+	def __init__(self,IPaddy,status):
+		Exception.__init__(self,"VFD "+IPaddy+" replied with HTTP status "+str(status))
+		self.status = status
 
 def ABinterfaceFactory(config):
 	"""returns a list of AB VFD interface class instances"""
@@ -15,41 +15,110 @@
 import datetime
 import json
 import logging
-# restkit
-from restkit import Resource
+import time
+import zlib
+import hashlib
+# 3rd party
 import requests
+from requests.packages.urllib3.exceptions import NewConnectionError, ConnectTimeoutError
 # EA mods
 from EAMIDexception import EAMIDexception
 
-class WWWcomm:
+# requests that can safely be sent again
+IDEMPOTENT_METHODS = ("GET","HEAD","PUT","DELETE","OPTIONS")
+
+def notSent_p(e):
+	"""True if requests exception e is a failure to connect, so nothing reached the server."""
+	if isinstance(e,requests.exceptions.ConnectTimeout):
+		return True
+	reason = getattr(e.args[0],"reason",None) if e.args else None
+	return isinstance(reason,(NewConnectionError,ConnectTimeoutError))
 
-	def __init__(self,MIDpass,configPath,baseURL,uploadPath,RCstatusPath,MIDname=None):
-		# self.baseURL = defaultConfig.baseURL
-		# self.password = defaultConfig
+class WWWcomm:
+	"""
+	All traffic with the web server goes through one requests.Session so
+	connections (and TLS sessions) are kept alive between calls.  GETs and
+	PUTs that fail to connect, time out or get a 5xx reply are retried up
+	to retries times, waiting backoff, 2*backoff, 4*backoff... seconds, but
+	not past retryTime seconds from the first attempt.  POSTs are only
+	retried when the connection could not be made, as otherwise the server
+	may already have stored what was sent; failed uploads go to the
+	backlog instead.
 
+	If bulkUploadPath is given, uploadReadingsBulk sends several readings
+	per request as gzip-compressed JSON.
+	"""
+	def __init__(self,MIDpass,configPath,baseURL,uploadPath,RCstatusPath,MIDname=None,bulkUploadPath=None,retries=3,backoff=2.0,timeout=60.0,retryTime=30.0):
 		# obtain base configuration
 		self.MIDpass = MIDpass
 		self.baseURL = baseURL
 		self.configPath = configPath
-		self.resource = Resource(baseURL,timeout=60)
-		# self.upResource = Resource("http://isadoredev1.exotericanalytics.com:5050")
 		self.uploadPath = uploadPath
 		self.RCstatusPath = RCstatusPath
 		self.MIDname = MIDname
+		self.bulkUploadPath = bulkUploadPath
+		self.retries = retries
+		self.backoff = backoff
+		self.timeout = timeout
+		self.retryTime = retryTime
+		self.session = requests.Session()
+		# NOTE: can remove once we upgrade Python to 2.7.9+
+		self.session.verify = False
+		# what the last config download looked like
+		self.configETag = None
+		self.configHash = None
+
+	def close(self):
+		self.session.close()
+
+	def request(self,method,path,**kwargs):
+		"""Send a request over the pooled session, retrying as described above."""
+		startTime = time.time()
+		attempt = 0
+		idempotent_p = method in IDEMPOTENT_METHODS
+		while True:
+			try:
+				r = self.session.request(method,self.baseURL+path,timeout=self.timeout,**kwargs)
+				if r.status_code < 500 or not idempotent_p or not self.retry_p(startTime,attempt):
+					return r
+				logging.warning("WWW replied "+str(r.status_code)+" to "+method+" "+path+", retrying.")
+			except (requests.ConnectionError,requests.Timeout) as e:
+				if not (idempotent_p or notSent_p(e)) or not self.retry_p(startTime,attempt):
+					raise
+				logging.warning("WWW "+method+" "+path+" failed, retrying: "+str(e))
+			time.sleep(self.backoff*2**attempt)
+			attempt += 1
+
+	def retry_p(self,startTime,attempt):
+		"""True if another attempt, after its backoff, is allowed."""
+		return attempt < self.retries and time.time() - startTime + self.backoff*2**attempt <= self.retryTime
 
 	def getConfig(self):
+		"""
+		Returns the WWW config, or None if it hasn't changed since the last
+		call.  The server is asked with If-None-Match when it gave an ETag,
+		otherwise the downloaded config is compared by hash.
+		"""
 		params_dict = {"mid_pass":self.MIDpass,"ts":"blah"}
 		if self.MIDname:
 			params_dict["mid_name"]=self.MIDname
-		output = self.resource.get(path=self.configPath, 
-								   params_dict=params_dict,
-								   verify=False)
+		headers = {}
+		if self.configETag:
+			headers["If-None-Match"] = self.configETag
+		output = self.request("GET",self.configPath,params=params_dict,headers=headers)
 		
-		logging.debug("WWW reply status code: "+str(output.status_int)+".")
-		if output.status_int != 200:
+		logging.debug("WWW reply status code: "+str(output.status_code)+".")
+		if output.status_code == 304:
+			return None
+		if output.status_code != 200:
 			raise MIDconfigDownloadError(output)
 
-		return json.loads(output.body_string())
+		self.configETag = output.headers.get("ETag")
+		configHash = hashlib.sha1(output.content).hexdigest()
+		if configHash == self.configHash:
+			return None
+		self.configHash = configHash
+		return json.loads(output.content)
 
 	def RC_cmd_status(self,control_id,fetched_p):
 			"""
@@ -57,46 +126,61 @@ class WWWcomm:
 			# TODO: check output for errors, don't just rely upon exceptions
 			try:
 					if fetched_p:
-							output = self.resource.put(path=self.RCstatusPath+str(control_id),
-													   params_dict={"fetched":1,
-																	"MID_pass":self.MIDpass},
-													   verify=False)
+							output = self.request("PUT",self.RCstatusPath+str(control_id),
+												  params={"fetched":1,
+														  "MID_pass":self.MIDpass})
 					else:
-							output = self.resource.put(path=self.RCstatusPath+str(control_id),
-													   params_dict={"fetched":0,
-																	"MID_pass":self.MIDpass},
-													   verify=False)
-					if output.status_int != 204:
-							raise MID_RCstatusError("Failed to inform WWW of successful RC command: " + str(control_id) + ".  Received response status int: " + str(output.status_int))
+							output = self.request("PUT",self.RCstatusPath+str(control_id),
+												  params={"fetched":0,
+														  "MID_pass":self.MIDpass})
+					if output.status_code != 204:
+							raise MID_RCstatusError("Failed to inform WWW of successful RC command: " + str(control_id) + ".  Received response status int: " + str(output.status_code))
 			except Exception as e:
 					raise MID_RCstatusError("Failed to inform WWW of unsuccessful RC command: " + str(control_id) + ".  This is the result of exception: " + str(e))
 
 	def uploadData(self,paramString):
-		# output = self.upResource.get(path=self.uploadPath,
-		# 							 params_dict={"data":paramString})
-		# NOTE: can remove verify param once we upgrade Python to 2.7.9+
-		output = self.resource.post(path=self.uploadPath,
-									params_dict={"data":paramString},
-									verify=False)
-		output.skip_body()		# to release the connection
-		return output
+		return self.request("POST",self.uploadPath,params={"data":paramString})
 
 	def uploadReading(self,passwd,readingTime,cmds,errors):
+		self.uploadReadingData(passwd,readingTime.isoformat(),readingData(readingTime,cmds))
+
+	def uploadReadingData(self,passwd,readingTimeStr,data):
+		"""Upload one reading's to_JSON_WWW_data records (see readingData)."""
 		payload =  {"mid_pass":passwd, 
-					"datetime":readingTime.isoformat(),
-					"data":json.dumps(reduce(lambda x,y: x+y.to_JSON_WWW_data(readingTime), cmds, [])),
+					"datetime":readingTimeStr,
+					"data":json.dumps(data),
 					"errors":[]}
-		# TODO: deal with requests-specific exceptions. in particular, the timeout exception.  for now, letting MID.py deal with it.
-		# NOTE: can remove verify param once we upgrade Python to 2.7.9+
 		logging.debug(payload["data"])
-		r = requests.post(self.baseURL+self.uploadPath,data=payload,timeout=60.0,verify=False)
-		# TODO: inspect reply
-		
+		r = self.request("POST",self.uploadPath,data=payload)
+		if not r.ok:
+			raise MIDuploadError(r)
+
+	def uploadReadingsBulk(self,passwd,readings):
+		"""
+		Upload readings, a list of (datetime string, to_JSON_WWW_data records),
+		in one gzip-compressed JSON request to bulkUploadPath:
+		{"mid_pass":...,"readings":[{"datetime":...,"data":[...],"errors":[]},...]}
+		"""
+		body = json.dumps({"mid_pass":passwd,
+						   "readings":[{"datetime":t,"data":d,"errors":[]} for (t,d) in readings]},
+						  separators=(',',':'))
+		r = self.request("POST",self.bulkUploadPath,data=gzipBytes(body),
+						 headers={"Content-Type":"application/json","Content-Encoding":"gzip"})
+		if not r.ok:
+			raise MIDuploadError(r)
+
+def gzipBytes(data):
+	compressor = zlib.compressobj(6,zlib.DEFLATED,16+zlib.MAX_WBITS)
+	return compressor.compress(data) + compressor.flush()
+
+def readingData(readingTime,cmds):
+	"""All of cmds' to_JSON_WWW_data records in one list."""
+	return reduce(lambda x,y: x+y.to_JSON_WWW_data(readingTime), cmds, [])
 
 def buildJSONupload(passwd,readingTime,cmds,errors):
 	return json.dumps({"passwd":passwd, 
 					   "datetime":readingTime.isoformat(),
-					   "data":reduce(lambda x,y: x+y.to_JSON_WWW_data(readingTime), cmds, []),
+					   "data":readingData(readingTime,cmds),
 					   "errors":[]},
 					  sort_keys=True,
 					  separators=(',',':'))
@@ -104,6 +188,8 @@ def buildJSONupload(passwd,readingTime,cmds,errors):
 class MID_WWW_commError(EAMIDexception):
 	def __init__(self,WWWoutput):
 		self.WWWoutput = WWWoutput
+	def __str__(self):
+		return str(type(self)) + " -- WWW reply status " + str(getattr(self.WWWoutput,"status_code",None))
 
 class MIDconfigDownloadError(MID_WWW_commError):
 	"""
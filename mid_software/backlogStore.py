@@ -0,0 +1,201 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+# std lib
+import os
+import json
+import time
+import logging
+
+SEGMENT_PREFIX = "seg-"
+SEGMENT_SUFFIX = ".log"
+INDEX_NAME = "ACKED"
+
+class BacklogStore:
+	"""
+	On-disk queue of readings that could not be uploaded.
+
+	Each reading is one JSON line {"datetime":...,"data":[...]} holding the
+	flattened to_JSON_WWW_data records, appended to numbered segment files
+	in path.  Appends are fsync'd every syncEvery readings or syncSeconds,
+	whichever comes first.  The position (segment, byte offset) of the
+	first reading not yet uploaded is kept in the ACKED index file, written
+	atomically, and segments entirely before it are deleted.  Nothing is
+	ever rewritten.
+
+	Once the segments take up more than maxBytes the oldest are evicted,
+	uploaded or not, so a site cut off for weeks keeps its latest readings.
+	"""
+	def __init__(self,path,segmentBytes=4*1024*1024,maxBytes=256*1024*1024,syncEvery=10,syncSeconds=60.0):
+		self.path = path
+		self.segmentBytes = segmentBytes
+		self.maxBytes = maxBytes
+		self.syncEvery = syncEvery
+		self.syncSeconds = syncSeconds
+		if not os.path.isdir(path):
+			os.makedirs(path)
+		self.segments = sorted([int(f[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) for f in os.listdir(path)
+								if f.startswith(SEGMENT_PREFIX) and f.endswith(SEGMENT_SUFFIX)])
+		self.acked = self._readIndex()
+		self.out = None
+		self.unsynced = 0
+		self.lastSync = time.time()
+		if self.segments:
+			self._recover(self.segments[-1])
+
+	def segmentPath(self,seq):
+		return os.path.join(self.path,"%s%010d%s" % (SEGMENT_PREFIX,seq,SEGMENT_SUFFIX))
+
+	def append(self,readingTime,data):
+		"""Queue one reading: its datetime and list of to_JSON_WWW_data records."""
+		line = json.dumps({"datetime":readingTime.isoformat(),"data":data},separators=(',',':'))+"\n"
+		if self.out is None or self.out.tell() >= self.segmentBytes:
+			self._roll()
+		self.out.write(line)
+		self.unsynced += 1
+		if self.unsynced >= self.syncEvery or time.time() - self.lastSync >= self.syncSeconds:
+			self.sync()
+		self._enforceCap()
+
+	def sync(self):
+		"""Make everything appended so far durable."""
+		if self.out is not None and self.unsynced:
+			self.out.flush()
+			os.fsync(self.out.fileno())
+		self.unsynced = 0
+		self.lastSync = time.time()
+
+	def readBatch(self,maxReadings):
+		"""
+		Returns (readings,position) for up to maxReadings of the oldest
+		readings not yet acknowledged, readings as (datetime string, data,
+		position after the reading).  Pass position to ack() once they are
+		all uploaded, it also covers unreadable readings that were skipped.
+		"""
+		if self.out is not None:
+			self.out.flush()
+		readings = []
+		(seq,offset) = self.acked
+		position = self.acked
+		for s in [s for s in self.segments if s >= seq]:
+			f = open(self.segmentPath(s),"rb")
+			try:
+				if s == seq:
+					f.seek(offset)
+				position = (s,f.tell())
+				while len(readings) < maxReadings:
+					line = f.readline()
+					# stop at the end or at a reading still being written
+					if not line.endswith("\n"):
+						break
+					position = (s,f.tell())
+					try:
+						reading = json.loads(line)
+						readings.append((reading["datetime"],reading["data"],position))
+					except (ValueError,KeyError,TypeError):
+						logging.error("Skipping unreadable backlog reading in "+self.segmentPath(s))
+			finally:
+				f.close()
+			if len(readings) >= maxReadings:
+				break
+		return (readings,position)
+
+	def ack(self,position):
+		"""Mark every reading before position (from readBatch) as uploaded."""
+		self.acked = position
+		tmpPath = os.path.join(self.path,INDEX_NAME+".tmp")
+		f = open(tmpPath,"wb")
+		f.write("%d %d\n" % position)
+		f.flush()
+		os.fsync(f.fileno())
+		f.close()
+		os.rename(tmpPath,os.path.join(self.path,INDEX_NAME))
+		for s in [s for s in self.segments if s < position[0]]:
+			self._remove(s)
+
+	def empty_p(self):
+		if self.out is not None:
+			self.out.flush()
+		for s in [s for s in self.segments if s >= self.acked[0]]:
+			size = os.path.getsize(self.segmentPath(s))
+			if (s == self.acked[0] and size > self.acked[1]) or (s > self.acked[0] and size > 0):
+				return False
+		return True
+
+	def sizeBytes(self):
+		if self.out is not None:
+			self.out.flush()
+		return sum([os.path.getsize(self.segmentPath(s)) for s in self.segments])
+
+	def close(self):
+		self.sync()
+		if self.out is not None:
+			self.out.close()
+			self.out = None
+
+	def _readIndex(self):
+		try:
+			f = open(os.path.join(self.path,INDEX_NAME),"rb")
+			try:
+				(seq,offset) = [int(x) for x in f.read().split()]
+			finally:
+				f.close()
+		except (IOError,ValueError):
+			(seq,offset) = (0,0)
+		if self.segments and seq < self.segments[0]:
+			(seq,offset) = (self.segments[0],0)
+		return (seq,offset)
+
+	def _recover(self,seq):
+		"""Cut a reading left half written by a crash off the end of segment seq."""
+		f = open(self.segmentPath(seq),"r+b")
+		try:
+			data = f.read()
+			end = data.rfind("\n") + 1
+			if end != len(data):
+				logging.warning("Dropping "+str(len(data)-end)+"B of torn backlog reading in "+self.segmentPath(seq))
+				f.truncate(end)
+		finally:
+			f.close()
+
+	def _roll(self):
+		"""Start appending to a new segment (or the last one if it has room)."""
+		if self.out is not None:
+			self.close()
+		elif self.segments and os.path.getsize(self.segmentPath(self.segments[-1])) < self.segmentBytes:
+			self.out = open(self.segmentPath(self.segments[-1]),"ab")
+			return
+		seq = 0
+		if self.segments:
+			seq = self.segments[-1] + 1
+		self.segments.append(seq)
+		self.out = open(self.segmentPath(seq),"ab")
+
+	def _remove(self,seq):
+		os.remove(self.segmentPath(seq))
+		self.segments.remove(seq)
+
+	def _enforceCap(self):
+		"""Evict the oldest segments while over maxBytes, always keeping the one being written."""
+		while len(self.segments) > 1 and self.sizeBytes() > self.maxBytes:
+			seq = self.segments[0]
+			logging.warning("Backlog over "+str(self.maxBytes)+"B, evicting "+self.segmentPath(seq))
+			self._remove(seq)
+			if self.acked[0] <= seq:
+				self.ack((self.segments[0],0))
+
+# Local Variables:
+# indent-tabs-mode: t
+# python-indent: 4
+# tab-width: 4
+# End:
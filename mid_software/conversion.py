@@ -12,21 +12,87 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 from math import *
+import collections
+import itertools
+import numpy as np
 
 #http://lybniz2.sourceforge.net/safeeval.html
 
+# number of compiled conversion formulas kept around
+COMPILED_CACHE_SIZE = 256
+
+#make a list of safe functions 
+safe_list = ['math','acos', 'asin', 'atan', 'atan2', 'ceil', 'cos', 'cosh', 'degrees', 'e', 'exp', 'fabs', 'floor', 'fmod', 'frexp', 'hypot', 'ldexp', 'log', 'log10', 'modf', 'pi', 'pow', 'radians', 'sin', 'sinh', 'sqrt', 'tan', 'tanh'] 
+#use the list to filter the module namespace, built once and shared by every eval
+safe_dict = dict([ (k, globals().get(k, None)) for k in safe_list ]) 
+#add any needed builtins back in. 
+safe_dict['abs'] = abs
+safe_dict['__builtins__'] = None
+
+# numpy equivalents of safe_dict, for evaluating a formula over whole arrays
+# frexp and modf return tuples and are left out, formulas using them are
+# evaluated one element at a time
+np_safe_dict = {'acos':np.arccos, 'asin':np.arcsin, 'atan':np.arctan, 'atan2':np.arctan2, 'ceil':np.ceil, 'cos':np.cos, 'cosh':np.cosh, 'degrees':np.degrees, 'e':np.e, 'exp':np.exp, 'fabs':np.fabs, 'floor':np.floor, 'fmod':np.fmod, 'hypot':np.hypot, 'ldexp':np.ldexp, 'log':np.log, 'log10':np.log10, 'pi':np.pi, 'pow':np.power, 'radians':np.radians, 'sin':np.sin, 'sinh':np.sinh, 'sqrt':np.sqrt, 'tan':np.tan, 'tanh':np.tanh, 'abs':np.abs, '__builtins__':None}
+
+# formula text -> code object, least recently used first
+_compiled = collections.OrderedDict()
+
+def compileConversion(evalStr):
+	"""Return the code object for a conversion formula, compiling it at most once."""
+	try:
+		code = _compiled.pop(evalStr)
+	except KeyError:
+		code = compile(evalStr,"<conversion>","eval")
+		if len(_compiled) >= COMPILED_CACHE_SIZE:
+			_compiled.popitem(last=False)
+	_compiled[evalStr] = code
+	return code
+
 def evalConversion(evalStr, x, t=0):
-	#make a list of safe functions 
-	safe_list = ['math','acos', 'asin', 'atan', 'atan2', 'ceil', 'cos', 'cosh', 'degrees', 'e', 'exp', 'fabs', 'floor', 'fmod', 'frexp', 'hypot', 'ldexp', 'log', 'log10', 'modf', 'pi', 'pow', 'radians', 'sin', 'sinh', 'sqrt', 'tan', 'tanh'] 
-	#use the list to filter the local namespace 
-	safe_dict = dict([ (k, locals().get(k, None)) for k in safe_list ]) 
-	#add any needed builtins back in. 
-	safe_dict['abs'] = abs
-	safe_dict['x'] = float(x)
-	safe_dict['t'] = float(t)
-	#safe_dict['dir'] = dir 
-	return eval(evalStr,{"__builtins__":None},safe_dict)
+	return eval(compileConversion(evalStr),safe_dict,{'x':float(x),'t':float(t)})
+
+def evalConversionBatch(evalStr, xs, ts=None):
+	"""
+	Apply one conversion formula to every raw value in xs (any iterable,
+	numpy arrays included).  ts, if given, supplies t for each x.
+	Returns a list of engineering values.
+	"""
+	code = compileConversion(evalStr)
+	if ts is None:
+		ts = itertools.repeat(0)
+	return [eval(code,safe_dict,{'x':float(x),'t':float(t)}) for (x,t) in itertools.izip(xs,ts)]
 
+def evalConversionArray(evalStrs, xs, ts=None):
+	"""
+	Vectorized evalConversion.  evalStrs is either one formula or a sequence
+	holding a formula for each x.  Each distinct formula is evaluated once
+	over the array of raw values that use it.  Returns a float array with NaN
+	wherever the formula failed or gave a non-finite value.
+	"""
+	xs = np.asarray(xs,dtype=float)
+	if ts is None:
+		ts = np.zeros(xs.shape)
+	else:
+		ts = np.asarray(ts,dtype=float)
+	ys = np.empty(xs.shape)
+	if isinstance(evalStrs,basestring):
+		groups = [(evalStrs,slice(None))]
+	else:
+		evalStrs = list(evalStrs)
+		groups = [(evalStr,np.array([s == evalStr for s in evalStrs],dtype=bool)) for evalStr in set(evalStrs)]
+	for (evalStr,idx) in groups:
+		try:
+			with np.errstate(all='ignore'):
+				ys[idx] = eval(compileConversion(evalStr),np_safe_dict,{'x':xs[idx],'t':ts[idx]})
+		except Exception:
+			# formula does not vectorize (conditionals, frexp, ...) or is bad, do it the slow way
+			for i in np.arange(len(xs))[idx]:
+				try:
+					ys[i] = evalConversion(evalStr,xs[i],ts[i])
+				except Exception:
+					ys[i] = np.nan
+	ys[~np.isfinite(ys)] = np.nan
+	return ys
 
 # Local Variables:
 # indent-tabs-mode: t
@@ -0,0 +1,101 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""
+Table driven CRCs used talking to devices.
+
+	CRC-16/MODBUS: Modbus RTU (Fuji PXR4, Honeywell UDC), appended low byte first
+	CRC-8/MAXIM:   Dallas/Maxim 1-Wire, used by the sensor units
+
+Both are reflected, so each table entry is the CRC of one byte shifted in
+LSB first.  data may be a str, bytearray or memoryview, and passing the
+CRC of what came before as crc continues it over more data.
+"""
+# std lib
+import struct
+
+MODBUS_INIT = 0xFFFF
+MAXIM_INIT = 0x00
+
+def reflectedTable(poly):
+	"""The 256 CRCs of one byte for reflected polynomial poly."""
+	table = []
+	for byte in range(256):
+		crc = byte
+		for bit in range(8):
+			if crc & 1:
+				crc = (crc >> 1) ^ poly
+			else:
+				crc >>= 1
+		table.append(crc)
+	return tuple(table)
+
+# 0x8005 and 0x31 bit reversed
+MODBUS_TABLE = reflectedTable(0xA001)
+MAXIM_TABLE = reflectedTable(0x8C)
+
+def crc16Modbus(data,crc=MODBUS_INIT):
+	table = MODBUS_TABLE
+	for byte in bytearray(data):
+		crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+	return crc
+
+def crc8Maxim(data,crc=MAXIM_INIT):
+	table = MAXIM_TABLE
+	for byte in bytearray(data):
+		crc = table[crc ^ byte]
+	return crc
+
+def crc16ModbusMany(frames):
+	"""CRC-16/MODBUS of each of frames."""
+	return [crc16Modbus(frame) for frame in frames]
+
+def crc8MaximMany(frames):
+	"""CRC-8/MAXIM of each of frames."""
+	return [crc8Maxim(frame) for frame in frames]
+
+def appendModbusCRC(frame):
+	"""frame (a str) with its Modbus RTU CRC appended."""
+	return frame + struct.pack("<H",crc16Modbus(frame))
+
+def modbusCRC_p(frame):
+	"""True if frame ends in the right Modbus RTU CRC of the rest of it."""
+	# running the CRC on through its own CRC always leaves 0
+	return len(frame) > 2 and crc16Modbus(frame) == 0
+
+def maximCRC_p(frame):
+	"""True if frame ends in the right CRC-8/MAXIM of the rest of it."""
+	return len(frame) > 1 and crc8Maxim(frame) == 0
+
+if __name__ == "__main__":
+	# benchmark against pycrc's bit_by_bit, which the interfaces used to call
+	import timeit
+	from crc_algorithms import Crc
+	frame = struct.pack("BBBBH",1,3,0x03,0xE8,1)
+	modbus = Crc(width=16,poly=0x8005,reflect_in=True,xor_in=0xFFFF,reflect_out=True,xor_out=0x0000)
+	maxim = Crc(width=8,poly=0x31,reflect_in=True,xor_in=0x00,reflect_out=True,xor_out=0x00)
+	assert modbus.bit_by_bit(frame) == crc16Modbus(frame)
+	assert maxim.bit_by_bit(frame) == crc8Maxim(frame)
+	n = 20000
+	for (name,stmt) in (("bit_by_bit CRC-16/MODBUS",lambda: modbus.bit_by_bit(frame)),
+						("table CRC-16/MODBUS",lambda: crc16Modbus(frame)),
+						("bit_by_bit CRC-8/MAXIM",lambda: maxim.bit_by_bit(frame)),
+						("table CRC-8/MAXIM",lambda: crc8Maxim(frame))):
+		t = timeit.timeit(stmt,number=n)
+		print "%-25s %8.2f us/frame" % (name,t/n*1e6)
+
+# Local Variables:
+# indent-tabs-mode: t
+# python-indent: 4
+# tab-width: 4
+# End:
@@ -0,0 +1,134 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+# std lib
+import threading
+import Queue
+import time
+import logging
+import metrics
+
+class DeviceTask:
+	"""The calls to make to one device, in order, and how they went."""
+	def __init__(self,device,calls,name=None):
+		self.device = device
+		self.calls = calls
+		self.name = name
+		self.startTime = None
+		self.done_p = False
+		self.timedOut_p = False
+		self.error = None
+
+	def ok_p(self):
+		return self.done_p and not self.timedOut_p and self.error is None
+
+	def run(self):
+		for call in self.calls:
+			try:
+				call()
+			except Exception as e:
+				logging.error("Call to device "+str(self.device)+" failed: "+str(e))
+				self.error = e
+
+class DevicePoller:
+	"""
+	Runs I/O with Ethernet devices on a pool of maxWorkers threads, so
+	devices are talked to in parallel with each other and with the hub.
+
+	start(device,calls) queues the calls for one device, run in order on a
+	single worker, and returns straight away.  A device is never worked on
+	by two workers at once: if its task from an earlier cycle is still
+	running it is skipped.  wait() returns the tasks started since the
+	last wait once they are all done, giving up on any running longer than
+	deviceTimeout.  The worker stuck with such a task is replaced so the
+	others keep being served, and the device stays busy until the stuck
+	call returns.
+	"""
+	def __init__(self,maxWorkers=8,deviceTimeout=20.0):
+		self.maxWorkers = maxWorkers
+		self.deviceTimeout = deviceTimeout
+		self.queue = Queue.Queue()
+		self.cond = threading.Condition()
+		self.busy = set()
+		self.tasks = []
+		for i in range(maxWorkers):
+			self._spawn()
+
+	def start(self,device,calls,name=None):
+		"""
+		Queue calls for device, their time recorded in metrics under name if
+		given.  Returns the DeviceTask, or None if device is still busy.
+		"""
+		with self.cond:
+			if device in self.busy:
+				logging.warning("Device "+str(device)+" still busy from an earlier cycle, skipping it.")
+				return None
+			self.busy.add(device)
+			task = DeviceTask(device,calls,name)
+			self.tasks.append(task)
+		self.queue.put(task)
+		return task
+
+	def wait(self):
+		"""Wait for the tasks started since the last wait and return them."""
+		with self.cond:
+			while True:
+				now = time.time()
+				nextDeadline = None
+				for task in self.tasks:
+					if task.done_p or task.timedOut_p or task.startTime is None:
+						continue
+					deadline = task.startTime + self.deviceTimeout
+					if now >= deadline:
+						logging.error("Device "+str(task.device)+" took over "+str(self.deviceTimeout)+"s, giving up on it.")
+						task.timedOut_p = True
+						self._spawn()
+					elif nextDeadline is None or deadline < nextDeadline:
+						nextDeadline = deadline
+				if not [task for task in self.tasks if not (task.done_p or task.timedOut_p)]:
+					break
+				if nextDeadline is None:
+					self.cond.wait(self.deviceTimeout)
+				else:
+					self.cond.wait(max(0.001,nextDeadline - now))
+			tasks = self.tasks
+			self.tasks = []
+		return tasks
+
+	def _spawn(self):
+		worker = threading.Thread(target=self._work)
+		worker.daemon = True
+		worker.start()
+
+	def _work(self):
+		while True:
+			task = self.queue.get()
+			with self.cond:
+				task.startTime = time.time()
+				self.cond.notifyAll()
+			task.run()
+			if task.name is not None:
+				metrics.record(task.name,time.time() - task.startTime)
+			with self.cond:
+				task.done_p = True
+				self.busy.discard(task.device)
+				self.cond.notifyAll()
+				if task.timedOut_p:
+					# a replacement took over while this was stuck
+					return
+
+# Local Variables:
+# indent-tabs-mode: t
+# python-indent: 4
+# tab-width: 4
+# End:
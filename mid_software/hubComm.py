@@ -13,19 +13,25 @@
 #   limitations under the License.
 # std lib
 import socket
-import StringIO
 import serial
 import struct
 import logging
 import traceback
+import time
+import collections
+import numpy as np
 # EA modules
 import hubPackets
+import metrics
 import json
 from hubPackets import HubTachCmd,HubTempHumCmd,HubTachCmd,HubTCCmd,HubPressureWideCmd,HubPressureWideSuperCmd, MultiTSuperCmd, HubWindCmd
+from hubPackets import indexByTypePort, limitTo32, portGroups
 from EAMIDexception import EAMIDexception
 
 MAX_NUM_PHYSICAL_PORTS = 6
 MAX_NUM_MULTI_PT_CHANNELS = 4
+# serial reads only block this long, reply timeouts are kept by SerialFrameReader
+SERIAL_READ_TIMEOUT = 0.5
 
 """
 kjdfkjd
@@ -37,9 +43,11 @@ class HubComm:
 		"""
 		def __init__(self,localIP=None,localPortNum=None,hubIP=None,hubPortNum=None,socketTimeout=45,serialPath=None):
 				self.serialDevice=None
+				# reply timeouts, learned from how long the hub takes per command
+				self.latency = LatencyTracker(ceiling=None if serialPath else socketTimeout)
 				if(serialPath):
-					# TODO: why wasn't 5*32 working?
-					self.serialDevice = serial.Serial(serialPath, 9600, timeout=10*32)
+					self.serialDevice = serial.Serial(serialPath, 9600, timeout=SERIAL_READ_TIMEOUT)
+					self.frameReader = SerialFrameReader(self.serialDevice)
 				else:
 					self.MIDaddy = (localIP,localPortNum)
 					self.hubAddy = (hubIP,hubPortNum)
@@ -66,6 +74,7 @@ class HubComm:
 		def clearSerial(self):
 			self.serialDevice.flushInput()
 			self.serialDevice.flushOutput()
+			self.frameReader.reset()
 
 		def clearComm(self):
 			if self.serialDevice:
@@ -73,174 +82,553 @@ class HubComm:
 			else:
 				self.clearUDP()
 
-		def processCommand(self,cmd):
-				# one object to hold all errors (should only use once anyway, me thinks)
-				errorResp = hubPackets.HubErrorResponse()
+		def sendCommand(self,cmd,clear=True):
+				"""
+				Send cmd's packet to the hub.  Returns False if cmd has no packet
+				to send (super commands).  clear should be False while other
+				replies are still expected from the hub.
+				"""
 				# create string to send to hub
 				pktData = cmd.createPacket()
-				# 
-				# if packet created, process it
-				# otherwise, just quit
-				# 
-				if pktData:
-					# send command
-					if(self.serialDevice):
+				if not pktData:
+					return False
+				if(self.serialDevice):
+					if clear:
 						self.clearSerial()
-						self.serialDevice.write(pktData)
+					self.serialDevice.write(pktData)
+				else:
+					self.udp.sendto(pktData,self.hubAddy)
+				return True
+
+		def recvReply(self,cmd):
+				"""
+				Receive one reply from the hub, waiting as long as self.latency
+				allows for cmd.  The time taken is recorded against cmd.
+				"""
+				timeout = self.latency.timeoutFor(cmd)
+				startTime = time.time()
+				try:
+					if(self.serialDevice):
+						rplyData = self.frameReader.read(cmd,timeout)
 					else:
-						self.udp.sendto(pktData,self.hubAddy)
-					# receive command
+						self.udp.settimeout(timeout)
+						rplyData = self.udp.recv(512)
+				except (socket.timeout, serial.SerialTimeoutException, hubPackets.HubTimeoutError):
+					self.latency.timedOut(cmd)
+					raise hubPackets.HubTimeoutError(cmd)
+				self.latency.record(cmd,time.time() - startTime)
+				if len(rplyData) == 0:
+						raise hubPackets.HubRplyEmptyError()
+				logging.debug("Length of reply data: " + str(len(rplyData)))
+				return rplyData
+
+		def parseReply(self,cmd,rplyData):
+				# one object to hold all errors (should only use once anyway, me thinks)
+				errorResp = hubPackets.HubErrorResponse()
+				rplyBuf = hubPackets.RplyCursor(rplyData)
+				#
+				# frame the reply a packet at a time and hand each packet to the
+				# error response or the command until we run out of packets
+				#
+				while True:
+					pkt = rplyBuf.frame()
+					if pkt is None:
+						# reached the end of the reply, exit the loop
+						break
 					try:
-						if(self.serialDevice):
-							# TODO: stop throwing CC away and use it
-							l=struct.unpack("<H", self.serialDevice.read(2))[0]
-							rplyData = self.serialDevice.read(l-2)
+						if pkt.code == hubPackets.HubErrorResponse.HUB_ERROR_RPLY_CODE:
+							errorResp.processReply(rplyBuf)
 						else:
-							rplyData = self.udp.recv(512)
-					except (socket.timeout, serial.SerialTimeoutException):
-						raise hubPackets.HubTimeoutError(cmd)
-					if len(rplyData) == 0:
-							raise hubPackets.HubRplyEmptyError()
-					logging.debug("Length of reply data: " + str(len(rplyData)))
-					rplyBuf = StringIO.StringIO(rplyData)
-					#
-					# parse command and error responses until we can't process no more
-					#
-					while True:
-						try:
-							# attempt to parse the buffer using the given command obj
-							# logging.debug("attempting to process buffer as cmd: " + str(cmd))
+							# attempt to parse the packet using the given command obj
 							cmd.processReply(rplyBuf)
-						except hubPackets.HubRplyCmdError:
-							# unable to parse buffer using the given command obj
-							# this is, hopefully, an error response, attempt to parse as an error
-							try:
-								logging.info("failed to process buffer as cmd, trying to process as an error response")
-								errorResp.processReply(rplyBuf)
-							except hubPackets.NotHubErrorCodeError:
-								# this is unexpected, we are unable to parse the buffer any longer
-								# raise an exception and exit
-								logging.error("Unable to parse rplyBuf as a command or as an error response.  Am giving up.")
-								raise BadHubReplyError()
-						except hubPackets.HubRplyEngValueError as e:
-							# add to errorResp the indices of the offending indices
-							errorResp.addEngValErrors(e.idxs)
-							# TODO: log this event
-						except (hubPackets.HubRplyFatalError) as e:
-							# these are the exceptions which try MIDs' souls: just give up
-							# mark all readings as invalid
-							errorResp.addParseErrors(e.theCmd.getSensorIDs())
-							# rply buf read pos past packet data
-							hubPackets.passPacket(e.rplyData,e.startPos,e.packetSize)
-							# TODO: log this event
-						except hubPackets.EmptyHubRplyError:
-							# reached the end of the reply, exit the loop
-							break
+					except hubPackets.HubRplyCmdError:
+						# neither a readings packet for cmd nor an error response
+						# this is unexpected, we are unable to parse the buffer any longer
+						# raise an exception and exit
+						logging.error("Unable to parse rplyBuf as a command or as an error response.  Am giving up.")
+						raise BadHubReplyError()
+					except hubPackets.HubRplyEngValueError as e:
+						# add to errorResp the indices of the offending indices
+						errorResp.addEngValErrors(e.idxs)
+						# TODO: log this event
+					except (hubPackets.HubRplyFatalError) as e:
+						# these are the exceptions which try MIDs' souls: just give up
+						# mark all readings as invalid
+						errorResp.addParseErrors(e.theCmd.getSensorIDs())
+						# TODO: log this event
+					except hubPackets.EmptyHubRplyError:
+						break
+					# jump to the next packet, however much of this one was read
+					rplyBuf.seek(pkt.end)
 				return errorResp
 
+		def processCommand(self,cmd):
+				# 
+				# if packet created, process it
+				# otherwise, just quit
+				# 
+				if not self.sendCommand(cmd):
+					return hubPackets.HubErrorResponse()
+				return self.parseReply(cmd,self.recvReply(cmd))
+
+class LatencyTracker:
+	"""
+	Learns how long the hub takes to answer each kind of command, keyed by
+	(port, command code, address count), and derives reply timeouts from it.
+
+	The hub itself waits up to ~4 s per unit (URX_TIMEOUT in the firmware),
+	so until minSamples replies have been seen for a key the timeout is that
+	bound, baseTimeout + perAddrTimeout per address.  After that it is
+	margin times the p99 of the last window reply times, never below floor
+	or above the bound.  ceiling, if given, caps every timeout.
+
+	A learned timeout always leaves room for one silent unit, perAddrTimeout
+	on top of the fastest reply, so the hub's partial reply and its unit
+	timeout error still arrive in time.  After a timeout the key falls back
+	to the bound until a reply is seen again.
+	"""
+	def __init__(self,window=200,minSamples=10,margin=1.5,floor=1.0,baseTimeout=2.0,perAddrTimeout=4.5,ceiling=None):
+		self.window = window
+		self.minSamples = minSamples
+		self.margin = margin
+		self.floor = floor
+		self.baseTimeout = baseTimeout
+		self.perAddrTimeout = perAddrTimeout
+		self.ceiling = ceiling
+		# key -> deque of recent reply times in seconds
+		self.samples = {}
+		# key -> number of timeouts
+		self.timeouts = {}
+		# keys whose last command timed out
+		self.backingOff = set()
+
+	def key(self,cmd):
+		return (getattr(cmd,"port",0),getattr(cmd,"cmd",None),len(getattr(cmd,"addy",[])))
+
+	def boundFor(self,key):
+		"""The longest the hub should ever take to answer a command with key."""
+		bound = self.baseTimeout + self.perAddrTimeout*max(1,key[2])
+		if self.ceiling is not None:
+			bound = min(bound,self.ceiling)
+		return bound
+
+	def timeoutFor(self,cmd):
+		return self._timeout(self.key(cmd))
+
+	def _timeout(self,key):
+		bound = self.boundFor(key)
+		samples = self.samples.get(key)
+		if not samples or len(samples) < self.minSamples or key in self.backingOff:
+			return bound
+		return min(bound,max(self.floor,
+							 self.margin*np.percentile(samples,99),
+							 min(samples) + self.perAddrTimeout))
+
+	def record(self,cmd,seconds):
+		k = self.key(cmd)
+		if k not in self.samples:
+			self.samples[k] = collections.deque(maxlen=self.window)
+		self.samples[k].append(seconds)
+		self.backingOff.discard(k)
+
+	def timedOut(self,cmd):
+		k = self.key(cmd)
+		self.timeouts[k] = self.timeouts.get(k,0) + 1
+		self.backingOff.add(k)
+
+	def stats(self):
+		"""
+		Returns {(port,cc,nAddr): {"count","p50","p99","timeouts","timeout"}}
+		for every key seen, times in seconds.
+		"""
+		stats = {}
+		for k in set(self.samples.keys()) | set(self.timeouts.keys()):
+			samples = self.samples.get(k,())
+			(p50,p99) = (None,None)
+			if samples:
+				(p50,p99) = np.percentile(samples,[50,99]).tolist()
+			stats[k] = {"count":len(samples),"p50":p50,"p99":p99,
+						"timeouts":self.timeouts.get(k,0),"timeout":self._timeout(k)}
+		return stats
+
+	def statsStr(self):
+		return ", ".join(["port %d cc %s x%d: n=%d p50=%s p99=%s timeouts=%d timeout=%.1f s" %
+						  (k[0],k[1],k[2],st["count"],fmtSeconds(st["p50"]),fmtSeconds(st["p99"]),st["timeouts"],st["timeout"])
+						  for (k,st) in sorted(self.stats().items())])
+
+def fmtSeconds(seconds):
+	if seconds is None:
+		return "-"
+	return "%.2f" % seconds
+
+class SerialFrameReader:
+	"""
+	Reassembles hub replies from the serial port.  Over serial each reply is
+	prefixed with its <H length (counting the 2 length bytes).  Bytes are
+	read as they arrive into a receive buffer and a frame is only accepted
+	if its length is sane, it starts with a hub reply code and its packets
+	fill it exactly.  Anything else is dropped a byte at a time until the
+	stream lines up with a frame again, so a lost or stray byte costs one
+	reply instead of wedging every read after it.  The hub writes a frame
+	in one go, so a frame still incomplete after idleGap seconds of
+	silence is taken to have a bad length and is resynchronised past too.
+
+	A reply must arrive within baseTimeout + perAddrTimeout seconds per
+	address of the command it answers (the hub waits up to 4 s per unit).
+	"""
+	HDR_SIZE = 2
+	# length + error packet + 32 8B readings
+	MAX_FRAME_SIZE = 2 + (2+2*32) + (4+8*32)
+	# compact the receive buffer once this many consumed bytes pile up
+	COMPACT_SIZE = 4096
+
+	def __init__(self,serialDevice,baseTimeout=2.0,perAddrTimeout=4.5,idleGap=SERIAL_READ_TIMEOUT):
+		self.serialDevice = serialDevice
+		self.baseTimeout = baseTimeout
+		self.perAddrTimeout = perAddrTimeout
+		self.idleGap = idleGap
+		self.lastRx = time.time()
+		self.buf = bytearray()
+		self.head = 0
+		self.cmd = None
+		self.deadline = None
+		self.dropped = 0
+
+	def reset(self):
+		"""Forget buffered bytes and the reply being waited on."""
+		self.buf = bytearray()
+		self.head = 0
+		self.deadline = None
+
+	def timeoutFor(self,cmd):
+		return self.baseTimeout + self.perAddrTimeout*max(1,len(getattr(cmd,"addy",[])))
+
+	def start(self,cmd,timeout=None):
+		"""Start waiting up to timeout seconds (default timeoutFor(cmd)) for the reply to cmd."""
+		if timeout is None:
+			timeout = self.timeoutFor(cmd)
+		self.cmd = cmd
+		self.deadline = time.time() + timeout
+
+	def feed(self,data):
+		if data:
+			self.buf += data
+			self.lastRx = time.time()
+
+	def poll(self):
+		"""
+		Read whatever the port has waiting without blocking and return the
+		next complete reply (without its length prefix), or None.  Raises
+		HubTimeoutError once the deadline set by start() has passed.
+		"""
+		waiting = self.serialDevice.inWaiting()
+		if waiting:
+			self.feed(self.serialDevice.read(waiting))
+		rplyData = self.nextFrame()
+		# a partial frame the hub has stopped sending must have had a bad length
+		while rplyData is None and self.head < len(self.buf) and time.time() - self.lastRx >= self.idleGap:
+			self._drop(1)
+			rplyData = self.nextFrame()
+		if rplyData is not None:
+			self.deadline = None
+		elif self.deadline is not None and time.time() > self.deadline:
+			self.deadline = None
+			raise hubPackets.HubTimeoutError(self.cmd)
+		return rplyData
+
+	def read(self,cmd,timeout=None):
+		"""Block until the reply to cmd arrives or its timeout passes."""
+		self.start(cmd,timeout)
+		while True:
+			rplyData = self.poll()
+			if rplyData is not None:
+				return rplyData
+			# block for the next byte, at most the serial read timeout
+			self.feed(self.serialDevice.read(1))
+
+	def nextFrame(self):
+		"""Take the next valid frame out of the buffer, None if it hasn't all arrived."""
+		while len(self.buf) - self.head > SerialFrameReader.HDR_SIZE:
+			size = struct.unpack_from("<H",self.buf,self.head)[0]
+			if size <= SerialFrameReader.HDR_SIZE or size > SerialFrameReader.MAX_FRAME_SIZE or \
+			   self.buf[self.head+SerialFrameReader.HDR_SIZE] not in hubPackets.HUB_RPLY_CODES:
+				self._drop(1)
+				continue
+			if len(self.buf) - self.head < size:
+				return None
+			rplyData = bytes(self.buf[self.head+SerialFrameReader.HDR_SIZE:self.head+size])
+			if not hubPackets.wellFramed(rplyData):
+				self._drop(1)
+				continue
+			self._consume(size)
+			return rplyData
+		return None
+
+	def _drop(self,n):
+		self.dropped += n
+		self._consume(n)
+
+	def _consume(self,n):
+		self.head += n
+		if self.head >= len(self.buf) or self.head > SerialFrameReader.COMPACT_SIZE:
+			del self.buf[:self.head]
+			self.head = 0
+
+class HubPoller:
+	"""
+	Schedules hub commands by physical port and keeps up to maxInFlight
+	requests outstanding with the hub.  Commands on the same port are always
+	sent in their original order (the MPT reset/addr/T sequences depend on
+	it), commands on different ports are interleaved round-robin.
+
+	The hub's reply carries the command code but not the port, so at most one
+	command per port and per command code is outstanding at any time.  That
+	makes every reply match exactly one in-flight command.
+
+	NOTE: the v3 hub firmware handles one command at a time and does not
+	buffer Ethernet board input while it talks to units, so it must be run
+	with maxInFlight=1.  Replies are still decoded while the hub works on the
+	next command.
+	"""
+	def __init__(self,hubCon,maxInFlight=1):
+		self.hubCon = hubCon
+		self.maxInFlight = max(1,maxInFlight)
+		# port -> [number of cmds, seconds of hub time]
+		self.portTimes = {}
+		self._rr = 0
+
+	def run(self,cmds):
+		"""
+		Process all of cmds.  Returns a list of (cmd,errorResp) in the order
+		the replies were handled.  A command that fails outright gets an error
+		response covering all of its sensor IDs.
+		"""
+		results = []
+		self.portTimes = {}
+		queues = groupByPort(cmds)
+		inFlight = []			# [(cmd,sendTime)], oldest first
+		lastRplyTime = time.time()
+		while queues or inFlight:
+			self._fill(queues,inFlight,results)
+			if not inFlight:
+				continue
+			# wait for the next reply
+			try:
+				rplyData = self.hubCon.recvReply(inFlight[0][0])
+			except (hubPackets.HubTimeoutError,hubPackets.HubRplyEmptyError):
+				logging.warning("Timed out waiting for hub reply, reporting error to WWW for all sensors in cmd.")
+				self._abort(inFlight,results,hubPackets.HubErrorResponse.addTimeoutError)
+				lastRplyTime = time.time()
+				continue
+			rplyTime = time.time()
+			(cmd,sendTime) = inFlight.pop(matchReply(rplyData,[f[0] for f in inFlight]))
+			self._addTime(cmd,rplyTime - max(sendTime,lastRplyTime))
+			lastRplyTime = rplyTime
+			# keep the hub busy while this reply is parsed
+			self._fill(queues,inFlight,results)
+			try:
+				results.append((cmd,self.hubCon.parseReply(cmd,rplyData)))
+			except BadHubReplyError:
+				logging.warning("Bad hub reply, reporting error to WWW for all sensors in cmd.")
+				results.append((cmd,hubPackets.HubErrorResponse()))
+				results[-1][1].addParseErrors(cmd.getSensorIDs())
+				# replies to anything sent since are flushed with the junk
+				self._abort(inFlight,results,hubPackets.HubErrorResponse.addTimeoutError)
+				lastRplyTime = time.time()
+		return results
+
+	def _fill(self,queues,inFlight,results):
+		"""Send commands until the in-flight window is full or nothing can be sent."""
+		while len(inFlight) < self.maxInFlight:
+			cmd = self._nextCmd(queues,inFlight)
+			if cmd is None:
+				return
+			if getattr(cmd,"skip_p",None) and cmd.skip_p():
+				# e.g. a pressure sample no longer needed
+				results.append((cmd,hubPackets.HubErrorResponse()))
+				continue
+			logging.debug("Sending command on port "+str(getattr(cmd,"port",0))+
+						  " with cmd code "+str(getattr(cmd,"cmd",None)))
+			if self.hubCon.sendCommand(cmd,clear=not inFlight):
+				inFlight.append((cmd,time.time()))
+			else:
+				# nothing to send (super cmds), done already
+				results.append((cmd,hubPackets.HubErrorResponse()))
+
+	def _nextCmd(self,queues,inFlight):
+		"""Pop the next command that can be sent without making a reply ambiguous."""
+		busyPorts = [getattr(f[0],"port",0) for f in inFlight]
+		busyCodes = [getattr(f[0],"cmd",None) for f in inFlight]
+		for i in range(len(queues)):
+			qi = (self._rr + i) % len(queues)
+			(port,q) = queues[qi]
+			if port in busyPorts or getattr(q[0],"cmd",None) in busyCodes:
+				continue
+			cmd = q.popleft()
+			if q:
+				self._rr = qi + 1
+			else:
+				del queues[qi]
+				self._rr = qi
+			return cmd
+		return None
+
+	def _abort(self,inFlight,results,addErrors):
+		"""Report an error for every in-flight command and clean up communications."""
+		for (cmd,sendTime) in inFlight:
+			errorResp = hubPackets.HubErrorResponse()
+			addErrors(errorResp,cmd.getSensorIDs())
+			results.append((cmd,errorResp))
+		del inFlight[:]
+		self.hubCon.clearComm()
+
+	def _addTime(self,cmd,seconds):
+		port = getattr(cmd,"port",0)
+		t = self.portTimes.setdefault(port,[0,0.0])
+		t[0] += 1
+		t[1] += seconds
+		metrics.record("hub.port%d.cmd%d" % (port,getattr(cmd,"cmd",0)),seconds)
+
+	def portTimesStr(self):
+		return ", ".join(["port %d: %d cmds in %.2f s" % (port,t[0],t[1]) for (port,t) in sorted(self.portTimes.items())])
+
+def groupByPort(cmds):
+	"""Split cmds into per-port FIFO queues, keeping the order ports are first seen."""
+	ports = []; queues = {}
+	for cmd in cmds:
+		port = getattr(cmd,"port",0)
+		if port not in queues:
+			ports.append(port)
+			queues[port] = collections.deque()
+		queues[port].append(cmd)
+	return [(port,queues[port]) for port in ports]
+
+def matchReply(rplyData,cmds):
+	"""
+	Return the index in cmds of the command rplyData answers.  Replies with
+	no readings packet (ping, error only) go to the oldest command.
+	"""
+	cc = hubPackets.replyCmdCode(rplyData)
+	if cc is not None:
+		for i,cmd in enumerate(cmds):
+			if getattr(cmd,"cmd",None) == cc:
+				return i
+	return 0
+
+class CommandPlan:
+	"""
+	The hub commands for one WWW config.  They are built from the config
+	the first time they are asked for and after that just reset and handed
+	out again each cycle, until setConfig gives the plan a new config.
+	"""
+	def __init__(self,JSON=None):
+		self.setConfig(JSON)
+
+	def setConfig(self,JSON):
+		self.JSON = JSON
+		self.cmds = None
+
+	def commands(self):
+		"""A new list of the plan's commands, ready to send."""
+		if self.cmds is None:
+			logging.info("Creating commands from JSON received from WWW.")
+			self.cmds = allCmdsFromJSON(self.JSON)
+		else:
+			for cmd in self.cmds:
+				cmd.reset()
+		return list(self.cmds)
+
 def allCmdsFromJSON(JSON):
 	allCmds = []
 	logging.debug("start of command creation from JSON")
-	allCmds += tempRHcmdsFromJSON(JSON["commandInfo"])
+	index = indexByTypePort(JSON["commandInfo"])
+	allCmds += tempRHcmdsFromJSON(JSON["commandInfo"],index)
 	logging.debug("created all T/RH cmds")
-	allCmds += kpaCmdsFromJSON(JSON["commandInfo"])
+	allCmds += kpaCmdsFromJSON(JSON["commandInfo"],index)
 	logging.debug("created all KPA cmds")
-	allCmds += TCcmdsFromJSON(JSON["commandInfo"])
+	allCmds += TCcmdsFromJSON(JSON["commandInfo"],index)
 	logging.debug("created all TC cmds")
-	allCmds += tachCmdsFromJSON(JSON["commandInfo"])
+	allCmds += tachCmdsFromJSON(JSON["commandInfo"],index)
 	logging.debug("created all tach cmds")
-	allCmds += anemometerCmdsFromJSON(JSON["commandInfo"])
+	allCmds += anemometerCmdsFromJSON(JSON["commandInfo"],index)
 	logging.debug("created all wind cmds")
 	try:
-		allCmds += multiPtCmdsFromJSON(JSON["commandInfo"])
+		allCmds += multiPtCmdsFromJSON(JSON["commandInfo"],index)
 	except Exception as e:
 		logging.debug("Error while creating MPT cmds: " + str(e))
 		logging.debug(traceback.format_exc())
 	logging.debug("created all MPT cmds")
 	return allCmds
 
-def tempRHcmdsFromJSON(JSON):
+# The *CmdsFromJSON functions take the commandInfo list and, optionally, its
+# indexByTypePort index so allCmdsFromJSON only has to build it once.
+
+def tempRHcmdsFromJSON(JSON,index=None):
 	# TODO: exception handling!
-	# TODO: limit to 32 addresses per command!
-	cmds = []
-	for port in range(1,MAX_NUM_PHYSICAL_PORTS+1):
-		t_rh_json = filter(lambda x: x["type"]=="temp_rh" and x["port"]==port,JSON)
-		if t_rh_json:
-			json_grps = limitTo32(t_rh_json)
-			for json_grp in json_grps:
-				# TODO: what to do with bin and bin_section names?
-				cmds += [HubTempHumCmd(sensorID=[(trh["temp_id"],trh["rh_id"]) for trh in json_grp],
-									   port=port,
-									   addy=[(trh["addy"]) for trh in json_grp],
-									   convertPy=[(trh["temp_convert"],trh["rh_convert"]) for trh in json_grp],
-									   bias=[(trh["temp_bias"],trh["rh_bias"]) for trh in json_grp])]
-	return cmds
-
-def kpaCmdsFromJSON(JSON):
-	if filter(lambda x: x["type"]=="pressure", JSON):
+	if index is None:
+		index = indexByTypePort(JSON)
+	# TODO: what to do with bin and bin_section names?
+	return [HubTempHumCmd(sensorID=[(trh["temp_id"],trh["rh_id"]) for trh in json_grp],
+						  port=port,
+						  addy=[(trh["addy"]) for trh in json_grp],
+						  convertPy=[(trh["temp_convert"],trh["rh_convert"]) for trh in json_grp],
+						  bias=[(trh["temp_bias"],trh["rh_bias"]) for trh in json_grp])
+			for (port,json_grp) in portGroups(index,"temp_rh")]
+
+def kpaCmdsFromJSON(JSON,index=None):
+	if index is None:
+		index = indexByTypePort(JSON)
+	if [k for k in index if k[0]=="pressure"]:
 		superCmd = HubPressureWideSuperCmd()
-		return superCmd.createCmds(JSON) + [superCmd] # append super command b/c that is what is where we will get the JSON from
+		return superCmd.createCmds(JSON,index) + [superCmd] # append super command b/c that is what is where we will get the JSON from
 	else:
 		return []
 
-def anemometerCmdsFromJSON(JSON):
-	cmds = []
-	for port in range(1,MAX_NUM_PHYSICAL_PORTS+1):
-		rel_json = filter(lambda x: x["type"]=="wind" and x["port"]==port,JSON)
-		if rel_json:
-			# TODO: what to do with bin and bin_section names?
-			cmds += [HubWindCmd(sensorID=[trh["sensor_id"] for trh in rel_json],
-								port=port,
-								addy=[(trh["addy"]) for trh in rel_json],
-								convertPy=[trh["convert"] for trh in rel_json],
-								bias=[trh["bias"] for trh in rel_json])]
-	return cmds
-
-def tachCmdsFromJSON(JSON):
-	cmds = []
-	for port in range(1,MAX_NUM_PHYSICAL_PORTS+1):
-		rel_json = filter(lambda x: x["type"]=="tach" and x["port"]==port,JSON)
-		if rel_json:
-			# TODO: what to do with bin and bin_section names?
-			cmds += [HubTachCmd(sensorID=[trh["sensor_id"] for trh in rel_json],
-								port=port,
-								addy=[(trh["addy"]) for trh in rel_json],
-								convertPy=[trh["convert"] for trh in rel_json],
-								bias=[trh["bias"] for trh in rel_json])]
-	return cmds
-
-def multiPtCmdsFromJSON(JSON):
-	# start by creating a list of all sensors noting their (port,sensorID,addr,ch,MPT addrs)
-	cfg_sensors = []
-	rel_json = filter(lambda x: x["type"]=="MP_T", JSON)
-	for rj in rel_json:
-		if json.loads(rj["sensor_extra_info"]):
-			cfg_sensors += [(rj["port"],
-							 rj["sensor_id"],
-							 rj["addy"],
-							 json.loads(rj["sensor_extra_info"])["ch"],
-							 json.loads(rj["sensor_extra_info"])["addrs"])]
-		else:
-			logging.warning("WARNING: There is a MPT sensor with no sensor_extra_info")
-			logging.debug(rj)
-	logging.debug(cfg_sensors)
-	# create a list of unique (port,addr,ch) tuples
-	dev_tuples = list(set([(cs[0],cs[2],cs[3]) for cs in cfg_sensors]))
-	# organize by (port,addr,ch) tuples
-	sID_MPTaddr_list = []
-	for dev_tuple in dev_tuples:
-		# logging.debug("gathering MPTaddrs for "+str(dev_tuple))
-		sID_MPTaddr_list += [[[],[]]]
-		for cs in cfg_sensors:
-			if dev_tuple[0] == cs[0] and dev_tuple[1] == cs[2] and dev_tuple[2] == cs[3]:
-				sID_MPTaddr_list[-1][0] += [cs[1]]
-				if cs[4]:		# if MPT addr list is not empty in web app
-					sID_MPTaddr_list[-1][1] += [[long(c4,base=16) for c4 in cs[4]]]
-				else:
-					sID_MPTaddr_list[-1][1] = None
-	# logging.debug("ready to create super commands for: "+str([(dt,sml) for dt,sml in zip(dev_tuples,sID_MPTaddr_list)]))
-	# create super command (and sub-commands) for each sID_MPTaddr_list element
-	superCmds = [MultiTSuperCmd(dt[0],dt[1],dt[2],sid[0],sid[1]) for (dt,sid) in zip(dev_tuples,sID_MPTaddr_list)]
+def anemometerCmdsFromJSON(JSON,index=None):
+	if index is None:
+		index = indexByTypePort(JSON)
+	# TODO: what to do with bin and bin_section names?
+	return [HubWindCmd(sensorID=[trh["sensor_id"] for trh in rel_json],
+					   port=port,
+					   addy=[(trh["addy"]) for trh in rel_json],
+					   convertPy=[trh["convert"] for trh in rel_json],
+					   bias=[trh["bias"] for trh in rel_json])
+			for (port,rel_json) in portGroups(index,"wind")]
+
+def tachCmdsFromJSON(JSON,index=None):
+	if index is None:
+		index = indexByTypePort(JSON)
+	# TODO: what to do with bin and bin_section names?
+	return [HubTachCmd(sensorID=[trh["sensor_id"] for trh in rel_json],
+					   port=port,
+					   addy=[(trh["addy"]) for trh in rel_json],
+					   convertPy=[trh["convert"] for trh in rel_json],
+					   bias=[trh["bias"] for trh in rel_json])
+			for (port,rel_json) in portGroups(index,"tach")]
+
+def multiPtCmdsFromJSON(JSON,index=None):
+	if index is None:
+		index = indexByTypePort(JSON)
+	# one pass over the MPT rows, grouping (sensor IDs, MPT addr lists) by
+	# (port,addr,ch) in the order the devices are first seen
+	devs = collections.OrderedDict()
+	for port in sorted([k[1] for k in index if k[0]=="MP_T"]):
+		for rj in index[("MP_T",port)]:
+			extraInfo = json.loads(rj["sensor_extra_info"])
+			if not extraInfo:
+				logging.warning("WARNING: There is a MPT sensor with no sensor_extra_info")
+				logging.debug(rj)
+				continue
+			dev = devs.setdefault((port,rj["addy"],extraInfo["ch"]),[[],[]])
+			dev[0] += [rj["sensor_id"]]
+			if dev[1] is None:
+				continue
+			if extraInfo["addrs"]:		# if MPT addr list is not empty in web app
+				dev[1] += [[long(a,base=16) for a in extraInfo["addrs"]]]
+			else:
+				dev[1] = None
+	# create super command (and sub-commands) for each device
+	superCmds = [MultiTSuperCmd(port,addr,ch,sIDs,MPTaddrs) for ((port,addr,ch),(sIDs,MPTaddrs)) in devs.items()]
 	logging.debug("super cmds created:")
 	for sC in superCmds:
 		logging.debug(str(sC))
@@ -255,18 +643,16 @@ def multiPtCmdsFromJSON(JSON):
 	# return list
 	return allCmds
 
-def TCcmdsFromJSON(JSON):
-	cmds = []
-	for port in range(1,MAX_NUM_PHYSICAL_PORTS+1):
-		tc_json = filter(lambda x: x["type"]=="TC" and x["port"]==port,JSON)
-		if tc_json:
-			# TODO: what to do with bin and bin_section names?
-			cmds += [HubTCCmd(sensorID=[(trh["A_id"],trh["B_id"]) for trh in tc_json],
-							  port=port,
-							  addy=[(trh["addy"]) for trh in tc_json],
-							  convertPy=[(trh["A_convert"],trh["B_convert"]) for trh in tc_json],
-							  bias=[(trh["A_bias"],trh["B_bias"]) for trh in tc_json])]
-	return cmds
+def TCcmdsFromJSON(JSON,index=None):
+	if index is None:
+		index = indexByTypePort(JSON)
+	# TODO: what to do with bin and bin_section names?
+	return [HubTCCmd(sensorID=[(trh["A_id"],trh["B_id"]) for trh in tc_json],
+					 port=port,
+					 addy=[(trh["addy"]) for trh in tc_json],
+					 convertPy=[(trh["A_convert"],trh["B_convert"]) for trh in tc_json],
+					 bias=[(trh["A_bias"],trh["B_bias"]) for trh in tc_json])
+			for (port,tc_json) in portGroups(index,"TC")]
 
 def prepare_json_upload(password, readingTime, cmds):
     return json.dumps({"passwd": password,
@@ -274,12 +660,6 @@ def prepare_json_upload(password, readingTime, cmds):
                        "data": reduce(lambda x: x + y.to_JSON_WWW(readingTime), cmds, []), # TODO: filter this to only include replies
                        "errors": []}) # inclue errors here
 
-def limitTo32(JSONlist):
-	if len(JSONlist) > 32:
-		return [JSONlist[:32]] + limitTo32(JSONlist[32:])
-	else:
-		return [JSONlist]
-
 class BadHubReplyError(EAMIDexception):
 	"""
 	Signals that an unparsable response was received by the MID from the hub
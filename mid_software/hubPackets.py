@@ -12,7 +12,7 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 import struct
-from conversion import evalConversion
+from conversion import evalConversion, evalConversionArray
 import operator
 import hacks
 from EAMIDexception import EAMIDexception
@@ -22,7 +22,19 @@ import logging
 MAGIC = "DERV"
 MAX_NUM_PHYSICAL_PORTS = 6
 PRESSURE_SAMPLES_PER_READING = 10
+# stop sampling a pressure sensor after this many readings once the standard
+# error of its estimate is within PRESSURE_SEM_TOLERANCE of it, as a fraction
+PRESSURE_MIN_SAMPLES = 4
+PRESSURE_SEM_TOLERANCE = 0.0005
 MAX_NUM_MPT_PTS = 6
+# addresses the hub takes in one command (MAX_ADDR_COUNT in the firmware)
+MAX_ADDRS_PER_CMD = 32
+
+# hub reply codes (errors are HubErrorResponse.HUB_ERROR_RPLY_CODE)
+READINGS_RPLY_CODE = 1; EXEC_SUCCESS_RPLY_CODE = 2; PONG_RPLY_CODE = 3; VERSION_RPLY_CODE = 5;
+HUB_RPLY_CODES = (1,2,3,4,5)
+# dtypes of the per-address reply data
+RAW_U8 = np.dtype('u1'); RAW_U16 = np.dtype('<u2'); RAW_U32 = np.dtype('<u4'); RAW_U64 = np.dtype('<u8');
 
 class HubPing:
 	def __init__(self,pingVal):
@@ -32,12 +44,12 @@ class HubPing:
 	def createPacket(self):
 		return MAGIC+struct.pack("B",130)+struct.pack("<H",self.pingVal)
 
-	def processReply(self,rplyData):
-		try:
-			rplyCode = ord(rplyData.read(1))
-		except:					# presume nothing more to process
-			raise EmptyHubRplyError(self,rplyData.getvalue())
-		self.pongVal = struct.unpack("<H",rplyData.read(2))[0]
+	def processReply(self,rplyBuf):
+		pkt = rplyBuf.frame()
+		if pkt is None:			# presume nothing more to process
+			raise EmptyHubRplyError(self,rplyBuf.getvalue())
+		rplyBuf.enter(pkt)
+		self.pongVal = rplyBuf.unpack("<H")[0]
 
 	def check(self):
 		return self.pingVal+1 == self.pongVal
@@ -52,7 +64,6 @@ class HubCmd:
 		"""
 		Constructor
 		"""
-		self.startPos = None
 		self.port = port
 		self.addy = addy
 		self.cmd = cmd
@@ -62,17 +73,26 @@ class HubCmd:
 		self.bias = bias
 		self.binName = binName
 		self.binSectionName = binSectionName
-		self.rplyCode = 0
-		self.rplySize = 0
-		self.rplyTotalSize = 0
-		self.retCmdCode = 0
-		self.rplyAddrLen = -1
+		self.reset()
 
 		# TODO: move check to subclasses that need this
 		# # check to make sure there is an equal number of addys, convert functions, biases provided
 		# if not all([x == len(addy) for x in (len(convertPy),len(bias))]):
 		# 	raise PacketCreationError("Unequal number of addresses, convert functions, and/or biases provided to Packet constructor")
 
+	def reset(self):
+		"""
+		Clear everything filled in from a reply so the command can be sent
+		again next cycle.  Child classes with reply fields of their own
+		must extend this.
+		"""
+		self.startPos = None
+		self.rplyCode = 0
+		self.rplySize = 0
+		self.rplyTotalSize = 0
+		self.retCmdCode = 0
+		self.rplyAddrLen = -1
+
 	def createPacket(self):
 		logging.debug("Creating a packet with cmd code = "+str(self.cmd))
 		buffer = MAGIC
@@ -89,30 +109,34 @@ class HubCmd:
 	def processReply(self,rplyBuf):
 		# record starting location of rply data
 		self.startPos = rplyBuf.tell()
-		# grab the first byte (rply code)
-		firstByte = rplyBuf.read(1)
+		# frame the packet at the read position (header fields only, nothing copied)
+		pkt = rplyBuf.frame()
 		# if empty, exit via exception
-		if not firstByte:
+		if pkt is None:
 			raise EmptyHubRplyError(self,rplyBuf.getvalue())
-		# parse hub rply code
-		self.rplyCode = ord(firstByte)
-		# if not a readings rply, go to start of rply data and throw exception
-		if self.rplyCode != 1:
-			rplyBuf.seek(self.startPos)
+		self.rplyCode = pkt.code
+		# if not a readings rply, leave the read position at the packet start and throw exception
+		if self.rplyCode != READINGS_RPLY_CODE:
 			raise HubRplyCmdError(self,rplyBuf.getvalue())
-		# parse rply size
-		self.rplySize = ord(rplyBuf.read(1))
-		# compute total size (DATA + 3B)
-		self.totalSize = self.rplySize + 3
+		# total size is DATA + 3B
+		self.totalSize = pkt.size
+		self.rplySize = pkt.size - 3
 		# TODO: check against an expected size
-		# parse rply CC
-		self.retCmdCode = ord(rplyBuf.read(1))
+		self.retCmdCode = pkt.cc
+		# reply cut off inside the header
+		if self.retCmdCode is None:
+			raise HubRplyParseError(self,rplyBuf,self.startPos,self.totalSize)
 		# if rply CC doesn't match sent CC, throw exception
 		if self.retCmdCode != self.cmd:
 			raise HubRplyCCError(self,rplyBuf,self.startPos,self.totalSize) # DATA + 3B
+		# move to the payload, reads past the end of this packet now come up short
+		rplyBuf.enter(pkt)
 		# all readings replies begin with the number of addresses with replies
 		# parse the number of addresses with replies
-		self.rplyAddrLen = ord(rplyBuf.read(1))
+		nAddr = readArray(rplyBuf,RAW_U8,1)
+		if nAddr is None:
+			raise HubRplyParseError(self,rplyBuf,self.startPos,self.totalSize)
+		self.rplyAddrLen = int(nAddr[0])
 		# if addy lengths don't match, throw exception
 		if self.rplyAddrLen != len(self.addy):
 			raise HubRplyAddrErr(self,rplyBuf,self.startPos,self.totalSize)
@@ -131,6 +155,9 @@ class HubTempHumCmd(HubCmd):
 		sensorID: [(T1_sid,RH1_sid),(T2_sid,RH2_sid),...,(TN_sid,RHN_sid)]
 		"""
 		HubCmd.__init__(self,sensorID,port,HubCmd.TEMP_HUM_SZ,addy,HubCmd.TEMP_HUM_CODE,convertPy,bias,binName,binSectionName)
+
+	def reset(self):
+		HubCmd.reset(self)
 		self.tempRaw = list()
 		self.humidityRaw = list()
 		self.tempEng = list()
@@ -163,39 +190,35 @@ class HubTempHumCmd(HubCmd):
 		return retVal
 
 	def processReply(self,rplyBuf):
-		# list of indices of bad eng vals
-		badEng = []; badEng_msg = [];
 		# let the parent class fill in some stuff
 		try:
 			HubCmd.processReply(self,rplyBuf)
 		except:
 			raise
-		# for each unit's reply...
-		for sid,i in zip(self.sensorID,range(self.rplyAddrLen)):
-			try:
-				(rawTemp, rawHum) = struct.unpack("<HH",rplyBuf.read(4))
-				self.tempRaw.append(rawTemp)
-				self.humidityRaw.append(rawHum)
-			except EAMIDexception as e:
-				raise HubRplyParseError(self,rplyBuf,self.startPos,self.totalSize)
-			try:
-				(t,h)=self.computeEngVals(i, rawTemp, rawHum)
-			except EAMIDexception as e:
-				t = 0; h = 0;
-				badEng += [sid[0],sid[1]]
-				badEng_msg += [str(e),str(e)]
-			self.tempEng.append(t)
-			self.humidityEng.append(h)
+		# one (temp,hum) row per unit
+		raw = readArray(rplyBuf,RAW_U16,self.rplyAddrLen,2)
+		if raw is None:
+			raise HubRplyParseError(self,rplyBuf,self.startPos,self.totalSize)
+		self.tempRaw += raw[:,0].tolist()
+		self.humidityRaw += raw[:,1].tolist()
+		(t,h,bad) = self.computeEngVals(raw[:,0],raw[:,1])
+		self.tempEng += t.tolist()
+		self.humidityEng += h.tolist()
 		# raise exception if bad eng val detected
-		if len(badEng) > 0:
-			raise HubRplyEngValueError(badEng,badEng_msg)
-
-	def computeEngVals(self, index, rawTemp, rawHum):
-		'''%returns (eng temp, eng RH)'''
-		t=0;h=0;
-		t = evalConversion(self.convertPy[index][0], rawTemp)+float(self.bias[index][0])
-		h = evalConversion(self.convertPy[index][1], rawHum, t)+float(self.bias[index][1])
-		return (t,h)
+		if bad.any():
+			badEng = [x for (sid,b) in zip(self.sensorID,bad) if b for x in sid]
+			raise HubRplyEngValueError(badEng,["bad T/RH engineering value"]*len(badEng))
+
+	def computeEngVals(self, rawTemp, rawHum):
+		'''%returns (eng temps, eng RHs, bad value mask), bad values are 0'''
+		n = len(rawTemp)
+		t = evalConversionArray([cP[0] for cP in self.convertPy[:n]], rawTemp) + \
+			np.array([float(b[0]) for b in self.bias[:n]])
+		h = evalConversionArray([cP[1] for cP in self.convertPy[:n]], rawHum, t) + \
+			np.array([float(b[1]) for b in self.bias[:n]])
+		bad = np.isnan(t) | np.isnan(h)
+		t[bad] = 0; h[bad] = 0;
+		return (t,h,bad)
 
 	def toWWWparam(self):
 		# DEPRICATED
@@ -219,6 +242,9 @@ class HubTachCmd(HubCmd):
 		if not convertPy:
 			convertPy = [None] * len(addy)
 		HubCmd.__init__(self,sensorID,port,HubCmd.TACH_SZ,addy,HubCmd.TACH_CODE,convertPy,bias,binName,binSectionName)
+
+	def reset(self):
+		HubCmd.reset(self)
 		self.RPM = list()
 
 	def to_JSON_WWW_data(self,readingTime):
@@ -236,12 +262,10 @@ class HubTachCmd(HubCmd):
 			HubCmd.processReply(self,rplyBuf)
 		except:
 			raise
-		try:
-			for i in range(self.rplyAddrLen):
-				RPM = struct.unpack("<H",rplyBuf.read(2))[0]
-				self.RPM.append(RPM)
-		except:
+		raw = readArray(rplyBuf,RAW_U16,self.rplyAddrLen)
+		if raw is None:
 			raise HubRplyParseError(self,rplyBuf,self.startPos,self.totalSize)
+		self.RPM += raw.tolist()
 
 	def toWWWparam(self):
 		# DEPRICATED
@@ -255,6 +279,9 @@ class HubTachCmd(HubCmd):
 class HubTCCmd(HubCmd):
 	def __init__(self,sensorID,port=0,addy=list(),convertPy=(("x",),("x",)),bias=((0,),(0,)),binName=[],binSectionName=[]):
 		HubCmd.__init__(self,sensorID,port,HubCmd.TC_K_SZ,addy,HubCmd.TC_K_CODE,convertPy,bias,binName,binSectionName)
+
+	def reset(self):
+		HubCmd.reset(self)
 		self.T1_raw = list()
 		self.T2_raw = list()
 		self.T1_eng = list()
@@ -289,45 +316,34 @@ class HubTCCmd(HubCmd):
 			HubCmd.processReply(self,rplyBuf)
 		except:
 			raise
-		try:
-			for i in range(self.rplyAddrLen):
-				(raw1,raw2) = struct.unpack("<HH",rplyBuf.read(4))
-				self.T1_raw.append(raw1)
-				self.T2_raw.append(raw2)
-		except:
+		raw = readArray(rplyBuf,RAW_U16,self.rplyAddrLen,2)
+		if raw is None:
 			raise HubRplyParseError(self,rplyBuf,self.startPos,self.totalSize)
+		self.T1_raw += raw[:,0].tolist()
+		self.T2_raw += raw[:,1].tolist()
 		try:
 			self.computeEngVals()
 		except HubRplyEngValueError:
 			raise
 
 	def computeEngVals(self):
-		badEng_sID = []; badEng_msg = []
-		for T_eng,sIDs,cPs,Ts,bs in zip((self.T1_eng,self.T2_eng),
-									   ([sid[0] for sid in self.sensorID],
-										[sid[1] for sid in self.sensorID]),
-									   ([cP[0] for cP in self.convertPy],
-										[cP[1] for cP in self.convertPy]),
-									   (self.T1_raw,self.T2_raw),
-									   ([b[0] for b in self.bias],
-										[b[1] for b in self.bias])):
-			for sid,cP,T,b in zip(sIDs,cPs,Ts,bs):
-				try:
-					logging.debug("pre TC eval conversion:"+str(sid)+str(cP)+str(T)+str(b))
-					if cP:
-						T_eng += [evalConversion(cP,T) + b]
-					else:		# if no conversion formula given, just give raw value
-						T_eng += [T]
-				except Exception as e:
-					# log the offending sensor id and error msg
-					badEng_sID += [sid]
-					badEng_msg += [str(e)]
-					# insert garbage value
-					T_eng += [0]
-					# log this incident
-					logging.info("Exception occured during computation of TC eng value."+str(e)+"\n"+str(sid)+str(cP)+str(T)+str(b))
+		badEng_sID = []
+		for ch,T_eng,Ts in ((0,self.T1_eng,self.T1_raw),(1,self.T2_eng,self.T2_raw)):
+			n = len(Ts)
+			# if no conversion formula given, just give raw value
+			cPs = [cP[ch] or "x" for cP in self.convertPy[:n]]
+			bs = np.array([b[ch] if cP[ch] else 0 for (cP,b) in zip(self.convertPy[:n],self.bias[:n])],dtype=float)
+			eng = evalConversionArray(cPs,Ts) + bs
+			bad = np.isnan(eng)
+			# insert garbage value
+			eng[bad] = 0
+			T_eng += eng.tolist()
+			for i in np.flatnonzero(bad):
+				# log the offending sensor id
+				badEng_sID += [self.sensorID[i][ch]]
+				logging.info("Bad TC eng value.\n"+str(self.sensorID[i][ch])+str(cPs[i])+str(Ts[i])+str(bs[i]))
 		if len(badEng_sID) > 0:
-			raise HubRplyEngValueError(badEng_sID,badEng_msg)
+			raise HubRplyEngValueError(badEng_sID,["bad TC engineering value"]*len(badEng_sID))
 	def toWWWparam(self):
 		# DEPRICATED
 		# create List of (ID,raw,eng), filter out elements with None for sensorID, break into seperate lists of each ID, raw, eng, then create a string for each of the seperate lists, and return a list of those strings
@@ -343,12 +359,93 @@ class HubTCCmd(HubCmd):
 	def __str__(self):
 		return "Thermocouple command\n"+HubCmd.__str__(self) + "\nraw T1: " + str(self.T1_raw) + "\nT1 eng temp: " + str(self.T1_eng) + "\nraw T2: " + str(self.T2_raw) + "\nT2 eng temp: " + str(self.T2_eng)
 
-class HubPressureWideSuperCmd(HubCmd):
+def madKeep(values,cutoff):
+	"""Mask of values within cutoff scaled MADs of their median (all of them if the MAD is 0)."""
+	dev = np.abs(values - np.median(values))
+	mad = 1.4826 * np.median(dev)
+	if mad == 0:
+		return np.ones(len(values),dtype=bool)
+	return dev <= cutoff * mad
+
+def trimmedMean(values,proportion=0.1):
+	"""Mean of values without the proportion highest and lowest."""
+	k = int(proportion * len(values))
+	return np.mean(np.sort(values)[k:len(values)-k])
+
+class SampleAccumulator:
+	"""
+	Readings of a fixed set of sensors, up to capacity each, kept in
+	preallocated arrays.  Readings whose eng value is None or not finite
+	are dropped as they are added.  estimates() rejects outliers more than
+	madCutoff scaled median absolute deviations from the median and then
+	applies method, "trimmed" (10% off each end), "median" or "mean".
+	A sensor is converged once it has minSamples readings and the standard
+	error of their mean is at most tolerance times the magnitude of their
+	mean, so it means the same whatever units a sensor's convert gives.
+	Sensors reading near zero take all capacity readings.
+	"""
+	METHODS = {"trimmed":trimmedMean,"median":np.median,"mean":np.mean}
+
+	def __init__(self,sensorIDs,capacity,minSamples=PRESSURE_MIN_SAMPLES,tolerance=PRESSURE_SEM_TOLERANCE,madCutoff=3.5,method="trimmed"):
+		self.rows = dict([(sID,i) for (i,sID) in enumerate(sensorIDs)])
+		self.sensorIDs = list(self.rows.keys())
+		self.sensorIDs.sort(key=lambda sID: self.rows[sID])
+		self.capacity = capacity
+		self.minSamples = minSamples
+		self.tolerance = tolerance
+		self.madCutoff = madCutoff
+		self.method = self.METHODS[method]
+		self.raw = np.zeros((len(self.rows),capacity))
+		self.eng = np.zeros((len(self.rows),capacity))
+		self.count = np.zeros(len(self.rows),dtype=int)
+		self.converged = np.zeros(len(self.rows),dtype=bool)
+
+	def reset(self):
+		self.count[:] = 0
+		self.converged[:] = False
+
+	def add(self,sensorIDs,raw,eng):
+		for (sID,r,e) in zip(sensorIDs,raw,eng):
+			i = self.rows.get(sID)
+			if i is None or e is None or not np.isfinite(e) or self.count[i] >= self.capacity:
+				continue
+			n = self.count[i]
+			self.raw[i,n] = r; self.eng[i,n] = e
+			self.count[i] = n = n + 1
+			if n >= self.minSamples and not self.converged[i]:
+				values = self.eng[i,:n]
+				self.converged[i] = np.std(values,ddof=1)/np.sqrt(n) <= self.tolerance*abs(np.mean(values))
+
+	def converged_p(self,sensorIDs):
+		return all([self.converged[self.rows[sID]] for sID in sensorIDs if sID in self.rows])
+
+	def estimates(self):
+		"""[(sensorID,raw estimate,eng estimate)] for each sensor with readings."""
+		result = []
+		for (i,sID) in enumerate(self.sensorIDs):
+			n = self.count[i]
+			if n == 0:
+				continue
+			keep = madKeep(self.eng[i,:n],self.madCutoff)
+			result.append((sID,float(self.method(self.raw[i,:n][keep])),float(self.method(self.eng[i,:n][keep]))))
+		return result
 
+class HubPressureWideSuperCmd(HubCmd):
+	"""
+	Takes a reading of each pressure sensor from up to
+	PRESSURE_SAMPLES_PER_READING samples.  The sample commands feed their
+	readings to a SampleAccumulator as they come in and are skipped
+	(skip_p) once all their sensors have converged.
+	"""
 	def __init__(self):
-		HubCmd.__init__(self,0)
 		self.cmds = []
-		self.samples = {}
+		self.accumulator = SampleAccumulator([],PRESSURE_SAMPLES_PER_READING)
+		HubCmd.__init__(self,0)
+
+	def reset(self):
+		"""Constituent cmds are reset on their own."""
+		HubCmd.reset(self)
+		self.accumulator.reset()
 
 	def createPacket(self):
 		"""Do nothing. Constituent cmds will handle this."""
@@ -358,70 +455,69 @@ class HubPressureWideSuperCmd(HubCmd):
 		"""Do nothing. Constituent cmds will handle this."""
 		pass
 
-	def createCmds(self,JSON):
+	def createCmds(self,JSON,index=None):
+		"""index is indexByTypePort(JSON), if already at hand"""
+		if index is None:
+			index = indexByTypePort(JSON)
+		groups = portGroups(index,"pressure")
+		self.accumulator = SampleAccumulator([trh["sensor_id"] for (port,kpa_json) in groups for trh in kpa_json],
+											 PRESSURE_SAMPLES_PER_READING)
 		for smpl in range(PRESSURE_SAMPLES_PER_READING):
-			for port in range(1,MAX_NUM_PHYSICAL_PORTS+1):
-				kpa_json = filter(lambda x: x["type"]=="pressure" and x["port"]==port,JSON)
-				if kpa_json:
-					# TODO: what to do with bin and bin_section names?
-					self.cmds += [HubPressureWideCmd(sensorID=[trh["sensor_id"] for trh in kpa_json],
-													 port=port,
-													 addy=[(trh["addy"]) for trh in kpa_json],
-													 convertPy=[trh["convert"] for trh in kpa_json],
-													 bias=[trh["bias"] for trh in kpa_json])]
+			for (port,kpa_json) in groups:
+				# TODO: what to do with bin and bin_section names?
+				cmd = HubPressureWideCmd(sensorID=[trh["sensor_id"] for trh in kpa_json],
+										 port=port,
+										 addy=[(trh["addy"]) for trh in kpa_json],
+										 convertPy=[trh["convert"] for trh in kpa_json],
+										 bias=[trh["bias"] for trh in kpa_json])
+				cmd.accumulator = self.accumulator
+				self.cmds += [cmd]
 		return self.cmds
 
-	def collectSamples(self):
-		# TODO: maybe have a minimum number of readings
-		self.samples = {}
-		for cmd in self.cmds:
-			for sample in zip(cmd.sensorID,cmd.raw,cmd.eng):
-				try:
-					self.samples[sample[0]]["raw"] += [sample[1]]
-					self.samples[sample[0]]["eng"] += [sample[2]]
-				except KeyError:
-					self.samples[sample[0]] = {"raw":[sample[1]],"eng":[sample[2]]}
-
 	def to_JSON_WWW_data(self,readingTime):
-		# compute averages
-		self.collectSamples()
-		return [{"sensor_id":sample[0],
+		return [{"sensor_id":sID,
 				 "type":"pressure_wide_super",
 				 "datetime":readingTime.isoformat(),
-				 "value":np.mean(sample[1]["eng"]),
-				 "raw_data":np.mean(sample[1]["raw"])} for sample in self.samples.items() if sample[1]["eng"] != None] # filtering by None eng vals will hopefully prevent inclusion of errors
+				 "value":eng,
+				 "raw_data":raw} for (sID,raw,eng) in self.accumulator.estimates()]
 
 class HubPressureWideCmd(HubCmd):
 	def __init__(self,sensorID,port=0,addy=list(),convertPy=["x"],bias=[0],binName=[],binSectionName=[]):
+		# SampleAccumulator of the super cmd this is a sample for
+		self.accumulator = None
 		HubCmd.__init__(self,sensorID,port,HubCmd.PRESSURE_WIDE_SZ,addy,HubCmd.PRESSURE_WIDE_CODE,convertPy,bias,binName,binSectionName)
+
+	def skip_p(self):
+		"""True if the super cmd already has enough samples of all of this cmd's sensors."""
+		return self.accumulator is not None and self.accumulator.converged_p(self.sensorID)
+
+	def reset(self):
+		HubCmd.reset(self)
 		self.raw = list()
 		self.eng = list()
 
 	def computeEngVals(self):
-		badEng_sID = []; badEng_msg = [];
-		for sID,cP,raw,b in zip(self.sensorID,self.convertPy,self.raw,self.bias):
-			try:
-				self.eng += [evalConversion(cP,raw) + b]
-			except Exception as e:
-				# log the offending sensor ID and error msg
-				badEng_sID += [sID]
-				badEng_msg += [str(e)]
-				# insert garbage value
-				self.eng += [None]
-		if len(badEng_sID) > 0:
-			raise HubRplyEngValueError(badEng_sID,badEng_msg)
+		n = len(self.raw)
+		eng = evalConversionArray(self.convertPy[:n],self.raw) + np.array(self.bias[:n],dtype=float)
+		bad = ~np.isfinite(eng)
+		if self.accumulator is not None:
+			self.accumulator.add(self.sensorID[:n],self.raw,eng.tolist())
+		# insert garbage value
+		self.eng += [None if b else e for (e,b) in zip(eng.tolist(),bad)]
+		if bad.any():
+			# log the offending sensor IDs
+			badEng_sID = [sid for (sid,b) in zip(self.sensorID,bad) if b]
+			raise HubRplyEngValueError(badEng_sID,["bad pressure engineering value"]*len(badEng_sID))
 
 	def processReply(self,rplyBuf):
 		try:
 			HubCmd.processReply(self,rplyBuf)
 		except:
 			raise
-		try:
-			for i in range(self.rplyAddrLen):
-				rawTmp = struct.unpack("<I",rplyBuf.read(4))[0]
-				self.raw.append(rawTmp)
-		except:
-			raise HubRplyParseError(self,rplyBuf.getvalue(),self.startPos,self.totalSize)
+		raw = readArray(rplyBuf,RAW_U32,self.rplyAddrLen)
+		if raw is None:
+			raise HubRplyParseError(self,rplyBuf,self.startPos,self.totalSize)
+		self.raw += raw.tolist()
 		try:
 			self.computeEngVals()
 		except HubRplyEngValueError:
@@ -436,6 +532,9 @@ class HubPressureWideCmd(HubCmd):
 class MultiTResetCmd(HubCmd):
 	def __init__(self,port=0,addy=list()):
 		HubCmd.__init__(self,[],port,HubCmd.MULTI_T_RST_SZ,addy,HubCmd.MULTI_T_RST_CODE)
+
+	def reset(self):
+		HubCmd.reset(self)
 		self.replies = []
 
 	def to_JSON_WWW_data(self,readingTime):
@@ -449,11 +548,10 @@ class MultiTResetCmd(HubCmd):
 			HubCmd.processReply(self,rplyBuf)
 		except:
 			raise
-		try:
-			for i in range(self.rplyAddrLen):
-				self.replies += [ord(rplyBuf.read(1))]
-		except:
+		raw = readArray(rplyBuf,RAW_U8,self.rplyAddrLen)
+		if raw is None:
 			raise HubRplyParseError(self,rplyBuf,self.startPos,self.totalSize)
+		self.replies += raw.tolist()
 		# TODO: throw errors if len(replies) = len(addys)
 
 	def toWWWparam(self):
@@ -469,9 +567,12 @@ class MultiTcmd(HubCmd):
 	def __init__(self,sensorID,channel,port=0,addy=list(),convertPy=[],bias=[]):
 		HubCmd.__init__(self,sensorID,port,HubCmd.MULTI_T_SZ,addy,
 						HubCmd.MULTI_T_CODE_BASE+channel,convertPy=convertPy,bias=bias)
+		self.channel = channel
+
+	def reset(self):
+		HubCmd.reset(self)
 		self.raw = []
 		self.eng = []
-		self.channel = channel
 
 	def to_JSON_WWW_data(self,readingTime):
 		return []
@@ -485,11 +586,10 @@ class MultiTcmd(HubCmd):
 			HubCmd.processReply(self,rplyBuf)
 		except:
 			raise
-		try:
-			for i in range(self.rplyAddrLen):
-				self.raw += [struct.unpack("<H",rplyBuf.read(HubCmd.MULTI_T_SZ))[0]]
-		except:
+		raw = readArray(rplyBuf,RAW_U16,self.rplyAddrLen)
+		if raw is None:
 			raise HubRplyParseError(self,rplyBuf,self.startPos,self.totalSize)
+		self.raw += raw.tolist()
 		# TODO: record some sort of error if unexpected 0xFFFF reply
 		# self.eng = []
 		# for (cP,r,b) in zip(self.convertPy,self.raw,self.bias):
@@ -501,7 +601,7 @@ class MultiTcmd(HubCmd):
 		# 		badEng_msg += [str(e)]
 		# 		# insert garbage value
 		# 		self.eng += [None]
-		self.eng = [ds18b20_conversion(r) for r in self.raw]
+		self.eng = ds18b20_conversion_array(self.raw).tolist()
 		# if len(badEng_sID) > 0:
 		# 	raise HubRplyEngValueError(badEng_sID,badEng_msg)
 
@@ -520,6 +620,14 @@ def ds18b20_conversion(v):
 	decimals = v & 0x000F
 	C = neg*(digits + decimals/16.0)
 	return 1.8 * C + 32.0
+
+def ds18b20_conversion_array(v):
+	"""ds18b20_conversion over an array of raw values, returns deg F array"""
+	v = np.asarray(v,dtype=np.int32)
+	neg = (v & 0xF800) != 0
+	v = np.where(neg,-v,v)
+	C = np.where(neg,-1.0,1.0) * (((v & 0x07F0) >> 4) + (v & 0x000F)/16.0)
+	return 1.8 * C + 32.0
 	
 class MultiTSuperCmd(HubCmd):
 	# this is to handle collection of readings for a single MPT cable
@@ -605,9 +713,12 @@ class MultiTAddrCmd(HubCmd):
 	def __init__(self,sensorID,channel,port=0,addy=list()):
 		HubCmd.__init__(self,sensorID,port,HubCmd.MULTI_T_ADDR_SZ,addy,
 						HubCmd.MULTI_T_ADDR_CODE_BASE+channel)
-		self.addrs = []
 		self.channel = channel
 
+	def reset(self):
+		HubCmd.reset(self)
+		self.addrs = []
+
 	def to_JSON_WWW_data(self,readingTime):
 		return []
 
@@ -619,11 +730,10 @@ class MultiTAddrCmd(HubCmd):
 			HubCmd.processReply(self,rplyBuf)
 		except:
 			raise
-		try:
-			for i in range(self.rplyAddrLen):
-				self.addrs += [struct.unpack("<Q",rplyBuf.read(HubCmd.MULTI_T_ADDR_SZ))[0]]
-		except:
+		raw = readArray(rplyBuf,RAW_U64,self.rplyAddrLen)
+		if raw is None:
 			raise HubRplyParseError(self,rplyBuf,self.startPos,self.totalSize)
+		self.addrs += raw.tolist()
 		# TODO: record some sort of error if unexpected 0xFFFFF reply
 
 	def __str__(self):
@@ -635,6 +745,9 @@ class MultiTAddrCmd(HubCmd):
 class HubWindCmd(HubCmd):
 	def __init__(self,sensorID,port=0,addy=list(),convertPy=list(),bias=list(),binName=[],binSectionName=[]):
 		HubCmd.__init__(self,sensorID,port,HubCmd.WIND_SZ,addy,HubCmd.WIND_CODE,convertPy,bias,binName,binSectionName)
+
+	def reset(self):
+		HubCmd.reset(self)
 		self.wind = list()
 		self.windEng = list()
 
@@ -643,22 +756,23 @@ class HubWindCmd(HubCmd):
 			HubCmd.processReply(self,rplyBuf)
 		except:
 			raise
-		try:
-			for i in range(self.rplyAddrLen):
-				rawWind = struct.unpack("<H",rplyBuf.read(2))[0]
-			self.wind.append(rawWind)
-			self.computeEngVals()
-		except:
+		raw = readArray(rplyBuf,RAW_U16,self.rplyAddrLen)
+		if raw is None:
 			raise HubRplyParseError(self,rplyBuf,self.startPos,self.totalSize)
+		self.wind += raw.tolist()
+		self.computeEngVals()
 
 	def computeEngVals(self):
+		n = len(self.wind)
 		try:
-			self.windEng = map(operator.add,map(evalConversion,self.convertPy,self.wind),self.bias)
-			# self.windEng = map(evalConversion,self.convertPy,map(operator.add,self.wind,self.bias))
+			eng = evalConversionArray(self.convertPy[:n],self.wind) + np.array(self.bias[:n],dtype=float)
 		except:
-			logging.debug("Exception while computing wind engineering values.")
+			eng = np.empty(n); eng[:] = np.nan
+		bad = np.isnan(eng)
+		if bad.any():
+			logging.debug("Bad wind engineering values.")
 			logging.debug(str(self.convertPy)+';raw='+str(self.wind)+';bias='+str(self.bias))
-			self.windEng=[None]*len(self.wind)
+		self.windEng = [None if b else e for (e,b) in zip(eng.tolist(),bad)]
 
 	def to_JSON_WWW_data(self,readingTime):
 		retVal = []
@@ -694,16 +808,16 @@ class HubErrorResponse:
 			return True
 
 	def processReply(self, rplyBuf):
-		startPos = rplyBuf.tell()
+		pkt = rplyBuf.frame()
 		# raise exception if not an error reply
-		if ord(rplyBuf.read(1)) != HubErrorResponse.HUB_ERROR_RPLY_CODE:
-			rplyBuf.seek(startPos)
+		if pkt is None or pkt.code != HubErrorResponse.HUB_ERROR_RPLY_CODE:
 			raise NotHubErrorCodeError(None,rplyBuf.getvalue())
-		# parse reply
-		self.rplySize = ord(rplyBuf.read(1))
-		for i in range(self.rplySize):
-			self.codes.append(struct.unpack("B", rplyBuf.read(1)))
-			self.addys.append(struct.unpack("B", rplyBuf.read(1)))
+		# parse reply, one (code,addr index) pair per error
+		rplyBuf.enter(pkt)
+		self.rplySize = (pkt.size - 2)//2
+		pairs = readArray(rplyBuf,RAW_U8,min(self.rplySize,rplyBuf.remaining()//2),2)
+		self.codes += pairs[:,0].tolist()
+		self.addys += pairs[:,1].tolist()
 
 	def addEngValErrors(self,indices):
 		self.codes += [HubErrorResponse.ENG_VAL_ERROR_CODE] * len(indices)
@@ -772,13 +886,153 @@ class NotHubErrorCodeError(HubRplyError):
 class HubTimeoutError(EAMIDexception):
 	"""Exception for when hub times out."""
 
-def passPacket(rplyBuf,startPos,pktSz):
-	""" pass over entire packet in the rply buffer.  works via side effect """
-	# move to start of packet
-	rplyBuf.seek(startPos)
-	# move pktSz Bytes to end of packet
-	rplyBuf.seek(startPos+pktSz)
-		
+class RplyPacket:
+	"""
+	One packet of a hub reply, framed from its header.  start and size are
+	offsets into the reply; hdrSize bytes of header come before the payload.
+	cc is None for packets without a command code (or cut off before it).
+	"""
+	def __init__(self,code,start,size,hdrSize,cc=None):
+		self.code = code
+		self.start = start
+		self.size = size
+		self.end = start + size
+		self.hdrSize = hdrSize
+		self.cc = cc
+
+	def __str__(self):
+		return "reply packet code "+str(self.code)+" at "+str(self.start)+", "+str(self.size)+"B, CC "+str(self.cc)
+
+def framePacket(rplyData,pos=0):
+	"""
+	Frame the packet starting at pos of a raw hub reply.  Returns None at the
+	end of the reply.  Unknown reply codes take up the rest of the reply.
+	"""
+	end = len(rplyData)
+	if pos >= end:
+		return None
+	code = struct.unpack_from("B",rplyData,pos)[0]
+	if code == READINGS_RPLY_CODE:
+		# [1,S,CC,DATA]
+		if pos + 3 > end:
+			return RplyPacket(code,pos,end-pos,end-pos)
+		(rplySize,cc) = struct.unpack_from("BB",rplyData,pos+1)
+		return RplyPacket(code,pos,rplySize+3,3,cc)
+	elif code == HubErrorResponse.HUB_ERROR_RPLY_CODE:
+		# [4,n,(code,addr)*n]
+		if pos + 2 > end:
+			return RplyPacket(code,pos,end-pos,end-pos)
+		return RplyPacket(code,pos,2+2*struct.unpack_from("B",rplyData,pos+1)[0],2)
+	elif code in (PONG_RPLY_CODE,VERSION_RPLY_CODE):
+		return RplyPacket(code,pos,3,1)
+	return RplyPacket(code,pos,end-pos,1)
+
+class RplyCursor:
+	"""
+	Read position over a raw hub reply, used in place of a StringIO copy of
+	it.  Packets are framed by offset and values decoded in place with
+	struct.unpack_from/np.frombuffer, so the reply is never copied.
+	"""
+	def __init__(self,rplyData):
+		self.data = rplyData
+		self.size = len(rplyData)
+		self.pos = 0
+		self.limit = self.size
+
+	def tell(self):
+		return self.pos
+
+	def seek(self,pos):
+		self.pos = pos
+		self.limit = self.size
+
+	def remaining(self):
+		return max(0,self.limit - self.pos)
+
+	def getvalue(self):
+		return self.data
+
+	def read(self,n):
+		""" memoryview of the next n bytes (fewer at the end) """
+		n = min(n,self.remaining())
+		view = memoryview(self.data)[self.pos:self.pos+n]
+		self.pos += n
+		return view
+
+	def unpack(self,fmt):
+		vals = struct.unpack_from(fmt,self.data,self.pos)
+		self.pos += struct.calcsize(fmt)
+		return vals
+
+	def frame(self):
+		""" frame the packet at the read position without moving it """
+		return framePacket(self.data,self.pos)
+
+	def enter(self,pkt):
+		""" move to pkt's payload and keep reads inside pkt until the next seek """
+		self.pos = pkt.start + pkt.hdrSize
+		self.limit = min(pkt.end,self.size)
+
+def indexByTypePort(JSON):
+	"""
+	Index the WWW config's commandInfo rows by (type,port) in one pass.
+	Rows keep their config order within each key.
+	"""
+	index = {}
+	for row in JSON:
+		index.setdefault((row["type"],row["port"]),[]).append(row)
+	return index
+
+def limitTo32(JSONlist):
+	"""Split JSONlist into chunks of at most MAX_ADDRS_PER_CMD rows."""
+	return [JSONlist[i:i+MAX_ADDRS_PER_CMD] for i in range(0,len(JSONlist),MAX_ADDRS_PER_CMD)]
+
+def portGroups(index,sensorType):
+	"""(port,rows) for every chunk of sensorType rows on the physical ports of index."""
+	return [(port,grp) for port in range(1,MAX_NUM_PHYSICAL_PORTS+1)
+			for grp in limitTo32(index.get((sensorType,port),[]))]
+
+def readArray(rplyBuf,dtype,n,width=1):
+	"""
+	Read n values (rows of width values if width > 1) of dtype from rplyBuf
+	with a single np.frombuffer call on the reply.  Returns None if the
+	packet runs short.
+	"""
+	sz = dtype.itemsize*n*width
+	if sz > rplyBuf.remaining():
+		return None
+	raw = np.frombuffer(rplyBuf.data,dtype=dtype,count=n*width,offset=rplyBuf.pos)
+	rplyBuf.pos += sz
+	if width > 1:
+		raw = raw.reshape((n,width))
+	return raw
+
+def replyCmdCode(rplyData):
+	"""
+	Return the command code of the first readings packet in a raw hub reply,
+	or None if the reply has no readings packet (ping, version, errors only).
+	"""
+	pkt = framePacket(rplyData)
+	while pkt is not None and pkt.code == HubErrorResponse.HUB_ERROR_RPLY_CODE:
+		pkt = framePacket(rplyData,pkt.end)
+	if pkt is None or pkt.code != READINGS_RPLY_CODE:
+		return None
+	return pkt.cc
+
+def wellFramed(rplyData):
+	"""
+	True if rplyData is made of packets with known reply codes that end
+	exactly at the end of the reply.
+	"""
+	pos = 0
+	pkt = framePacket(rplyData)
+	while pkt is not None:
+		if pkt.code not in HUB_RPLY_CODES:
+			return False
+		pos = pkt.end
+		pkt = framePacket(rplyData,pos)
+	return pos == len(rplyData)
+
 # Local Variables:
 # indent-tabs-mode: t
 # python-indent: 4
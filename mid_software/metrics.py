@@ -0,0 +1,127 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""
+Timing of what the MID spends its cycles on.
+
+	with metrics.span("upload"):
+		WWWcon.uploadReadingData(...)
+	metrics.record("hub.port1.cc4",seconds)
+
+Each name keeps its last window durations for percentiles, plus totals.
+Disabled (the default, see configure) span() hands back one shared no-op
+object and record() returns straight away.
+"""
+# std lib
+import collections
+import threading
+import json
+import time
+import math
+import os
+
+class NullSpan:
+	def __enter__(self):
+		return self
+	def __exit__(self,excType,exc,tb):
+		return False
+
+NULL_SPAN = NullSpan()
+
+class Span:
+	def __init__(self,metrics,name):
+		self.metrics = metrics
+		self.name = name
+	def __enter__(self):
+		self.startTime = time.time()
+		return self
+	def __exit__(self,excType,exc,tb):
+		self.metrics.record(self.name,time.time() - self.startTime)
+		return False
+
+class Metrics:
+	def __init__(self,enabled=False,window=200):
+		self.enabled = enabled
+		self.window = window
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		self.samples = {}		# name -> deque of the last window durations
+		self.totals = {}		# name -> [count,seconds,max]
+		self.startTime = time.time()
+
+	def span(self,name):
+		if not self.enabled:
+			return NULL_SPAN
+		return Span(self,name)
+
+	def record(self,name,seconds):
+		if not self.enabled:
+			return
+		with self.lock:
+			samples = self.samples.get(name)
+			if samples is None:
+				samples = self.samples[name] = collections.deque(maxlen=self.window)
+				self.totals[name] = [0,0.0,0.0]
+			samples.append(seconds)
+			t = self.totals[name]
+			t[0] += 1; t[1] += seconds; t[2] = max(t[2],seconds)
+
+	def stats(self):
+		"""{name: {"n","total","max","p50","p90","p99"}}, seconds, percentiles over the window."""
+		with self.lock:
+			items = [(name,sorted(self.samples[name]),list(self.totals[name])) for name in self.samples]
+		return dict([(name,{"n":t[0],"total":round(t[1],4),"max":round(t[2],4),
+							"p50":percentile(s,50),"p90":percentile(s,90),"p99":percentile(s,99)})
+					 for (name,s,t) in items])
+
+	def write(self,path):
+		"""Write stats() as one line of JSON, atomically replacing path."""
+		if not self.enabled:
+			return
+		tmpPath = path+".tmp"
+		f = open(tmpPath,"wb")
+		try:
+			json.dump({"since":self.startTime,"written":time.time(),"spans":self.stats()},
+					  f,separators=(',',':'),sort_keys=True)
+			f.write("\n")
+		finally:
+			f.close()
+		os.rename(tmpPath,path)
+
+def percentile(ordered,p):
+	"""Nearest rank percentile of the sorted list ordered."""
+	if not ordered:
+		return None
+	i = min(len(ordered)-1,max(0,int(math.ceil(p/100. * len(ordered))) - 1))
+	return round(ordered[i],4)
+
+METRICS = Metrics()
+
+def configure(enabled,window=200):
+	METRICS.enabled = enabled
+	METRICS.window = window
+	METRICS.reset()
+
+def span(name):
+	return METRICS.span(name)
+
+def record(name,seconds):
+	METRICS.record(name,seconds)
+
+# Local Variables:
+# indent-tabs-mode: t
+# python-indent: 4
+# tab-width: 4
+# End:
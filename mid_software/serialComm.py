@@ -16,6 +16,11 @@ import FujiInterface
 # from HoneywellInterface import Honeywell3300ReadSP_PVcmd
 import VFDinterface
 import StringIO
+import struct
+import time
+import logging
+import metrics
+from EA_RCcmd import EA_RCcmd
 from EAMIDexception import EAMIDexception
 
 FujiPXR4_ID = 11
@@ -32,6 +37,10 @@ YaskawaP7_Amps_ID = 61
 
 RS485DeviceIDs = (FujiPXR4_ID,HoneywellUDC3300_ID,YaskawaP7_ID)
 
+# Modbus RTU function codes whose reply echoes the request: 8 bytes with CRC
+ECHO_FUNCTION_CODES = (0x05,0x06,0x0F,0x10)
+READ_FUNCTION_CODES = (0x01,0x02,0x03,0x04)
+
 def isRS485_p(deviceID):
 	return deviceID in RS485DeviceIDs
 	
@@ -53,23 +62,119 @@ def cmdFactory(deviceID,sensorTypeID,sensorID,addy,value=None):
 	else:
 		pass
 
+def rtuFrameLength(data):
+	"""
+	Length a Modbus RTU reply starting data will have, CRC included, or
+	None if more of it is needed to tell (or its function code is unknown).
+	"""
+	if len(data) < 2:
+		return None
+	functionCode = ord(data[1])
+	if functionCode & 0x80:
+		# exception reply: addr, code, exception code, CRC
+		return 5
+	if functionCode in ECHO_FUNCTION_CODES:
+		return 8
+	if functionCode in READ_FUNCTION_CODES and len(data) >= 3:
+		return 3 + ord(data[2]) + 2
+	return None
+
+def interFrameGap(baudrate):
+	"""Modbus RTU silent interval: 3.5 characters of 11 bits, 1.75ms above 19200 baud."""
+	if baudrate > 19200:
+		return 0.00175
+	return 3.5 * 11. / baudrate
+
 class SerialComm:
-	"""blah blah blah"""
-	def __init__(self,port="/dev/ttyUSB1"):
+	"""
+	The RS485 bus, kept open across cycles.  processCommand sends a
+	command's Modbus RTU request and reads the reply only until the frame
+	is complete, its length known from the function code, waiting up to
+	timeout for it.  Requests are spaced at least the inter-frame gap after
+	the last traffic.  The port is reopened after a serial error.
+	"""
+	def __init__(self,port="/dev/ttyUSB1",baudrate=9600,parity=serial.PARITY_ODD,timeout=5,serialDevice=None):
 		self.port = port
-		self.ser = serial.Serial(port=port,parity=serial.PARITY_ODD,
-								 baudrate=9600,timeout=5)
+		self.baudrate = baudrate
+		self.parity = parity
+		self.timeout = timeout
+		self.gap = interFrameGap(baudrate)
+		self.lastTraffic = 0
+		self.ser = serialDevice
+		if self.ser is None:
+			self.open()
+
+	def open(self):
+		self.ser = serial.Serial(port=self.port,parity=self.parity,
+								 baudrate=self.baudrate,timeout=self.timeout)
+
 	def processCommand(self,cmd):
-		# send command
-		sndBuf = cmd.createPacket(True)
-		self.ser.write(sndBuf)
-		# receive reply
-		rplyBuf = StringIO.StringIO(self.ser.read(100))
+		if self.ser is None:
+			self.open()
+		try:
+			# send command
+			sndBuf = cmd.createPacket(True)
+			wait = self.lastTraffic + self.gap - time.time()
+			if wait > 0:
+				time.sleep(wait)
+			self.ser.flushInput()
+			self.ser.write(sndBuf)
+			# receive reply
+			rply = self.readFrame()
+		except serial.SerialException:
+			self.closeSer()
+			raise
 		# parse reply
-		cmd.processReply(rplyBuf)
+		cmd.processReply(StringIO.StringIO(rply))
+
+	def readFrame(self):
+		"""The reply frame, or as much of it as came within timeout."""
+		rply = ""
+		deadline = time.time() + self.timeout
+		portTimeout = self.ser.timeout
+		try:
+			while True:
+				length = rtuFrameLength(rply)
+				if length is None:
+					# slave, function code and byte count tell the length
+					need = 3 - len(rply)
+					if len(rply) >= 3:
+						need = 1
+				else:
+					need = length - len(rply)
+				remaining = deadline - time.time()
+				if need <= 0 or remaining <= 0:
+					break
+				self.ser.timeout = remaining
+				data = self.ser.read(need)
+				self.lastTraffic = time.time()
+				if not data:
+					break
+				rply += data
+		finally:
+			self.ser.timeout = portTimeout
+		return rply
+
+	def runCmds(self,cmds):
+		"""
+		Process cmds, remote control writes ahead of reads.  Returns
+		[(cmd,exception or None)] in the order they were processed.
+		"""
+		results = []
+		for cmd in [c for c in cmds if isinstance(c,EA_RCcmd)] + [c for c in cmds if not isinstance(c,EA_RCcmd)]:
+			try:
+				with metrics.span("rs485.slave%s" % getattr(cmd,"slaveAddy",None)):
+					self.processCommand(cmd)
+				results.append((cmd,None))
+			except Exception as e:
+				logging.error("RS485 command to "+str(getattr(cmd,"slaveAddy",None))+" failed: "+repr(e))
+				results.append((cmd,e))
+		return results
 
 	def closeSer(self):
-		self.ser.close()
+		if self.ser is not None:
+			self.ser.close()
+		self.ser = None
 
 class EmptyRplyError(EAMIDexception):
 	def __init__(self,cmd,rply):
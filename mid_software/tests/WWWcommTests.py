@@ -0,0 +1,112 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import unittest
+import json
+import urlparse
+import socket
+import time
+import requests
+import WWWcomm
+from tests.WWWstandIn import WWWstandIn
+
+class WWWcommTests(unittest.TestCase):
+    """WWWcomm against the local stand-in server."""
+
+    def setUp(self):
+        self.server = WWWstandIn(config={"commandInfo": [], "RC": []})
+        self.WWWcon = WWWcomm.WWWcomm("secret", "/resources/MID", self.server.baseURL,
+                                      "/resources/data/readings", "/resources/controls/",
+                                      bulkUploadPath="/resources/data/readings_bulk",
+                                      retries=2, backoff=0.01, timeout=5)
+
+    def tearDown(self):
+        self.WWWcon.close()
+        self.server.stop()
+
+    def testKeepAlive(self):
+        self.assertEqual(self.WWWcon.getConfig(), {"commandInfo": [], "RC": []})
+        self.WWWcon.RC_cmd_status(7, True)
+        self.WWWcon.uploadReadingData("secret", "2019-01-01T00:00:00+00:00", [{"sensor_id": 1, "value": 2.0}])
+        self.assertEqual([r["method"] for r in self.server.requests], ["GET", "PUT", "POST"])
+        self.assertEqual(self.server.requests[0]["query"]["mid_pass"], ["secret"])
+        self.assertEqual(self.server.requests[1]["path"], "/resources/controls/7")
+        self.assertEqual(self.server.requests[1]["query"]["fetched"], ["1"])
+        form = urlparse.parse_qs(self.server.requests[2]["body"])
+        self.assertEqual(json.loads(form["data"][0]), [{"sensor_id": 1, "value": 2.0}])
+        self.assertEqual(self.server.connections, 1)
+
+    def testConditionalConfig(self):
+        self.assertEqual(self.WWWcon.getConfig(), {"commandInfo": [], "RC": []})
+        self.assertEqual(self.WWWcon.getConfig(), None)
+        self.assertTrue(self.server.requests[-1]["headers"]["if-none-match"])
+        self.server.config = {"commandInfo": [], "RC": [{"ctrl_id": 1}]}
+        self.assertEqual(self.WWWcon.getConfig(), self.server.config)
+        # without ETags the download is compared by hash
+        self.server.etag_p = False
+        self.assertEqual(self.WWWcon.getConfig(), None)
+        self.server.config = {"commandInfo": [], "RC": []}
+        self.assertEqual(self.WWWcon.getConfig(), self.server.config)
+
+    def testBulkUpload(self):
+        readings = [("2019-01-01T00:0%d:00+00:00" % i, [{"sensor_id": i, "value": i*0.5}]) for i in range(5)]
+        self.WWWcon.uploadReadingsBulk("secret", readings)
+        req = self.server.requests[-1]
+        self.assertEqual(req["path"], "/resources/data/readings_bulk")
+        self.assertEqual(req["headers"]["content-encoding"], "gzip")
+        body = json.loads(req["body"])
+        self.assertEqual(body["mid_pass"], "secret")
+        self.assertEqual([(r["datetime"], r["data"]) for r in body["readings"]],
+                         [(t, d) for (t, d) in readings])
+
+    def testRetry(self):
+        self.server.failNext = 2
+        self.assertEqual(self.WWWcon.getConfig(), {"commandInfo": [], "RC": []})
+        self.assertEqual(len(self.server.requests), 3)
+        self.server.failNext = 3
+        self.assertRaises(WWWcomm.MIDconfigDownloadError, self.WWWcon.getConfig)
+
+    def testNoPostRetryOnServerError(self):
+        # the server may have stored it, the backlog takes it from here
+        self.server.failNext = 1
+        self.assertRaises(WWWcomm.MIDuploadError, self.WWWcon.uploadReadingData,
+                          "secret", "2019-01-01T00:00:00+00:00", [])
+        self.assertEqual(len(self.server.requests), 1)
+
+    def testPostRetryNotConnected(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        WWWcon = WWWcomm.WWWcomm("secret", "/resources/MID", "http://127.0.0.1:%d" % port,
+                                 "/resources/data/readings", "/resources/controls/",
+                                 retries=10, backoff=0.05, timeout=5, retryTime=0.5)
+        attempts = []
+        request = WWWcon.session.request
+        def countingRequest(*args, **kwargs):
+            attempts.append(time.time())
+            return request(*args, **kwargs)
+        WWWcon.session.request = countingRequest
+        startTime = time.time()
+        self.assertRaises(requests.ConnectionError, WWWcon.uploadReadingData,
+                          "secret", "2019-01-01T00:00:00+00:00", [])
+        # refused connections are retried, within retryTime
+        self.assertTrue(len(attempts) > 1)
+        self.assertTrue(time.time() - startTime < 1.0)
+        WWWcon.close()
+
+    def testNoRetryOnClientError(self):
+        self.server.failStatus = 400
+        self.server.failNext = 1
+        self.assertRaises(WWWcomm.MIDconfigDownloadError, self.WWWcon.getConfig)
+        self.assertEqual(len(self.server.requests), 1)
@@ -0,0 +1,107 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""
+Stand-in for the Isadore web server, for testing WWWcomm offline.
+
+    server = WWWstandIn(config={"commandInfo": ...})
+    WWWcon = WWWcomm.WWWcomm("pass", "/config", server.baseURL, "/upload", "/rc/", bulkUploadPath="/bulk")
+    ...
+    server.stop()
+
+GET of any path returns config as JSON with an ETag (unless etag_p is
+False) and honours If-None-Match, PUT returns 204 and POST returns 200.
+Every request is kept in requests as a dict with method, path, query,
+headers and body (gunzipped if it was sent gzipped).  The next failNext
+requests get failStatus instead.  connections counts the TCP
+connections made.
+"""
+import BaseHTTPServer
+import SocketServer
+import threading
+import json
+import urlparse
+import zlib
+import hashlib
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.standIn.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def handleRequest(self):
+        standIn = self.server.standIn
+        url = urlparse.urlparse(self.path)
+        body = self.rfile.read(int(self.headers.getheader("Content-Length", 0)))
+        if self.headers.getheader("Content-Encoding") == "gzip":
+            body = zlib.decompress(body, 16+zlib.MAX_WBITS)
+        standIn.requests.append({"method": self.command,
+                                 "path": url.path,
+                                 "query": urlparse.parse_qs(url.query),
+                                 "headers": dict(self.headers.items()),
+                                 "body": body})
+        if standIn.failNext > 0:
+            standIn.failNext -= 1
+            self.reply(standIn.failStatus, "")
+        elif self.command == "GET":
+            body = json.dumps(standIn.config)
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()
+            if not standIn.etag_p:
+                self.reply(200, body)
+            elif self.headers.getheader("If-None-Match") == etag:
+                self.reply(304, "")
+            else:
+                self.reply(200, body, {"ETag": etag})
+        elif self.command == "PUT":
+            self.reply(204, "")
+        else:
+            self.reply(200, "")
+
+    def reply(self, status, body, headers={}):
+        self.send_response(status)
+        for (k, v) in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = handleRequest
+    do_PUT = handleRequest
+    do_POST = handleRequest
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class WWWstandIn:
+    def __init__(self, config=None, failStatus=503):
+        self.config = config or {}
+        self.failStatus = failStatus
+        self.failNext = 0
+        self.etag_p = True
+        self.requests = []
+        self.connections = 0
+        self.server = StandInServer(("127.0.0.1", 0), StandInHandler)
+        self.server.standIn = self
+        self.baseURL = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,140 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import unittest
+import BaseHTTPServer
+import SocketServer
+import threading
+import re
+import VFDinterface
+
+TAGS = ("Datalink A1 Out", "Datalink A2 Out", "Datalink A3 Out", "Datalink A4 Out")
+
+def page(values, before=20000, after=30000):
+    rows = "".join(["<tr><td>%s</td><td>%d</td></tr>\n" % (tag, v) for (tag, v) in zip(TAGS, values)])
+    return "<html><table>" + "<!-- x -->" * (before/10) + rows + "<!-- y -->" * (after/10) + "</table></html>"
+
+class DriveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.drive.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        drive = self.server.drive
+        body = drive.page
+        status = 200
+        headers = {}
+        m = re.match(r"bytes=(\d+)-(\d+)", self.headers.getheader("Range") or "")
+        drive.ranges.append(self.headers.getheader("Range"))
+        if m and drive.range_p:
+            (start, end) = (int(m.group(1)), int(m.group(2)))
+            if start >= len(body):
+                (status, body) = (416, "")
+            else:
+                (status, body) = (206, body[start:end+1])
+                headers["Content-Range"] = "bytes %d-%d/%d" % (start, start+len(body)-1, len(drive.page))
+        self.send_response(status)
+        for (k, v) in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+            drive.sent += len(body)
+        except Exception:
+            pass
+
+class DriveServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class abVFDTests(unittest.TestCase):
+    def setUp(self):
+        self.server = DriveServer(("127.0.0.1", 0), DriveHandler)
+        self.server.drive = self
+        self.page = page((600, 12, 1750, 1748))
+        self.range_p = True
+        self.connections = 0
+        self.sent = 0
+        self.ranges = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.client = VFDinterface.ABVFDclient("127.0.0.1:%d" % self.server.server_address[1], timeout=5)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testScanner(self):
+        doc = page((1, 2, 3, 4), 100, 100)
+        expected = dict([(tag, VFDinterface.AllenBradleyP70VFD.getTDValue.im_func(None, doc, tag)) for tag in TAGS])
+        for size in (1, 7, 4096):
+            scanner = VFDinterface.TagScanner(TAGS)
+            for i in range(0, len(doc), size):
+                scanner.feed(doc[i:i+size])
+            self.assertEqual(scanner.values, expected)
+        self.assertEqual(expected["Datalink A3 Out"], "3")
+
+    def testRangeFetch(self):
+        values = self.client.fetchTags("/diagnostics_5.html", TAGS)
+        self.assertEqual([values[t] for t in TAGS], ["600", "12", "1750", "1748"])
+        self.assertEqual(self.ranges, [None])
+        fullSent = self.sent
+        self.page = page((610, 13, 1760, 1755))
+        values = self.client.fetchTags("/diagnostics_5.html", TAGS)
+        self.assertEqual([values[t] for t in TAGS], ["610", "13", "1760", "1755"])
+        self.assertTrue(self.ranges[-1].startswith("bytes="))
+        self.assertTrue(self.sent - fullSent < 1000)
+        # the long rest of the first page was left unread so that connection was closed,
+        # range fetches keep theirs
+        self.client.fetchTags("/diagnostics_5.html", TAGS)
+        self.assertEqual(self.connections, 2)
+
+    def testMovedTags(self):
+        self.client.fetchTags("/diagnostics_5.html", TAGS)
+        self.page = page((1, 2, 3, 4), before=5000)
+        values = self.client.fetchTags("/diagnostics_5.html", TAGS)
+        self.assertEqual([values[t] for t in TAGS], ["1", "2", "3", "4"])
+        self.assertEqual(self.ranges[-1], None)
+        # shorter than the cached range
+        self.page = page((5, 6, 7, 8), before=0, after=0)
+        self.client.spans["/diagnostics_5.html"] = (40000, 41000)
+        values = self.client.fetchTags("/diagnostics_5.html", TAGS)
+        self.assertEqual([values[t] for t in TAGS], ["5", "6", "7", "8"])
+
+    def testNoRangeSupport(self):
+        self.range_p = False
+        self.client.fetchTags("/diagnostics_5.html", TAGS)
+        values = self.client.fetchTags("/diagnostics_5.html", TAGS)
+        self.assertEqual(values["Datalink A4 Out"], "1748")
+        self.assertEqual(self.client.rangeOK_p, False)
+        self.client.fetchTags("/diagnostics_5.html", TAGS)
+        self.assertEqual(self.ranges[-1], None)
+
+    def testMissingTag(self):
+        values = self.client.fetchTags("/diagnostics_5.html", TAGS + ("Datalink B1 Out",))
+        self.assertEqual(values["Datalink B1 Out"], "0")
+        self.assertEqual(values["Datalink A1 Out"], "600")
+
+    def testReconnect(self):
+        self.client.fetchTags("/diagnostics_5.html", TAGS)
+        self.client.fetchTags("/diagnostics_5.html", TAGS)
+        # the drive drops the idle connection
+        self.client.conn.sock.close()
+        self.assertEqual(self.client.fetchTags("/diagnostics_5.html", TAGS)["Datalink A2 Out"], "12")
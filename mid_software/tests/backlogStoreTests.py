@@ -0,0 +1,101 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import unittest
+import os
+import shutil
+import tempfile
+import datetime
+import backlogStore
+import MID
+
+def readingTime(i):
+    return datetime.datetime(2019, 1, 1) + datetime.timedelta(minutes=3*i)
+
+def reading(i):
+    return [{"sensor_id": i, "value": i*1.5, "datetime": readingTime(i).isoformat()}]
+
+class FakeWWW:
+    bulkUploadPath = "/resources/data/mid_bulk"
+
+    def __init__(self):
+        self.uploads = []
+
+    def uploadReadingsBulk(self, passwd, readings):
+        self.uploads.append(readings)
+
+class backlogStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def testReplayInBatches(self):
+        store = backlogStore.BacklogStore(self.path, segmentBytes=200, syncEvery=3)
+        self.assertTrue(store.empty_p())
+        for i in range(10):
+            store.append(readingTime(i), reading(i))
+        self.assertTrue(len(store.segments) > 1)
+        self.assertFalse(store.empty_p())
+        (readings, position) = store.readBatch(4)
+        self.assertEqual([r[1] for r in readings], [reading(i) for i in range(4)])
+        self.assertEqual(readings[0][0], readingTime(0).isoformat())
+        store.ack(position)
+        store.close()
+        # acked position survives a restart
+        store = backlogStore.BacklogStore(self.path, segmentBytes=200)
+        (readings, position) = store.readBatch(100)
+        self.assertEqual([r[1] for r in readings], [reading(i) for i in range(4, 10)])
+        store.ack(position)
+        self.assertTrue(store.empty_p())
+        self.assertEqual(len(store.segments), 1)
+        # appends after a restart go after what was there
+        store.append(readingTime(10), reading(10))
+        self.assertEqual([r[1] for r in store.readBatch(100)[0]], [reading(10)])
+
+    def testTornReading(self):
+        store = backlogStore.BacklogStore(self.path)
+        store.append(readingTime(0), reading(0))
+        store.close()
+        f = open(store.segmentPath(store.segments[-1]), "ab")
+        f.write('{"datetime":"2019-01-01T00:03:00","da')
+        f.close()
+        store = backlogStore.BacklogStore(self.path)
+        store.append(readingTime(1), reading(1))
+        self.assertEqual([r[1] for r in store.readBatch(100)[0]], [reading(0), reading(1)])
+
+    def testSizeCapEvictsOldest(self):
+        store = backlogStore.BacklogStore(self.path, segmentBytes=200, maxBytes=600)
+        for i in range(40):
+            store.append(readingTime(i), reading(i))
+        self.assertTrue(store.sizeBytes() <= 600 + 200)
+        readings = store.readBatch(100)[0]
+        self.assertTrue(0 < len(readings) < 40)
+        self.assertEqual(readings[-1][1], reading(39))
+
+    def testReplaySkipsUnreadable(self):
+        store = backlogStore.BacklogStore(self.path)
+        store.append(readingTime(0), reading(0))
+        store.close()
+        f = open(store.segmentPath(store.segments[-1]), "ab")
+        for i in range(3):
+            f.write('{"datetime":"2019-01-01T00:03:00"}\n')
+        f.close()
+        store = backlogStore.BacklogStore(self.path)
+        WWWcon = FakeWWW()
+        self.assertEqual(MID.postStoredData(WWWcon, store, "pass", batchSize=1), 1)
+        # batches of nothing but unreadable readings are acked, not uploaded
+        self.assertEqual(WWWcon.uploads, [[(readingTime(0).isoformat(), reading(0))]])
+        self.assertTrue(store.empty_p())
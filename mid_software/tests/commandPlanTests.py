@@ -0,0 +1,87 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import unittest
+import json
+import time
+import hubComm
+import hubPackets
+
+def trhJSON(port, addy):
+    return {"type": "temp_rh", "port": port, "addy": addy,
+            "temp_id": 100+addy, "rh_id": 200+addy,
+            "temp_convert": "x", "rh_convert": "x", "temp_bias": 0, "rh_bias": 0}
+
+def tachJSON(port, addy):
+    return {"type": "tach", "port": port, "addy": addy, "sensor_id": 300+addy,
+            "convert": None, "bias": 0}
+
+def pressureJSON(port, addy):
+    return {"type": "pressure", "port": port, "addy": addy, "sensor_id": 400+addy,
+            "convert": "x", "bias": 0}
+
+def mptJSON(port, addy, ch, sid, addrs):
+    return {"type": "MP_T", "port": port, "addy": addy, "sensor_id": sid,
+            "sensor_extra_info": json.dumps({"ch": ch, "addrs": addrs})}
+
+WWW_CFG = {"commandInfo": [trhJSON(1, 1), trhJSON(1, 2), trhJSON(2, 3), tachJSON(3, 4), pressureJSON(1, 5)]}
+
+class commandPlanTests(unittest.TestCase):
+
+    def testCommandsReused(self):
+        plan = hubComm.CommandPlan(WWW_CFG)
+        cmds = plan.commands()
+        self.assertEqual(len(cmds), 3 + hubPackets.PRESSURE_SAMPLES_PER_READING + 1)
+        trh = cmds[0]
+        trh.tempRaw = [1, 2]
+        cmds.append("not in the plan")
+        again = plan.commands()
+        self.assertEqual(len(again), len(cmds) - 1)
+        self.assertTrue(again[0] is trh)
+        self.assertEqual(trh.tempRaw, [])
+
+    def testNewConfigRebuilds(self):
+        plan = hubComm.CommandPlan(WWW_CFG)
+        trh = plan.commands()[0]
+        plan.setConfig({"commandInfo": [tachJSON(3, 4)]})
+        cmds = plan.commands()
+        self.assertEqual(len(cmds), 1)
+        self.assertFalse(cmds[0] is trh)
+
+    def testChunkedBy32(self):
+        cfg = {"commandInfo": [tachJSON(2, a) for a in range(70)] + [pressureJSON(1, a) for a in range(33)]}
+        cmds = hubComm.allCmdsFromJSON(cfg)
+        tach = [c for c in cmds if isinstance(c, hubPackets.HubTachCmd)]
+        self.assertEqual([len(c.addy) for c in tach], [32, 32, 6])
+        self.assertEqual(sum([c.addy for c in tach], []), range(70))
+        kpa = [c for c in cmds if isinstance(c, hubPackets.HubPressureWideCmd)]
+        self.assertEqual([len(c.addy) for c in kpa], [32, 1] * hubPackets.PRESSURE_SAMPLES_PER_READING)
+
+    def testMPTgrouping(self):
+        cfg = [mptJSON(1, 7, 0, 1, ["10"]), mptJSON(2, 7, 0, 2, []), mptJSON(1, 7, 0, 3, ["1f"]),
+               mptJSON(1, 7, 1, 4, ["20"])]
+        superCmds = [c for c in hubComm.multiPtCmdsFromJSON(cfg) if isinstance(c, hubPackets.MultiTSuperCmd)]
+        self.assertEqual([(c.port, c.addy, c.MPTchannel, c.sensorIDs, c.MPTaddys) for c in superCmds],
+                         [(1, [7], 0, [1, 3], [[0x10], [0x1f]]), (1, [7], 1, [4], [[0x20]]),
+                          (2, [7], 0, [2], None)])
+
+    def testLargeConfig(self):
+        rows = []
+        for port in range(1, 7):
+            rows += [trhJSON(port, a) for a in range(300)] + [tachJSON(port, a) for a in range(200)] + \
+                [pressureJSON(port, a) for a in range(200)]
+            rows += [mptJSON(port, a/6, a % 4, a, ["%x" % a]) for a in range(120)]
+        startTime = time.time()
+        cmds = hubComm.allCmdsFromJSON({"commandInfo": rows})
+        self.assertTrue(time.time() - startTime < 2.0)
+        self.assertTrue(max([len(c.addy) for c in cmds]) <= 32)
@@ -0,0 +1,45 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import unittest
+import conversion
+
+class conversionTests(unittest.TestCase):
+
+    def testEvalConversion(self):
+        self.assertAlmostEqual(conversion.evalConversion("-40.2+0.018*x", 1000), -22.2)
+        self.assertAlmostEqual(conversion.evalConversion("x+t", 1, 2), 3.0)
+        self.assertAlmostEqual(conversion.evalConversion("sqrt(x)", 16), 4.0)
+
+    def testNoBuiltins(self):
+        self.assertRaises(Exception, conversion.evalConversion, "__import__('os')", 0)
+
+    def testCompiledOnce(self):
+        code = conversion.compileConversion("x*2.5")
+        self.assertTrue(conversion.compileConversion("x*2.5") is code)
+
+    def testCacheBounded(self):
+        for i in range(conversion.COMPILED_CACHE_SIZE + 10):
+            conversion.compileConversion("x+%d" % i)
+        self.assertEqual(len(conversion._compiled), conversion.COMPILED_CACHE_SIZE)
+        self.assertFalse("x+0" in conversion._compiled)
+
+    def testBatch(self):
+        self.assertEqual(conversion.evalConversionBatch("x/2", [2, 4, 6]), [1.0, 2.0, 3.0])
+        self.assertEqual(conversion.evalConversionBatch("x-t", [2, 4], [1, 1]), [1.0, 3.0])
+
+    def testArray(self):
+        ys = conversion.evalConversionArray(["x*2", "sqrt(x)", "x if x > 1 else 0", "x/0"], [1, 16, 3, 2])
+        self.assertEqual(ys[:3].tolist(), [2.0, 4.0, 3.0])
+        self.assertTrue(conversion.np.isnan(ys[3]))
+        self.assertEqual(conversion.evalConversionArray("x+t", [1, 2], [1, 1]).tolist(), [2.0, 3.0])
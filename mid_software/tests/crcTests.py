@@ -0,0 +1,63 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import unittest
+import random
+import struct
+import StringIO
+import crc
+import FujiInterface
+from crc_algorithms import Crc
+
+class crcTests(unittest.TestCase):
+    def setUp(self):
+        rand = random.Random(14)
+        self.frames = ["".join([chr(rand.randint(0, 255)) for i in range(rand.randint(0, 40))]) for j in range(50)]
+
+    def testCheckValues(self):
+        self.assertEqual(crc.crc16Modbus("123456789"), 0x4B37)
+        self.assertEqual(crc.crc8Maxim("123456789"), 0xA1)
+
+    def testMatchesBitByBit(self):
+        modbus = Crc(width=16, poly=0x8005, reflect_in=True, xor_in=0xFFFF, reflect_out=True, xor_out=0x0000)
+        maxim = Crc(width=8, poly=0x31, reflect_in=True, xor_in=0x00, reflect_out=True, xor_out=0x00)
+        self.assertEqual(crc.crc16ModbusMany(self.frames), [modbus.bit_by_bit(f) for f in self.frames])
+        self.assertEqual(crc.crc8MaximMany(self.frames), [maxim.bit_by_bit(f) for f in self.frames])
+
+    def testIncremental(self):
+        data = "".join(self.frames)
+        view = memoryview(data)
+        (c16, c8) = (crc.MODBUS_INIT, crc.MAXIM_INIT)
+        for i in range(0, len(data), 7):
+            c16 = crc.crc16Modbus(view[i:i+7], c16)
+            c8 = crc.crc8Maxim(view[i:i+7], c8)
+        self.assertEqual(c16, crc.crc16Modbus(data))
+        self.assertEqual(c8, crc.crc8Maxim(bytearray(data)))
+
+    def testVerify(self):
+        frame = crc.appendModbusCRC(struct.pack(">BBBBH", 1, 3, 0x03, 0xEA, 1))
+        self.assertTrue(crc.modbusCRC_p(frame))
+        self.assertFalse(crc.modbusCRC_p(frame[:3] + "\xff" + frame[4:]))
+        self.assertFalse(crc.modbusCRC_p(""))
+        unit = "DERV" + chr(7)
+        self.assertTrue(crc.maximCRC_p(unit + chr(crc.crc8Maxim(unit))))
+
+    def testFujiReply(self):
+        cmd = FujiInterface.FujiPXR4ReadSVCmd(1, 42)
+        self.assertEqual(cmd.createPacket(True), crc.appendModbusCRC(cmd.createPacket()))
+        rply = crc.appendModbusCRC(struct.pack(">BBBH", 1, 3, 2, 1234))
+        cmd.processReply(StringIO.StringIO(rply))
+        self.assertEqual(cmd.getSV(), 123.4)
+        cmd = FujiInterface.FujiPXR4ReadSVCmd(1, 42)
+        self.assertRaises(FujiInterface.FujiPXR4RplyCRCError, cmd.processReply,
+                          StringIO.StringIO(rply[:-1] + chr(ord(rply[-1]) ^ 1)))
@@ -0,0 +1,86 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import unittest
+import threading
+import time
+import devicePoller
+
+class DevicePollerTests(unittest.TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.calls = []
+        self.running = {}
+        self.maxRunning = 0
+
+    def call(self, device, name, seconds=0.05):
+        def call():
+            with self.lock:
+                self.running[device] = self.running.get(device, 0) + 1
+                self.maxRunning = max(self.maxRunning, sum(self.running.values()))
+                self.assertEqual(self.running[device], 1)
+            time.sleep(seconds)
+            with self.lock:
+                self.running[device] -= 1
+                self.calls.append((device, name))
+        return call
+
+    def testParallel(self):
+        poller = devicePoller.DevicePoller(maxWorkers=4, deviceTimeout=5)
+        startTime = time.time()
+        for d in range(4):
+            poller.start(d, [self.call(d, "RC"), self.call(d, "RO")])
+        tasks = poller.wait()
+        self.assertTrue(time.time() - startTime < 0.35)
+        self.assertEqual(self.maxRunning, 4)
+        self.assertTrue(all([t.ok_p() for t in tasks]))
+        # calls to one device stay in order
+        for d in range(4):
+            self.assertEqual([n for (dev, n) in self.calls if dev == d], ["RC", "RO"])
+
+    def testBounded(self):
+        poller = devicePoller.DevicePoller(maxWorkers=2, deviceTimeout=5)
+        for d in range(6):
+            poller.start(d, [self.call(d, "RO")])
+        self.assertEqual(len(poller.wait()), 6)
+        self.assertEqual(self.maxRunning, 2)
+
+    def testErrors(self):
+        poller = devicePoller.DevicePoller(maxWorkers=2)
+        def fail():
+            raise IOError("no route to host")
+        good = poller.start("10.0.0.5", [self.call("10.0.0.5", "RO")])
+        bad = poller.start("10.0.0.6", [fail, self.call("10.0.0.6", "RO")])
+        poller.wait()
+        self.assertTrue(good.ok_p())
+        self.assertFalse(bad.ok_p())
+        # later calls still made
+        self.assertEqual(len(self.calls), 2)
+
+    def testTimeout(self):
+        poller = devicePoller.DevicePoller(maxWorkers=1, deviceTimeout=0.2)
+        release = threading.Event()
+        stuck = poller.start("stuck", [release.wait])
+        fine = poller.start("fine", [self.call("fine", "RO")])
+        startTime = time.time()
+        poller.wait()
+        self.assertTrue(time.time() - startTime < 1.0)
+        self.assertTrue(stuck.timedOut_p)
+        self.assertTrue(fine.ok_p())
+        # the stuck device is skipped until its call returns
+        self.assertEqual(poller.start("stuck", [self.call("stuck", "RO")]), None)
+        release.set()
+        time.sleep(0.05)
+        again = poller.start("stuck", [self.call("stuck", "RO")])
+        poller.wait()
+        self.assertTrue(again.ok_p())
@@ -0,0 +1,92 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import unittest
+import datetime
+import DMMCCmd
+
+class FakeSlots:
+    """Opens FakeSpiDevs whose readings cycle through the values given per (slot, channel)."""
+    def __init__(self, values, failing=()):
+        self.values = values
+        self.failing = failing
+        self.calls = {}
+        self.opened = []
+
+    def readings(self, slot, channel):
+        if slot in self.failing:
+            raise IOError("no such device")
+        n = self.calls.get((slot, channel), 0)
+        self.calls[(slot, channel)] = n + 1
+        values = self.values[(slot, channel)]
+        return values[n % len(values)]
+
+    def open(self, slot):
+        spi = DMMCCmd.FakeSpiDev(slot, self.readings)
+        self.opened.append(spi)
+        return spi
+
+def dmJSON(sensorID, slot, channel, **kw):
+    d = {"type": "dm_mc", "sensor_id": sensorID, "port": slot, "addy": channel,
+         "convert": "x/10.", "bias": 1.0}
+    d.update(kw)
+    return d
+
+class dmmcTests(unittest.TestCase):
+    def setUp(self):
+        self.slots = FakeSlots({(0, 0): [100, 110, 90, 4000, 0], (0, 1): [2000],
+                                (1, 3): [7, 9]})
+        self.oldSampler = DMMCCmd.SAMPLER
+        DMMCCmd.SAMPLER = DMMCCmd.SPISampler(self.slots.open)
+
+    def tearDown(self):
+        DMMCCmd.SAMPLER = self.oldSampler
+
+    def testReduce(self):
+        self.assertEqual(DMMCCmd.trimmedMean([5, 1, 9, 3]), 4.0)
+        self.assertEqual(DMMCCmd.trimmedMean([7, 7, 7]), 7.0)
+        self.assertEqual(DMMCCmd.trimmedMean([2, 4]), 3.0)
+        self.assertEqual(DMMCCmd.median([5, 1, 9, 3]), 4.0)
+        self.assertEqual(DMMCCmd.median([5, 1, 9]), 5.0)
+
+    def testProcess(self):
+        cmds = DMMCCmd.processDMMCCommands([dmJSON(1, 0, 1, samples=5), dmJSON(2, 0, 2),
+                                            dmJSON(3, 1, 4, samples=4), {"type": "temp"}])
+        self.assertEqual([c.raw_data for c in cmds], [100.0, 2000.0, 8.0])
+        self.assertEqual(cmds[0].value, 11.0)
+        self.assertEqual(self.slots.calls, {(0, 0): 5, (0, 1): 18, (1, 3): 4})
+        data = cmds[1].to_JSON_WWW_data(datetime.datetime(2019, 1, 1))
+        self.assertEqual((data[0]["sensor_id"], data[0]["value"]), (2, 201.0))
+
+    def testSlotsKeptOpen(self):
+        for i in range(3):
+            DMMCCmd.processDMMCCommands([dmJSON(1, 0, 1), dmJSON(3, 1, 4)])
+        self.assertEqual([spi.slot for spi in self.slots.opened], [0, 1])
+
+    def testSlotFailure(self):
+        self.slots.failing = (1,)
+        cmds = DMMCCmd.processDMMCCommands([dmJSON(1, 0, 1), dmJSON(3, 1, 4)])
+        self.assertFalse(cmds[0].error)
+        self.assertTrue(cmds[1].error)
+        self.assertEqual(cmds[1].to_JSON_WWW_data(datetime.datetime(2019, 1, 1)), [])
+        self.assertTrue(self.slots.opened[1].closed_p)
+        # reopened on the next cycle
+        self.slots.failing = ()
+        cmds = DMMCCmd.processDMMCCommands([dmJSON(3, 1, 4)])
+        self.assertFalse(cmds[0].error)
+        self.assertEqual(len(self.slots.opened), 3)
+
+    def testExecute(self):
+        cmd = DMMCCmd.DMMCCmd(sensorID=9, slot=0, channel=2, convertPy="x", bias=0.5, samples=3)
+        cmd.execute()
+        self.assertEqual(cmd.value, 2000.5)
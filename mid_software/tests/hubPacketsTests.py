@@ -0,0 +1,103 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import unittest
+import struct
+import hubPackets
+import hubComm
+
+def readingsRply(cc, n, data):
+    return struct.pack("BBBB", 1, len(data)+1, cc, n) + data
+
+def errorRply(pairs):
+    return struct.pack("BB", 4, len(pairs)) + "".join([struct.pack("BB", c, a) for (c, a) in pairs])
+
+class ParseOnlyHubComm(hubComm.HubComm):
+    def __init__(self):
+        pass
+
+class hubPacketsTests(unittest.TestCase):
+
+    def testTempHumReply(self):
+        cmd = hubPackets.HubTempHumCmd([(1, 2), (3, 4)], port=1, addy=[5, 6],
+                                       convertPy=[("-40.2+0.018*x", "x+t"), ("log(x)", "x")],
+                                       bias=[(0, 1), (0, 0)])
+        rply = readingsRply(hubPackets.HubCmd.TEMP_HUM_CODE, 2, struct.pack("<HHHH", 1000, 50, 0, 60))
+        try:
+            cmd.processReply(hubPackets.RplyCursor(rply))
+            self.fail("bad eng value not reported")
+        except hubPackets.HubRplyEngValueError as e:
+            self.assertEqual(e.idxs, [3, 4])
+        self.assertEqual(cmd.tempRaw, [1000, 0])
+        self.assertEqual(cmd.humidityRaw, [50, 60])
+        self.assertAlmostEqual(cmd.tempEng[0], -22.2)
+        self.assertAlmostEqual(cmd.humidityEng[0], 28.8)
+        self.assertEqual(cmd.tempEng[1], 0)
+
+    def testShortReply(self):
+        cmd = hubPackets.HubPressureWideCmd([1, 2], 1, [5, 6], ["x", "x"], [0, 0])
+        rply = readingsRply(hubPackets.HubCmd.PRESSURE_WIDE_CODE, 2, struct.pack("<I", 70000))
+        self.assertRaises(hubPackets.HubRplyParseError, cmd.processReply, hubPackets.RplyCursor(rply))
+
+    def testWindReply(self):
+        cmd = hubPackets.HubWindCmd([1, 2], 1, [5, 6], ["x*2", "x/0"], [0, 1])
+        cmd.processReply(hubPackets.RplyCursor(readingsRply(hubPackets.HubCmd.WIND_CODE, 2, struct.pack("<HH", 3, 4))))
+        self.assertEqual(cmd.wind, [3, 4])
+        self.assertEqual(cmd.windEng, [6.0, None])
+
+    def testFramePackets(self):
+        rply = errorRply([(1, 0), (9, 1)]) + readingsRply(hubPackets.HubCmd.TACH_CODE, 1, struct.pack("<H", 7))
+        pkt = hubPackets.framePacket(rply)
+        self.assertEqual((pkt.code, pkt.start, pkt.size, pkt.cc), (4, 0, 6, None))
+        pkt = hubPackets.framePacket(rply, pkt.end)
+        self.assertEqual((pkt.code, pkt.start, pkt.size, pkt.cc), (1, 6, 6, hubPackets.HubCmd.TACH_CODE))
+        self.assertEqual(hubPackets.framePacket(rply, pkt.end), None)
+        self.assertEqual(hubPackets.replyCmdCode(rply), hubPackets.HubCmd.TACH_CODE)
+        self.assertEqual(hubPackets.replyCmdCode(errorRply([(1, 0)])), None)
+
+    def testParseMixedReply(self):
+        """error packets, readings and a packet declaring more data than it holds"""
+        cmd = hubPackets.HubTachCmd([1, 2], 1, [5, 6], bias=[0, 0])
+        rply = errorRply([(3, 1)]) + \
+            readingsRply(hubPackets.HubCmd.TACH_CODE, 2, struct.pack("<HHH", 100, 200, 300)) + \
+            errorRply([(9, 0)])
+        errorResp = ParseOnlyHubComm().parseReply(cmd, rply)
+        self.assertEqual(cmd.RPM, [100, 200])
+        self.assertEqual(errorResp.codes, [3, 9])
+        self.assertEqual(errorResp.addys, [1, 0])
+
+    def testParseCCMismatch(self):
+        cmd = hubPackets.HubTachCmd([1], 1, [5], bias=[0])
+        rply = readingsRply(hubPackets.HubCmd.WIND_CODE, 1, struct.pack("<H", 100)) + errorRply([(9, 0)])
+        errorResp = ParseOnlyHubComm().parseReply(cmd, rply)
+        self.assertEqual(cmd.RPM, [])
+        self.assertEqual(errorResp.codes, [hubPackets.HubErrorResponse.PARSE_ERROR_CODE, 9])
+
+    def testPing(self):
+        ping = hubPackets.HubPing(123)
+        ParseOnlyHubComm().parseReply(ping, struct.pack("<BH", 3, 124))
+        self.assertTrue(ping.check())
+
+    def testReset(self):
+        cmd = hubPackets.HubWindCmd([1, 2], 1, [5, 6], ["x*2", "x"], [0, 1])
+        rply = readingsRply(hubPackets.HubCmd.WIND_CODE, 2, struct.pack("<HH", 3, 4))
+        cmd.processReply(hubPackets.RplyCursor(rply))
+        cmd.reset()
+        self.assertEqual((cmd.wind, cmd.windEng, cmd.rplyAddrLen), ([], [], -1))
+        cmd.processReply(hubPackets.RplyCursor(rply))
+        self.assertEqual(cmd.windEng, [6.0, 5.0])
+
+    def testDs18b20Array(self):
+        raws = range(0, 0x10000, 7)
+        self.assertEqual(hubPackets.ds18b20_conversion_array(raws).tolist(),
+                         [hubPackets.ds18b20_conversion(r) for r in raws])
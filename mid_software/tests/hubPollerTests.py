@@ -0,0 +1,86 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import unittest
+import struct
+import hubComm
+import hubPackets
+
+class FakeHubComm(hubComm.HubComm):
+    """Answers tach cmds in the order they were sent, RPM = address."""
+    def __init__(self, timeoutAddrs=()):
+        self.sent = []
+        self.pending = []
+        self.cleared = 0
+        self.timeoutAddrs = timeoutAddrs
+
+    def sendCommand(self, cmd, clear=True):
+        if not cmd.createPacket():
+            return False
+        self.sent.append(cmd)
+        self.pending.append(cmd)
+        return True
+
+    def recvReply(self, cmd):
+        cmd = self.pending.pop(0)
+        if cmd.addy[0] in self.timeoutAddrs:
+            raise hubPackets.HubTimeoutError(cmd)
+        return struct.pack("BBBB", 1, 2*len(cmd.addy)+1, cmd.cmd, len(cmd.addy)) + \
+            "".join([struct.pack("<H", a) for a in cmd.addy])
+
+    def clearComm(self):
+        self.cleared += 1
+        self.pending = []
+
+def tachCmd(port, addr):
+    return hubPackets.HubTachCmd(sensorID=[addr], port=port, addy=[addr], bias=[0])
+
+class hubPollerTests(unittest.TestCase):
+
+    def testPortOrderKept(self):
+        """commands on a port keep their order, ports are interleaved"""
+        cmds = [tachCmd(1, 10), tachCmd(1, 11), tachCmd(1, 12), tachCmd(2, 20), tachCmd(2, 21)]
+        hubCon = FakeHubComm()
+        results = hubComm.HubPoller(hubCon).run(cmds)
+        self.assertEqual([c.addy[0] for c in hubCon.sent], [10, 20, 11, 21, 12])
+        self.assertEqual(len(results), len(cmds))
+        for cmd in cmds:
+            self.assertEqual(cmd.RPM, cmd.addy)
+
+    def testPortTimes(self):
+        cmds = [tachCmd(1, 10), tachCmd(3, 30)]
+        poller = hubComm.HubPoller(FakeHubComm())
+        poller.run(cmds)
+        self.assertEqual(sorted(poller.portTimes.keys()), [1, 3])
+        self.assertEqual(poller.portTimes[1][0], 1)
+
+    def testTimeoutReported(self):
+        cmds = [tachCmd(1, 10), tachCmd(2, 20)]
+        hubCon = FakeHubComm(timeoutAddrs=(10,))
+        results = dict((cmd.addy[0], err) for (cmd, err) in hubComm.HubPoller(hubCon).run(cmds))
+        self.assertEqual(results[10].codes, [hubPackets.HubErrorResponse.TIMEOUT_ERROR_CODE])
+        self.assertTrue(results[20].isEmpty_p())
+        self.assertEqual(hubCon.cleared, 1)
+
+    def testSuperCmdsNotSent(self):
+        superCmd = hubPackets.HubPressureWideSuperCmd()
+        hubCon = FakeHubComm()
+        results = hubComm.HubPoller(hubCon).run([tachCmd(1, 10), superCmd])
+        self.assertEqual(len(results), 2)
+        self.assertEqual(len(hubCon.sent), 1)
+
+    def testMatchReply(self):
+        cmds = [tachCmd(1, 10), hubPackets.HubTempHumCmd([(1, 2)], port=2, addy=[5])]
+        rply = struct.pack("BBBB", 4, 1, 4, 1) + struct.pack("BBBB", 1, 5, hubPackets.HubCmd.TEMP_HUM_CODE, 1)
+        self.assertEqual(hubComm.matchReply(rply, cmds), 1)
+        self.assertEqual(hubComm.matchReply(struct.pack("<BH", 3, 5), cmds), 0)
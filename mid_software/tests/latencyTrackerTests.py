@@ -0,0 +1,74 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import unittest
+import hubComm
+import hubPackets
+
+def tachCmd(port, addrs):
+    return hubPackets.HubTachCmd(sensorID=addrs, port=port, addy=addrs, bias=[0]*len(addrs))
+
+class latencyTrackerTests(unittest.TestCase):
+
+    def testColdStartUsesHubBound(self):
+        tracker = hubComm.LatencyTracker(baseTimeout=2, perAddrTimeout=4)
+        self.assertEqual(tracker.timeoutFor(tachCmd(1, range(32))), 130)
+        tracker = hubComm.LatencyTracker(baseTimeout=2, perAddrTimeout=4, ceiling=45)
+        self.assertEqual(tracker.timeoutFor(tachCmd(1, range(32))), 45)
+
+    def testLearnedTimeout(self):
+        tracker = hubComm.LatencyTracker(minSamples=10, margin=2, floor=1, perAddrTimeout=1)
+        cmd = tachCmd(1, range(4))
+        for i in range(9):
+            tracker.record(cmd, 1.5)
+        self.assertEqual(tracker.timeoutFor(cmd), tracker.boundFor(tracker.key(cmd)))
+        tracker.record(cmd, 1.5)
+        self.assertAlmostEqual(tracker.timeoutFor(cmd), 3.0)
+        # other ports, codes and address counts are tracked separately
+        self.assertEqual(tracker.timeoutFor(tachCmd(2, range(4))), tracker.boundFor((2, cmd.cmd, 4)))
+        self.assertEqual(tracker.timeoutFor(tachCmd(1, range(5))), tracker.boundFor((1, cmd.cmd, 5)))
+        # never below one unit's worth over the fastest reply
+        for i in range(200):
+            tracker.record(cmd, 0.01)
+        self.assertAlmostEqual(tracker.timeoutFor(cmd), 1.01)
+        # nor below the floor
+        tracker.floor = 2
+        self.assertEqual(tracker.timeoutFor(cmd), 2)
+
+    def testDeadUnit(self):
+        tracker = hubComm.LatencyTracker(minSamples=10, margin=1.5, floor=1, baseTimeout=2, perAddrTimeout=4.5)
+        cmd = tachCmd(1, range(4))
+        for i in range(50):
+            tracker.record(cmd, 0.2)
+        # the hub waits up to 4 s on a silent unit before its partial reply
+        self.assertTrue(tracker.timeoutFor(cmd) > 0.2 + 4.0)
+        self.assertTrue(tracker.timeoutFor(cmd) < tracker.boundFor(tracker.key(cmd)))
+        # a timeout falls back to the bound until the hub answers again
+        tracker.timedOut(cmd)
+        self.assertEqual(tracker.timeoutFor(cmd), tracker.boundFor(tracker.key(cmd)))
+        self.assertEqual(tracker.timeoutFor(cmd), tracker.boundFor(tracker.key(cmd)))
+        tracker.record(cmd, 4.3)
+        self.assertTrue(4.3 < tracker.timeoutFor(cmd) < tracker.boundFor(tracker.key(cmd)))
+
+    def testStats(self):
+        tracker = hubComm.LatencyTracker()
+        cmd = tachCmd(1, [5])
+        tracker.record(cmd, 1.0)
+        tracker.record(cmd, 3.0)
+        tracker.timedOut(tachCmd(2, [6]))
+        stats = tracker.stats()
+        self.assertEqual(stats[(1, cmd.cmd, 1)]["count"], 2)
+        self.assertAlmostEqual(stats[(1, cmd.cmd, 1)]["p50"], 2.0)
+        self.assertEqual(stats[(2, cmd.cmd, 1)]["timeouts"], 1)
+        self.assertEqual(stats[(2, cmd.cmd, 1)]["p99"], None)
+        self.assertTrue("port 2" in tracker.statsStr())
@@ -0,0 +1,86 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import unittest
+import tempfile
+import shutil
+import json
+import os
+import time
+import metrics
+import devicePoller
+
+class MetricsTests(unittest.TestCase):
+    def tearDown(self):
+        metrics.configure(False)
+
+    def testDisabled(self):
+        m = metrics.Metrics()
+        self.assertTrue(m.span("hub") is metrics.NULL_SPAN)
+        with m.span("hub"):
+            pass
+        m.record("hub", 1.0)
+        self.assertEqual(m.stats(), {})
+
+    def testStats(self):
+        m = metrics.Metrics(enabled=True, window=10)
+        for i in range(1, 21):
+            m.record("upload", i / 10.)
+        s = m.stats()["upload"]
+        # totals cover everything, percentiles the last 10
+        self.assertEqual(s["n"], 20)
+        self.assertAlmostEqual(s["total"], 21.0)
+        self.assertAlmostEqual(s["max"], 2.0)
+        self.assertAlmostEqual(s["p50"], 1.5)
+        self.assertAlmostEqual(s["p90"], 1.9)
+        self.assertAlmostEqual(s["p99"], 2.0)
+
+    def testSpan(self):
+        m = metrics.Metrics(enabled=True)
+        try:
+            with m.span("config"):
+                time.sleep(0.02)
+                raise ValueError("server down")
+        except ValueError:
+            pass
+        s = m.stats()["config"]
+        self.assertEqual(s["n"], 1)
+        self.assertTrue(0.015 < s["total"] < 1.0)
+
+    def testWrite(self):
+        tmpDir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpDir, "metrics.json")
+            m = metrics.Metrics(enabled=True)
+            m.record("cycle", 3.0)
+            m.write(path)
+            m.record("cycle", 5.0)
+            m.write(path)
+            lines = open(path).read().splitlines()
+            self.assertEqual(len(lines), 1)
+            written = json.loads(lines[0])
+            self.assertEqual(written["spans"]["cycle"]["n"], 2)
+            self.assertEqual(written["spans"]["cycle"]["max"], 5.0)
+            self.assertEqual(os.listdir(tmpDir), ["metrics.json"])
+        finally:
+            shutil.rmtree(tmpDir)
+
+    def testDevicePollerNames(self):
+        metrics.configure(True)
+        poller = devicePoller.DevicePoller(maxWorkers=2, deviceTimeout=5)
+        poller.start("10.0.0.1", [lambda: time.sleep(0.01)], "eth.modbus")
+        poller.start("10.0.0.2", [lambda: None])
+        poller.wait()
+        s = metrics.METRICS.stats()
+        self.assertEqual(s.keys(), ["eth.modbus"])
+        self.assertEqual(s["eth.modbus"]["n"], 1)
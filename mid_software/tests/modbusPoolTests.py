@@ -0,0 +1,233 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import unittest
+import socket
+import threading
+import time
+import EthModbusComm
+import devicePoller
+import MID
+
+class FakeRegisters:
+    def __init__(self, registers):
+        self.registers = registers
+
+    def getRegister(self, i):
+        return self.registers[i]
+
+    def isError(self):
+        return False
+
+class FakeException:
+    """Modbus exception response, which has no registers."""
+    def isError(self):
+        return True
+
+    def __str__(self):
+        return "Exception Response(131, 3, IllegalAddress)"
+
+class FakeClient:
+    """
+    ModbusTcpClient stand-in whose socket is one end of a socketpair.
+    Registers read from banks, every read is logged in reads.
+    """
+    made = []
+    slowConnect = threading.Event()
+    banks = {"holding": [1234, 7, 8, 9, 10],
+             "input": [11, 12, 1234, 150, 13]}
+
+    def __init__(self, host):
+        self.host = host
+        self.socket = None
+        self.peer = None
+        self.reads = []
+        self.fail = False
+        self.exception = False
+        FakeClient.made.append(self)
+
+    def connect(self):
+        if self.host.endswith(".99"):
+            return False
+        if self.host.endswith(".98"):
+            # a controller that takes until the test lets it go to answer
+            FakeClient.slowConnect.wait(5)
+        (self.socket, self.peer) = socket.socketpair()
+        return True
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.peer.close()
+        self.socket = None
+
+    def read(self, space, address, count):
+        self.reads.append((space, address, count))
+        if self.fail:
+            raise IOError("broken pipe")
+        if self.exception:
+            return FakeException()
+        return FakeRegisters(FakeClient.banks[space][address:address+count])
+
+    def read_holding_registers(self, address, count):
+        return self.read("holding", address, count)
+
+    def read_input_registers(self, address, count):
+        return self.read("input", address, count)
+
+    def write_register(self, address, value):
+        self.reads.append(("write", address, value))
+        if self.fail:
+            raise IOError("broken pipe")
+        if self.exception:
+            return FakeException()
+        return FakeRegisters([])
+
+class FakeWWW:
+    def __init__(self):
+        self.statuses = []
+
+    def RC_cmd_status(self, control_id, fetched_p):
+        self.statuses.append((control_id, fetched_p))
+
+class ModbusPoolTests(unittest.TestCase):
+    def setUp(self):
+        FakeClient.made = []
+        FakeClient.slowConnect.clear()
+        self.pool = EthModbusComm.ModbusPool(idleTimeout=60, minBackoff=10, maxBackoff=40,
+                                             clientFactory=FakeClient)
+
+    def tearDown(self):
+        self.pool.closeAll()
+
+    def pooled(self, cmd):
+        cmd.pool = self.pool
+        return cmd
+
+    def testReuse(self):
+        for i in range(3):
+            pv = self.pooled(EthModbusComm.Honeywell_UDC3500_getPV(1, "10.0.0.5"))
+            sp = self.pooled(EthModbusComm.Honeywell_UDC3500_getSP(2, "10.0.0.5"))
+            pv.execute()
+            sp.execute()
+            self.assertEqual(pv.PV, 123.4)
+            self.assertEqual(sp.SP, 123.4)
+        self.assertEqual(len(FakeClient.made), 1)
+        self.assertEqual(len(FakeClient.made[0].reads), 6)
+
+    def testReconnectAfterError(self):
+        pv = self.pooled(EthModbusComm.Honeywell_UDC3500_getPV(1, "10.0.0.5"))
+        pv.execute()
+        FakeClient.made[0].fail = True
+        pv.PV = None
+        pv.execute()
+        self.assertEqual(pv.PV, None)
+        self.assertEqual(FakeClient.made[0].socket, None)
+        pv.execute()
+        self.assertEqual(pv.PV, 123.4)
+        self.assertEqual(len(FakeClient.made), 2)
+
+    def testExceptionResponse(self):
+        pv = self.pooled(EthModbusComm.Honeywell_UDC3500_getPV(1, "10.0.0.5"))
+        pv.execute()
+        FakeClient.made[0].exception = True
+        pv.PV = None
+        pv.execute()
+        self.assertEqual(pv.PV, None)
+        # the controller answered, so its connection is kept
+        self.assertTrue(FakeClient.made[0].socket is not None)
+        FakeClient.made[0].exception = False
+        pv.execute()
+        self.assertEqual(pv.PV, 123.4)
+        self.assertEqual(len(FakeClient.made), 1)
+
+    def testSetSP(self):
+        sp = self.pooled(EthModbusComm.Honeywell_UDC3500_setSP(1, "10.0.0.5", 150.25))
+        sp.execute()
+        self.assertEqual(FakeClient.made[0].reads, [("write", 2, 1502)])
+        FakeClient.made[0].exception = True
+        self.assertRaises(Exception, sp.execute)
+        self.assertTrue(FakeClient.made[0].socket is not None)
+        FakeClient.made[0].fail = True
+        self.assertRaises(IOError, sp.execute)
+        self.assertEqual(FakeClient.made[0].socket, None)
+        sp = self.pooled(EthModbusComm.Honeywell_UDC3500_setSP(1, "10.0.0.99", 150.25))
+        self.assertRaises(EthModbusComm.ModbusConnectError, sp.execute)
+
+    def testFinishEthCommands(self):
+        poller = devicePoller.DevicePoller(maxWorkers=2, deviceTimeout=5)
+        RCcmds = [self.pooled(EthModbusComm.Honeywell_UDC3500_setSP(1, "10.0.0.5", 150.0)),
+                  self.pooled(EthModbusComm.Honeywell_UDC3500_setSP(2, "10.0.0.99", 150.0))]
+        ROcmds = [self.pooled(EthModbusComm.Honeywell_UDC3500_getPV(3, "10.0.0.5")),
+                  self.pooled(EthModbusComm.Honeywell_UDC3500_getPV(4, "10.0.0.99"))]
+        for IPaddr in ["10.0.0.5", "10.0.0.99"]:
+            calls = [rc.execute for rc in RCcmds if rc.slaveAddr == IPaddr]
+            reads = [ro for ro in ROcmds if ro.slaveAddr == IPaddr]
+            calls.append(lambda reads=reads: EthModbusComm.executeCmds(reads))
+            poller.start(IPaddr, calls)
+        WWWcon = FakeWWW()
+        ROs = MID.finishEthCommands(poller, (RCcmds, ROcmds, []), WWWcon)
+        self.assertEqual(WWWcon.statuses, [(1, 1), (2, 0)])
+        self.assertEqual([ro.sensorID for ro in ROs], [3, 4])
+        self.assertEqual(ROs[0].PV, 123.4)
+        self.assertEqual(ROs[1].PV, None)
+
+    def testStaleConnection(self):
+        client = self.pool.borrow("10.0.0.5")
+        self.pool.release("10.0.0.5")
+        # the controller hangs up while idle
+        client.peer.close()
+        self.assertFalse(EthModbusComm.alive_p(client))
+        self.assertTrue(self.pool.borrow("10.0.0.5") is not client)
+        self.assertEqual(len(FakeClient.made), 2)
+
+    def testBackoff(self):
+        self.assertRaises(EthModbusComm.ModbusConnectError, self.pool.borrow, "10.0.0.99")
+        self.assertRaises(EthModbusComm.ModbusConnectError, self.pool.borrow, "10.0.0.99")
+        self.assertEqual(len(FakeClient.made), 1)
+        self.assertEqual(self.pool.backoff["10.0.0.99"][1], 10)
+        # retry once the backoff has passed, then double it
+        self.pool.backoff["10.0.0.99"] = (time.time()-1, 10)
+        self.assertRaises(EthModbusComm.ModbusConnectError, self.pool.borrow, "10.0.0.99")
+        self.assertEqual(len(FakeClient.made), 2)
+        self.assertEqual(self.pool.backoff["10.0.0.99"][1], 20)
+        # other controllers are unaffected
+        self.pool.borrow("10.0.0.5")
+
+    def testConnectOutsideLock(self):
+        self.pool.borrow("10.0.0.5")
+        self.pool.release("10.0.0.5")
+        slow = threading.Thread(target=self.pool.borrow, args=("10.0.0.98",))
+        slow.start()
+        try:
+            while len(FakeClient.made) < 2:
+                time.sleep(0.01)
+            # a slow connect holds up neither connected nor new controllers
+            start = time.time()
+            self.pool.borrow("10.0.0.5")
+            self.pool.borrow("10.0.0.6")
+            self.assertTrue(time.time()-start < 1)
+        finally:
+            FakeClient.slowConnect.set()
+            slow.join()
+        self.assertEqual(sorted(self.pool.conns.keys()), ["10.0.0.5", "10.0.0.6", "10.0.0.98"])
+
+    def testEvictIdle(self):
+        self.pool.borrow("10.0.0.5")
+        self.pool.borrow("10.0.0.6")
+        self.pool.release("10.0.0.5")
+        self.pool.release("10.0.0.6")
+        self.pool.conns["10.0.0.6"].lastUsed -= 61
+        self.pool.evictIdle()
+        self.assertEqual(self.pool.conns.keys(), ["10.0.0.5"])
+        self.assertEqual(FakeClient.made[1].socket, None)
@@ -0,0 +1,73 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import unittest
+import datetime
+import EthModbusComm
+from tests.modbusPoolTests import FakeClient
+
+READING_TIME = datetime.datetime(2019, 1, 1)
+
+class ModbusReadPlanTests(unittest.TestCase):
+    def setUp(self):
+        FakeClient.made = []
+        self.pool = EthModbusComm.ModbusPool(clientFactory=FakeClient)
+
+    def tearDown(self):
+        self.pool.closeAll()
+
+    def cmds(self, IPaddr, sensorTypes, deviceID=EthModbusComm.HoneywellUDC3500_ID):
+        cmds = [EthModbusComm.factory(deviceID, t, 100+i, IPaddr) for (i, t) in enumerate(sensorTypes)]
+        for cmd in cmds:
+            cmd.pool = self.pool
+        return cmds
+
+    def testMergeAdjacent(self):
+        (pv, sp, out) = self.cmds("10.0.0.5", (EthModbusComm.PV_ID, EthModbusComm.SP_ID, EthModbusComm.OUTPUT_ID))
+        reads = EthModbusComm.planReads([pv, sp, out])
+        self.assertEqual([(r.space, r.start, r.count) for r in reads],
+                         [("holding", 0, 1), ("input", 2, 2)])
+        EthModbusComm.executeCmds([pv, sp, out])
+        self.assertEqual(FakeClient.made[0].reads, [("holding", 0, 1), ("input", 2, 2)])
+        self.assertEqual((pv.PV, sp.SP, out.output), (123.4, 123.4, 75.0))
+        self.assertEqual(out.to_JSON_WWW_data(READING_TIME)[0]["sensor_id"], 102)
+
+    def testPerController(self):
+        cmds = (self.cmds("10.0.0.5", (EthModbusComm.SP_ID, EthModbusComm.OUTPUT_ID)) +
+                self.cmds("10.0.0.6", (EthModbusComm.OUTPUT_ID, EthModbusComm.SP_ID),
+                          EthModbusComm.HoneywellUDC2500_ID))
+        EthModbusComm.executeCmds(cmds)
+        self.assertEqual([(c.host, c.reads) for c in FakeClient.made],
+                         [("10.0.0.5", [("input", 2, 2)]), ("10.0.0.6", [("input", 2, 2)])])
+        self.assertEqual([c.to_JSON_WWW_data(READING_TIME)[0]["value"] for c in cmds],
+                         [123.4, 75.0, 75.0, 123.4])
+
+    def testGaps(self):
+        (pv,) = self.cmds("10.0.0.5", (EthModbusComm.PV_ID,))
+        far = self.cmds("10.0.0.5", (EthModbusComm.PV_ID,))[0]
+        far.register = 3
+        self.assertEqual([(r.start, r.count) for r in EthModbusComm.planReads([pv, far])], [(0, 1), (3, 1)])
+        self.assertEqual([(r.start, r.count) for r in EthModbusComm.planReads([far, pv], maxGap=2)], [(0, 4)])
+        EthModbusComm.executeCmds([far, pv], maxGap=2)
+        self.assertEqual((pv.PV, far.PV), (123.4, 0.9))
+        far.register = EthModbusComm.MAX_READ_REGISTERS
+        self.assertEqual(len(EthModbusComm.planReads([pv, far], maxGap=1000)), 2)
+
+    def testFailedRead(self):
+        (sp, out) = self.cmds("10.0.0.5", (EthModbusComm.SP_ID, EthModbusComm.OUTPUT_ID))
+        self.pool.borrow("10.0.0.5")
+        FakeClient.made[0].fail = True
+        EthModbusComm.executeCmds([sp, out])
+        self.assertEqual((sp.SP, out.output), (None, None))
+        self.assertEqual(out.to_JSON_WWW_data(READING_TIME), [])
+        self.assertFalse("10.0.0.5" in self.pool.conns)
@@ -0,0 +1,99 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import unittest
+import struct
+import datetime
+import hubComm
+import hubPackets
+from tests.hubPollerTests import FakeHubComm
+
+class FakePressureHub(FakeHubComm):
+    """Answers pressure cmds with raw readings(addr, n), n counting the readings of addr."""
+    def __init__(self, readings):
+        FakeHubComm.__init__(self)
+        self.readings = readings
+        self.counts = {}
+
+    def reading(self, addr):
+        n = self.counts.get(addr, 0)
+        self.counts[addr] = n + 1
+        return struct.pack("<I", self.readings(addr, n))
+
+    def recvReply(self, cmd):
+        cmd = self.pending.pop(0)
+        return struct.pack("BBBB", 1, 4*len(cmd.addy)+1, cmd.cmd, len(cmd.addy)) + \
+            "".join([self.reading(a) for a in cmd.addy])
+
+def kpaJSON(sensorID, port, addy):
+    return {"type": "pressure", "port": port, "sensor_id": sensorID, "addy": addy,
+            "convert": "x/100.", "bias": 0}
+
+class pressureAccumulatorTests(unittest.TestCase):
+
+    def testAccumulator(self):
+        acc = hubPackets.SampleAccumulator([1, 2], 10, minSamples=4, tolerance=0.01)
+        for (i, e) in enumerate([1.0, None, float("nan"), 1.02, 0.98, 1.01, 9.0, 1.0, 0.99]):
+            acc.add([1, 2], [i, i], [e, 5.0])
+        self.assertEqual(list(acc.count), [7, 9])
+        estimates = dict([(sID, (raw, eng)) for (sID, raw, eng) in acc.estimates()])
+        # the 9.0 outlier is rejected
+        self.assertAlmostEqual(estimates[1][1], 1.0, 2)
+        self.assertEqual(estimates[2][1], 5.0)
+        self.assertTrue(acc.converged_p([2]))
+        acc.reset()
+        self.assertEqual(acc.estimates(), [])
+        self.assertFalse(acc.converged_p([2]))
+
+    def testRelativeTolerance(self):
+        # the same relative noise converges after as many readings at any scale
+        counts = []
+        for scale in (0.1, 1.0, 1000.0):
+            acc = hubPackets.SampleAccumulator([1], 20, minSamples=4, tolerance=0.0005)
+            n = 0
+            while not acc.converged_p([1]) and n < 20:
+                acc.add([1], [n], [scale * (1 + 0.001 * (n % 2))])
+                n += 1
+            counts.append(n)
+        self.assertEqual(counts, [counts[0]]*3)
+        self.assertTrue(counts[0] < 20)
+        # 1% noise is too much, even on a sensor reading in small units
+        acc = hubPackets.SampleAccumulator([1], 20, minSamples=4, tolerance=0.0005)
+        acc.add([1]*20, range(20), [0.1 * (1 + 0.01 * (n % 2)) for n in range(20)])
+        self.assertFalse(acc.converged_p([1]))
+        # and around zero it never converges
+        acc = hubPackets.SampleAccumulator([1], 20, minSamples=4, tolerance=0.0005)
+        acc.add([1]*20, range(20), [0.001 * (n % 2) for n in range(20)])
+        self.assertFalse(acc.converged_p([1]))
+
+    def testMethods(self):
+        # 100 is rejected
+        values = [1.0, 2.0, 3.0, 10.0, 100.0]
+        for (method, expected) in (("median", 2.5), ("mean", 4.0), ("trimmed", 4.0)):
+            acc = hubPackets.SampleAccumulator([1], 10, madCutoff=3.5, method=method)
+            acc.add([1]*5, values, values)
+            self.assertEqual(acc.estimates()[0][2], expected)
+
+    def testEarlyStop(self):
+        cmds = hubComm.kpaCmdsFromJSON([kpaJSON(100, 1, 10), kpaJSON(101, 1, 11), kpaJSON(102, 2, 12)])
+        # port 1 is steady, port 2 is noisy
+        hubCon = FakePressureHub(lambda a, n: 10000 + (a == 12) * 50 * (n % 2))
+        results = hubComm.HubPoller(hubCon).run(cmds)
+        self.assertEqual(len(results), len(cmds))
+        sentPorts = [c.port for c in hubCon.sent]
+        self.assertEqual(sentPorts.count(2), hubPackets.PRESSURE_SAMPLES_PER_READING)
+        # at most one more than needed as the next cmd is sent while a reply is parsed
+        self.assertTrue(hubPackets.PRESSURE_MIN_SAMPLES <= sentPorts.count(1) <= hubPackets.PRESSURE_MIN_SAMPLES + 1)
+        data = dict([(d["sensor_id"], d["value"]) for d in cmds[-1].to_JSON_WWW_data(datetime.datetime(2019, 1, 1))])
+        self.assertEqual(data[100], 100.0)
+        self.assertAlmostEqual(data[102], 100.25)
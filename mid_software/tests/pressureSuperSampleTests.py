@@ -12,6 +12,7 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 import unittest
+import datetime
 from tests import MIDhubTests
 import hubComm
 import hubPackets
@@ -35,10 +36,11 @@ class hubCommTests(unittest.TestCase):
                                            {"type":"pressure","port":2,"sensor_id":103,"addy":104,"convert":"x","bias":0}])       
         # make sure correct number of commands
         self.assertEqual(len(tstCmds),2*hubPackets.PRESSURE_SAMPLES_PER_READING+1) # +1 b/c of the super sample cmd itself
-        # throw some raw and eng data in there
+        # throw some raw and eng data in there, the way replies do
         for tci,tc in enumerate(tstCmds[:-1]):
-            tc.raw += [tci+10.]*2; tc.eng += [float(tci)]*2;
-        tstJSON = reduce(lambda x,y: x+y.to_JSON_WWW_data(), tstCmds, [])
+            tc.accumulator.add(tc.sensorID, [tci+10.]*2, [float(tci)]*2)
+        readingTime = datetime.datetime(2019, 1, 1)
+        tstJSON = reduce(lambda x,y: x+y.to_JSON_WWW_data(readingTime), tstCmds, [])
         self.assertEqual(len(tstJSON),4) # only super class should return a JSON item
 
     
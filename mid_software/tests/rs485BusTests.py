@@ -0,0 +1,105 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import unittest
+import struct
+import time
+import crc
+import serialComm
+import FujiInterface
+
+class FakeBus:
+    """
+    Stands in for the RS485 port: each write gets the next of replies,
+    handed out chunkSize bytes per read.  Writes are logged with their time.
+    """
+    def __init__(self, replies, chunkSize=3):
+        self.replies = list(replies)
+        self.chunkSize = chunkSize
+        self.pending = ""
+        self.writes = []
+        self.timeout = None
+
+    def flushInput(self):
+        self.pending = ""
+
+    def write(self, data):
+        self.writes.append((time.time(), data))
+        if self.replies:
+            self.pending += self.replies.pop(0)
+
+    def read(self, n):
+        data = self.pending[:min(n, self.chunkSize)]
+        self.pending = self.pending[len(data):]
+        return data
+
+    def close(self):
+        pass
+
+def readRply(value):
+    return crc.appendModbusCRC(struct.pack(">BBBH", 1, 3, 2, value))
+
+def writeRply(addy, value):
+    return crc.appendModbusCRC(struct.pack(">BBBBH", 1, 6, addy[0], addy[1], value))
+
+class rs485BusTests(unittest.TestCase):
+
+    def testFrameLength(self):
+        self.assertEqual(serialComm.rtuFrameLength("\x01"), None)
+        self.assertEqual(serialComm.rtuFrameLength("\x01\x03"), None)
+        self.assertEqual(serialComm.rtuFrameLength("\x01\x03\x04"), 9)
+        self.assertEqual(serialComm.rtuFrameLength("\x01\x06"), 8)
+        self.assertEqual(serialComm.rtuFrameLength("\x01\x83"), 5)
+
+    def testNoTimeoutWait(self):
+        bus = serialComm.SerialComm(timeout=5, serialDevice=FakeBus([readRply(1234), readRply(567)]))
+        startTime = time.time()
+        cmds = [FujiInterface.FujiPXR4ReadSVCmd(1, 10), FujiInterface.FujiPXR4ReadSVCmd(1, 11)]
+        results = bus.runCmds(cmds)
+        self.assertTrue(time.time() - startTime < 0.5)
+        self.assertEqual([e for (c, e) in results], [None, None])
+        self.assertEqual([c.getSV() for c in cmds], [123.4, 56.7])
+
+    def testPortTimeoutRestored(self):
+        fake = FakeBus([readRply(1234), ""])
+        fake.timeout = 1.0
+        bus = serialComm.SerialComm(timeout=0.05, serialDevice=fake)
+        bus.runCmds([FujiInterface.FujiPXR4ReadSVCmd(1, 10), FujiInterface.FujiPXR4ReadSVCmd(1, 11)])
+        self.assertEqual(fake.timeout, 1.0)
+
+    def testInterFrameGap(self):
+        fake = FakeBus([readRply(1), readRply(2)])
+        bus = serialComm.SerialComm(baudrate=9600, serialDevice=fake)
+        bus.runCmds([FujiInterface.FujiPXR4ReadSVCmd(1, 10), FujiInterface.FujiPXR4ReadSVCmd(1, 11)])
+        self.assertTrue(fake.writes[1][0] - fake.writes[0][0] >= serialComm.interFrameGap(9600))
+
+    def testWritesFirst(self):
+        setSV = FujiInterface.FujiPXR4SetSVCmd(1, 7, 50.0)
+        fake = FakeBus([writeRply(setSV.addy, 500), readRply(500)])
+        bus = serialComm.SerialComm(serialDevice=fake)
+        readSV = FujiInterface.FujiPXR4ReadSVCmd(1, 10)
+        results = bus.runCmds([readSV, setSV])
+        self.assertEqual([c for (c, e) in results], [setSV, readSV])
+        self.assertEqual([e for (c, e) in results], [None, None])
+        self.assertEqual(ord(fake.writes[0][1][1]), 0x06)
+        self.assertEqual(readSV.getSV(), 50.0)
+
+    def testBadReplies(self):
+        bad = readRply(1234)
+        bad = bad[:-1] + chr(ord(bad[-1]) ^ 0xFF)
+        bus = serialComm.SerialComm(timeout=0.05, serialDevice=FakeBus([bad, "", readRply(1)]))
+        cmds = [FujiInterface.FujiPXR4ReadSVCmd(1, i) for i in range(3)]
+        results = bus.runCmds(cmds)
+        self.assertTrue(isinstance(results[0][1], FujiInterface.FujiPXR4RplyCRCError))
+        self.assertTrue(isinstance(results[1][1], serialComm.EmptyRplyError))
+        self.assertEqual(results[2][1], None)
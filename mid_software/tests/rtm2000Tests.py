@@ -0,0 +1,82 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import unittest
+import json
+import logging
+import struct
+import RTM2000Cmd
+
+def point(sensorID, slaveAddr, boardNum, position):
+    return {"type": "rtm2000", "sensor_id": sensorID,
+            "device_name": json.dumps({"slaveAddr": slaveAddr, "boardNum": boardNum, "position": position})}
+
+def rtmRply(slaveAddr, boardNum, temps):
+    rply = struct.pack("<cBcB65H", "*", slaveAddr, "t", boardNum, *temps)
+    return rply + chr(RTM2000Cmd.checksum(rply)) + "\r"
+
+class FakeRTMBus:
+    """Replies to each request from the slave and board it names, as given in boards."""
+    def __init__(self, boards):
+        self.boards = boards
+        self.pending = ""
+        self.requests = []
+
+    def flushInput(self):
+        self.pending = ""
+
+    def write(self, data):
+        self.requests.append(data)
+        key = (ord(data[1]), ord(data[3]))
+        if key in self.boards:
+            self.pending = self.boards[key]
+
+    def read(self, n):
+        (data, self.pending) = (self.pending[:n], self.pending[n:])
+        return data
+
+class rtm2000Tests(unittest.TestCase):
+
+    def testCreateCommands(self):
+        JSON = [point(1, 2, 3, 0), point(2, 1, 8, 5), {"type": "pressure", "sensor_id": 9},
+                point(3, 2, 3, 64), point(4, 1, 9, 0), point(5, 1, 8, 6),
+                {"type": "rtm2000", "sensor_id": 6, "device_name": "not JSON"}]
+        cmds = RTM2000Cmd.createCommands(JSON, "/dev/null", logging)
+        self.assertEqual([(c.slaveAddr, c.boardNum, c.sensorIDs, c.positions) for c in cmds],
+                         [(1, 8, [2, 5], [5, 6]), (2, 3, [1, 3], [0, 64])])
+
+    def testReadAll(self):
+        temps = [2732 + i for i in range(65)]
+        cmds = RTM2000Cmd.createCommands([point(1, 1, 1, 0), point(2, 1, 1, 64), point(3, 1, 2, 10),
+                                          point(4, 3, 1, 1)], "/dev/null", logging)
+        bad = rtmRply(1, 2, temps)[:-1] + "\n"
+        fake = FakeRTMBus({(1, 1): rtmRply(1, 1, temps), (1, 2): bad, (3, 1): rtmRply(3, 1, temps)})
+        bus = RTM2000Cmd.RTM2000Bus(verifyChecksum=True, serialDevice=fake)
+        self.assertEqual(bus.readAll(cmds), 1)
+        self.assertEqual([r[:4] for r in fake.requests], ["$\x01t\x01", "$\x01t\x02", "$\x03t\x01"])
+        self.assertEqual(cmds[0].K_all, [2732, 2796])
+        self.assertAlmostEqual(cmds[0].F_all[0], 32.0)
+        self.assertTrue(cmds[1].error)
+        self.assertEqual(cmds[1].to_JSON_WWW_data(None), [])
+        self.assertEqual(cmds[2].K_all, [2733])
+
+    def testBadReplies(self):
+        cmd = RTM2000Cmd.RTM2000Cmd([1], 1, 1, [0])
+        good = rtmRply(1, 1, [3000]*65)
+        for rply in (good[:-1], rtmRply(2, 1, [3000]*65), good[:-1] + "\n"):
+            self.assertRaises(RTM2000Cmd.RTM2000RplyError, cmd.processReply, rply)
+        corrupt = good[:10] + chr(ord(good[10]) ^ 1) + good[11:]
+        self.assertRaises(RTM2000Cmd.RTM2000RplyError, cmd.processReply, corrupt, True)
+        cmd.processReply(corrupt)
+        cmd.processReply(good, True)
+        self.assertEqual(cmd.K_all, [3000])
@@ -0,0 +1,82 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import unittest
+import struct
+import hubComm
+import hubPackets
+
+class FakeSerial:
+    """Hands out the given chunks of bytes, one chunk per read."""
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def inWaiting(self):
+        if self.chunks:
+            return len(self.chunks[0])
+        return 0
+
+    def read(self, n):
+        if not self.chunks:
+            return ""
+        data = self.chunks[0][:n]
+        self.chunks[0] = self.chunks[0][n:]
+        if not self.chunks[0]:
+            self.chunks.pop(0)
+        return data
+
+def frame(rply):
+    return struct.pack("<H", len(rply)+2) + rply
+
+def tachRply(rpm):
+    return struct.pack("BBBBH", 1, 3, hubPackets.HubCmd.TACH_CODE, 1, rpm)
+
+def tachCmd(addrs):
+    return hubPackets.HubTachCmd(sensorID=addrs, port=1, addy=addrs, bias=[0]*len(addrs))
+
+class serialFrameReaderTests(unittest.TestCase):
+
+    def testSplitFrames(self):
+        data = frame(tachRply(10)) + frame(tachRply(11))
+        reader = hubComm.SerialFrameReader(FakeSerial([data[:3], data[3:9], data[9:]]))
+        self.assertEqual(reader.read(tachCmd([1])), tachRply(10))
+        self.assertEqual(reader.read(tachCmd([1])), tachRply(11))
+        self.assertEqual(reader.dropped, 0)
+
+    def testResync(self):
+        """stray bytes and a frame with a bad length are skipped"""
+        data = "\x07\x00\x01" + "\x09\x00" + tachRply(10) + frame(tachRply(11))
+        reader = hubComm.SerialFrameReader(FakeSerial([data]))
+        self.assertEqual(reader.read(tachCmd([1])), tachRply(11))
+        self.assertTrue(reader.dropped > 0)
+
+    def testResyncIdle(self):
+        """a length header too long for the data is given up on once the line goes quiet"""
+        data = "\x00\x01\x03" + frame(tachRply(11))
+        reader = hubComm.SerialFrameReader(FakeSerial([data]), idleGap=0)
+        self.assertEqual(reader.read(tachCmd([1])), tachRply(11))
+        self.assertEqual(reader.dropped, 3)
+
+    def testPollDoesNotBlock(self):
+        data = frame(tachRply(10))
+        reader = hubComm.SerialFrameReader(FakeSerial([data[:4], data[4:]]), baseTimeout=60)
+        reader.start(tachCmd([1]))
+        self.assertEqual(reader.poll(), None)
+        self.assertEqual(reader.poll(), tachRply(10))
+
+    def testTimeoutScalesWithAddrs(self):
+        reader = hubComm.SerialFrameReader(FakeSerial([]), baseTimeout=1, perAddrTimeout=2)
+        self.assertEqual(reader.timeoutFor(tachCmd([1])), 3)
+        self.assertEqual(reader.timeoutFor(tachCmd(range(32))), 65)
+        reader = hubComm.SerialFrameReader(FakeSerial(["\x05"]), baseTimeout=0, perAddrTimeout=0.01)
+        self.assertRaises(hubPackets.HubTimeoutError, reader.read, tachCmd([1]))
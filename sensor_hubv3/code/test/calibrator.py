@@ -21,10 +21,14 @@ import getopt
 import csv
 import numpy
 import sys
+import os
 import time
+import math
+import bisect
+import threading
+import Queue
 import traceback
 import midsim
-import StringIO
 import datetime
 import pylab
 from matplotlib.backends.backend_pdf import PdfPages
@@ -45,10 +49,12 @@ def usage(p):
     print >> p, "                                       -a 1:4602,3:5492,172.16.43.22:3201;1:9873"
     print >> p, "  -n                     Bypass statistical safeguard checks, in step3"
     print >> p, "  --step0                Only do step0"
-    print >> p, "  --step1=fileout        Only do step1 put output in 'fileout'"
+    print >> p, "  --step1=fileout        Only do step1 put output in 'fileout', binary if it ends in .npy"
     print >> p, "  --step2=filein,fileout Only do step2 using output from step1"
     print >> p, "  --step3=filein         Only do step3 using output from step2"
     print >> p, "  --verify               Only do verifying step"
+    print >> p, "  --parallel             Sample all hubs at once, streaming into the step2 statistics"
+    print >> p, "  --checkpoint=file      With --parallel, keep samples in 'file' and resume from it"
     print >> p, ""
     print >> p, "-------------------------------------------------"
     print >> p, "By default it goes through these steps:"
@@ -84,10 +90,11 @@ def main():
     stats_threshold = [27, 1500, 24]  # [Error stddev, pre cal allowed error, post cal allowed error]
     config = {"verbose": False, "delay": 0, "counts": 300, "ref": [], "units": [], "stats_check": True, "step0": False,
               "step1": [None, None], "step2": [None, None], "step3": [None, None], "verify": False,
-              "stats_threshold": stats_threshold}
+              "parallel": False, "checkpoint": None, "stats_threshold": stats_threshold}
     try:
         opts, args = getopt.getopt(sys.argv[1:], "hvp:r:a:n",
-                                   ["help", "verbose", "step0", "step1=", "step2=", "step3=", "verify"])
+                                   ["help", "verbose", "step0", "step1=", "step2=", "step3=", "verify",
+                                    "parallel", "checkpoint="])
     except getopt.GetoptError, err:
         print str(err)
         usage(None)
@@ -122,6 +129,10 @@ def main():
                 config["step3"][0] = parse_step3in(config["step3"][0])
             elif o in ("--verify",):
                 config["verify"] = True
+            elif o in ("--parallel",):
+                config["parallel"] = True
+            elif o in ("--checkpoint",):
+                config["checkpoint"] = a
     except SystemExit as e:
         sys.exit(e)
     except:
@@ -149,30 +160,66 @@ def main():
     elif config["step2"][0]:
         step2(config)
     elif config["step1"][1]:
+        if config["parallel"]:
+            if config["step1"][1].endswith(SAMPLES_EXT):
+                print >> sys.stderr, "ERROR: --parallel writes step1 output as text"
+                sys.exit(14)
+            step12_parallel(config, config["step1"][1])
+            sys.exit(0)
         step1(config)
     elif config["step0"]:
         step0(config)
     else:
         step0(config)
-        step1(config)
-        step2(config)
+        if config["parallel"]:
+            step12_parallel(config, config["checkpoint"])
+        else:
+            step1(config)
+            step2(config)
         step3(config)
         step4(config)
         sys.exit(0)
 
 
+# midsim clients by IPHOST, None for the local hub, kept open for the whole run
+CLIENTS = {}
+
+
+def client(hostipport):
+    if hostipport not in CLIENTS:
+        CLIENTS[hostipport] = midsim.MidsimClient(remote=hostipport)
+    return CLIENTS[hostipport]
+
+
+def pressures(records, allow_err=False):
+    """The raw pressurewide values of the Readings in records, None for ERR if allow_err."""
+    values = []
+    for r in records:
+        if isinstance(r, midsim.Reading):
+            if not r.ok_p() and not allow_err:
+                raise midsim.MidsimError("Unit %d:%d did not reply" % (r.port, r.address))
+            values.append(r.values['pressure'])
+    return values
+
+
+def timed_pressures(c, queries, allow_err=False):
+    """
+    The pressures read by queries, made in one call to client c, and when
+    each was read: the call's time spread evenly over the addresses.
+    """
+    t0 = time.time()
+    values = []
+    for (q, records) in zip(queries, c.query_many(queries)):
+        v = pressures(records, allow_err)
+        if len(v) != len(q.addrs):
+            raise midsim.MidsimError("Got %d readings for %d addresses on port %d" % (len(v), len(q.addrs), q.port))
+        values.extend(v)
+    step = (time.time() - t0) / len(values)
+    return values, [t0 + (j + 0.5) * step for j in range(len(values))]
+
+
 def set_cal(hostipport, port, address, value):
-    outstream = StringIO.StringIO()
-    remote = ""
-    if hostipport:
-        remote = "-r "+hostipport
-    args = (
-        "%s %s -f csv -p %d -a %d -t %s --set-cal=%d" % ("midsim.py", remote, port, address, "pressurewide", value)
-    ).split()
-    midsim.midsim(args, outstream)
-    mout = outstream.getvalue()
-    outstream.close()
-    v = int(mout.rstrip().split(",")[1])
+    v = client(hostipport).set_cal("pressurewide", port, address, value)
     if v != value:
         print >> sys.stderr, "ERROR: Unit calibration was not set correctly: sp = %d != pv = %d" % (value, v)
         sys.exit(7)
@@ -188,66 +235,98 @@ def step0(config):
 
 
 def step1_diffport(config):
-    # [[Port, Unit_ADDRESS, REF_VALUE, UNIT_VALUE, REF_VALUE], ...]
+    # [[Port, Unit_ADDRESS, REF_VALUE, UNIT_VALUE, REF_VALUE, REF_TIME, UNIT_TIME, REF_TIME], ...]
     alldata = []
+    ref = config["ref"]
+    refq = midsim.make_query("pressurewide", ref[1], [ref[2]])
     for i in xrange(config["counts"]):
         sys.stdout.write("Sample %d/%d                  \r" % (i + 1, config["counts"]))
         sys.stdout.flush()
         for unit in config["units"]:
-            # Get Reference value
             data = []
             data.extend([unit[0], unit[1], unit[2]])
 
-            if unit[0] is config["ref"][0] and unit[1] == config["ref"][1]:
-                outstream = StringIO.StringIO()
-                remote = ""
-                if unit[0]:
-                    remote = "-r "+unit[0]
-                midsim.midsim(["midsim.py"] + ("%s -f csv -p %d -a %d,%d,%d -t %s" % (
-                    remote, config["ref"][1], config["ref"][2], unit[2], config["ref"][2], "pressurewide")).split(),
-                    outstream)
-                mout = outstream.getvalue()
-                outstream.close()
-                data.extend([int(c) for c in mout.rstrip().split(",")[1:]])
-                alldata.append(data)
+            if unit[0] == ref[0] and unit[1] == ref[1]:
+                # Reference, unit, reference in one command
+                q = midsim.make_query("pressurewide", ref[1], [ref[2], unit[2], ref[2]])
+                (values, times) = timed_pressures(client(unit[0]), [q])
+            else:
+                unitq = midsim.make_query("pressurewide", unit[1], [unit[2]])
+                if unit[0] == ref[0]:
+                    # Reference, unit, reference in one call to the hub
+                    (values, times) = timed_pressures(client(ref[0]), [refq, unitq, refq])
+                else:
+                    (values, times) = ([], [])
+                    for (hostipport, q) in ((ref[0], refq), (unit[0], unitq), (ref[0], refq)):
+                        (v, t) = timed_pressures(client(hostipport), [q])
+                        values.extend(v)
+                        times.extend(t)
+            data.extend(values)
+            data.extend(times)
+            alldata.append(data)
+        time.sleep(config["delay"])
+    print
+    return alldata
+
+
+def samechain_queries(ref, units):
+    """
+    Queries reading the reference and units, all on the reference's port,
+    interleaved ref,u1,ref,u2,...,ref so each unit is read between two
+    reference readings, in as few commands as fit.
+    """
+    per_query = (midsim.MAX_ADDRS - 1) // 2
+    queries = []
+    for i in range(0, len(units), per_query):
+        addrs = [ref[2]]
+        for unit in units[i:i + per_query]:
+            addrs.extend([unit[2], ref[2]])
+        queries.append(midsim.make_query("pressurewide", ref[1], addrs))
+    return queries
+
+
+def step1_samechain(config):
+    """
+    step1_diffport for units on the reference's chain, reading them all
+    with the commands of samechain_queries in one call per sample.  A
+    sample where a unit or its references replied ERR, or the hub's reply
+    did not hold a reading for each address, is dropped.
+    """
+    # [[Port, Unit_ADDRESS, REF_VALUE, UNIT_VALUE, REF_VALUE, REF_TIME, UNIT_TIME, REF_TIME], ...]
+    alldata = []
+    ref = config["ref"]
+    units = config["units"]
+    queries = samechain_queries(ref, units)
+    c = client(ref[0])
+    dropped = 0
+    for i in xrange(config["counts"]):
+        sys.stdout.write("Sample %d/%d                  \r" % (i + 1, config["counts"]))
+        sys.stdout.flush()
+        try:
+            (values, times) = timed_pressures(c, queries, True)
+        except midsim.MidsimError, e:
+            print >> sys.stderr, "ERROR: sample %d: %s" % (i + 1, str(e))
+            dropped += len(units)
+            time.sleep(config["delay"])
+            continue
+        # each command's addresses are ref,(unit,ref)*k
+        j = 0
+        k = 0
+        for unit in units:
+            if k == (midsim.MAX_ADDRS - 1) // 2:
+                j += 1
+                k = 0
+            sample = values[j:j + 3]
+            if None in sample:
+                dropped += 1
             else:
-                outstream = StringIO.StringIO()
-                remote = ""
-                if config["ref"][0]:
-                    remote = "-r "+config["ref"][0]
-                midsim.midsim(("%s %s -f csv -p %d -a %d -t %s" % (
-                    "midsim.py", remote, config["ref"][1], config["ref"][2], "pressurewide")).split(), outstream)
-                mout = outstream.getvalue()
-                outstream.close()
-                data.append(int(mout.rstrip().split(",")[1]))
-
-                # Get other unit values
-                outstream = StringIO.StringIO()
-                remote = ""
-                if unit[0]:
-                    remote = "-r "+unit[0]
-                args = "%s %s -f csv -p %d -a %d -t %s" % ("midsim.py", remote, unit[1], unit[2], "pressurewide")
-                args = args.split()
-                midsim.midsim(args, outstream)
-                mout = outstream.getvalue()
-                outstream.close()
-                data.append(int(mout.rstrip().split(",")[1]))
-
-                # Get Reference value
-                outstream = StringIO.StringIO()
-                remote = ""
-                if config["ref"][0]:
-                    remote = "-r "+config["ref"][0]
-                args = "%s %s -f csv -p %d -a %d -t %s" % (
-                    "midsim.py", remote, config["ref"][1], config["ref"][2], "pressurewide")
-                args = args.split()
-                midsim.midsim(args, outstream)
-                mout = outstream.getvalue()
-                outstream.close()
-                data.append(int(mout.rstrip().split(",")[1]))
-                alldata.append(data)
+                alldata.append([unit[0], unit[1], unit[2]] + sample + times[j:j + 3])
+            j += 2
+            k += 1
         time.sleep(config["delay"])
     print
+    if dropped:
+        print >> sys.stderr, "WARNING: dropped %d samples with ERR or missing readings" % (dropped,)
     return alldata
 
 
@@ -258,68 +337,125 @@ def step1(config):
     sameports = True
     port = config["units"][0][1]
     for unit in config["units"]:
-        if unit[0] is not config["units"][0][0] or unit[1] != port:
+        if unit[0] != config["units"][0][0] or unit[1] != port:
             sameports = False
             break
 
-    if sameports and (config["ref"][0] is not config["units"][0][0] or config["ref"][1] != port):
+    if sameports and (config["ref"][0] != config["units"][0][0] or config["ref"][1] != port):
         sameports = False
 
-    # [[Port, Unit_ADDRESS, REF_VALUE, UNIT_VALUE, REF_VALUE], ...]
+    # [[Port, Unit_ADDRESS, REF_VALUE, UNIT_VALUE, REF_VALUE, REF_TIME, UNIT_TIME, REF_TIME], ...]
     if sameports:
-        # XXX: Make a super fast sampler
-        alldata = step1_diffport(config)
+        alldata = step1_samechain(config)
     else:
         alldata = step1_diffport(config)
     if config["step1"][1] is not None:
-        with open(config["step1"][1], 'wb') as f:
-            for row in alldata:
-                f.write("%s,%d,%d,%d,%d,%d\n" % (row[0], row[1], row[2], row[3], row[4], row[5]))
+        if config["step1"][1].endswith(SAMPLES_EXT):
+            numpy.save(config["step1"][1], samples_array(alldata))
+        else:
+            with open(config["step1"][1], 'wb') as f:
+                for row in alldata:
+                    f.write("%s,%d,%d,%d,%d,%d,%.3f,%.3f,%.3f\n" % tuple(row))
         sys.exit(0)
     else:
         config["step2"][0] = alldata
 
 
+# step1 samples, a row per unit reading
+SAMPLE_DTYPE = numpy.dtype([('host', 'S64'), ('port', 'i4'), ('address', 'i4'),
+                            ('r1', 'i8'), ('v', 'i8'), ('r2', 'i8'),
+                            ('t1', 'f8'), ('tu', 'f8'), ('t2', 'f8')])
+# step1 output in this binary format, numpy.save of a SAMPLE_DTYPE array
+SAMPLES_EXT = '.npy'
+
+
+def samples_array(rows):
+    """step1 rows as a SAMPLE_DTYPE array, times NaN for rows without them."""
+    samples = numpy.empty(len(rows), dtype=SAMPLE_DTYPE)
+    for (i, row) in enumerate(rows):
+        samples[i] = (str(row[0]),) + tuple(row[1:]) + (numpy.nan,) * (9 - len(row))
+    return samples
+
+
 def parse_step2in(filename):
+    """The SAMPLE_DTYPE array of step1 output filename."""
+    if filename.endswith(SAMPLES_EXT):
+        return numpy.load(filename)
+    # sample times are missing from files from before they were recorded
+    ncols = 0
     with open(filename, 'rb') as f:
-        sr = csv.reader(f, delimiter=',', quotechar='"')
-        alldata = []
-        for row in sr:
-            d = [row[0], int(row[1]), int(row[2]), int(row[3]), int(row[4]), int(row[5])]
-            if d[0] == 'None':
-                d[0] = None
-            alldata.append(d)
-        return alldata
+        for line in f:
+            if not line.startswith('#'):
+                ncols = len(line.split(','))
+                break
+    if ncols == 0:
+        return numpy.empty(0, dtype=SAMPLE_DTYPE)
+    dtype = numpy.dtype(SAMPLE_DTYPE.descr[:ncols])
+    loaded = numpy.loadtxt(filename, dtype=dtype, delimiter=',', comments='#', ndmin=1)
+    if ncols == len(SAMPLE_DTYPE):
+        return loaded
+    samples = numpy.empty(len(loaded), dtype=SAMPLE_DTYPE)
+    for name in SAMPLE_DTYPE.names:
+        samples[name] = loaded[name] if name in dtype.names else numpy.nan
+    return samples
+
+
+def ref_weight(row):
+    """How far from the first reference reading to the second the unit was read, 0.5 untimed."""
+    if len(row) > 6 and row[8] != row[6]:
+        return (row[7] - row[6]) / (row[8] - row[6])
+    return 0.5
+
+
+def sample_errors(samples):
+    """Each sample's reference, interpolated to when the unit was read, less the unit's reading."""
+    r1 = samples['r1'].astype(float)
+    dt = samples['t2'] - samples['t1']
+    timed = numpy.isfinite(dt) & (dt != 0)
+    w = numpy.full(len(samples), 0.5)
+    w[timed] = (samples['tu'][timed] - samples['t1'][timed]) / dt[timed]
+    return r1 + (samples['r2'] - r1) * w - samples['v']
+
+
+def unit_stats(samples):
+    """
+    step2's [[host, port, address, mean_error, stddev_error, minerror,
+    maxerror, suggested_offset], ...] of samples, a SAMPLE_DTYPE array,
+    one row per unit ordered by host, port and address.
+    """
+    if len(samples) == 0:
+        return []
+    # group on one integer per (host, port, address), hosts being few
+    hosts = sorted(set(samples['host']))
+    host_index = numpy.zeros(len(samples), dtype='i8')
+    for (i, host) in enumerate(hosts):
+        host_index[samples['host'] == host] = i
+    keys = (host_index << 40) | (samples['port'].astype('i8') << 20) | samples['address']
+    (units, inverse) = numpy.unique(keys, return_inverse=True)
+    errors = sample_errors(samples)
+    counts = numpy.bincount(inverse)
+    mean = numpy.bincount(inverse, errors) / counts
+    std = numpy.sqrt(numpy.bincount(inverse, (errors - mean[inverse]) ** 2) / counts)
+    # each unit's errors together, to reduce
+    order = numpy.argsort(inverse, kind='mergesort')
+    starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+    minerror = numpy.minimum.reduceat(errors[order], starts)
+    maxerror = numpy.maximum.reduceat(errors[order], starts)
+    # round half away from zero, like round()
+    suggested = numpy.sign(mean) * numpy.floor(numpy.abs(mean) + 0.5)
+    return [[None if hosts[k >> 40] == 'None' else hosts[k >> 40], int((k >> 20) & 0xFFFFF), int(k & 0xFFFFF),
+             float(m), float(sd), float(lo), float(hi), int(o)]
+            for (k, m, sd, lo, hi, o) in zip(units, mean, std, minerror, maxerror, suggested)]
 
 
 def step2(config):
     print "Calculating States..."
-    # sort step2 in data
-    # [[port, address, [[r1, v1, r2], ...]]]
-    sorted_data = []
-    for row in config["step2"][0]:
-        found = False
-        for srow in sorted_data:
-            if srow[0] is row[0] and srow[1] == row[1] and srow[2] == row[2]:
-                srow[3].append([row[3], row[4], row[5]])
-                found = True
-                break
-        if not found:
-            sorted_data.append([row[0], row[1], row[2], [[row[3], row[4], row[5]]]])
-
+    samples = config["step2"][0]
+    if not isinstance(samples, numpy.ndarray):
+        samples = samples_array(samples)
     # Calculate Offsets
     # [ [port, address, mean_error, stddev_error, minerror, maxerror, suggested_offset] ]
-    calculations = []
-    for row in sorted_data:
-        zdata = zip(*row[3])
-        r = (numpy.array(zdata[0]) + numpy.array(zdata[2])) / 2.0
-        me = r - numpy.array(zdata[1])
-        mean_error = numpy.mean(me)
-        stddev_error = numpy.std(me)
-        minerror = numpy.min(me)
-        maxerror = numpy.max(me)
-        suggested_offset = round(mean_error)
-        calculations.append([row[0], row[1], row[2], mean_error, stddev_error, minerror, maxerror, suggested_offset])
+    calculations = unit_stats(samples)
 
     if config["step2"][1] is not None:
         with open(config["step2"][1], 'wb') as f:
@@ -330,6 +466,232 @@ def step2(config):
         config["step3"][0] = calculations
 
 
+class UnitStats:
+    """step2's statistics of one unit's errors, kept as they arrive."""
+
+    def __init__(self, unit):
+        self.unit = unit
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, row):
+        """Add a step1 row."""
+        e = row[3] + (row[5] - row[3]) * ref_weight(row) - row[4]
+        # Welford
+        self.n += 1
+        delta = e - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (e - self.mean)
+        self.min = e if self.min is None else min(self.min, e)
+        self.max = e if self.max is None else max(self.max, e)
+
+    def calculation(self):
+        """[host, port, address, mean_error, stddev_error, minerror, maxerror, suggested_offset] like step2."""
+        return list(self.unit) + [self.mean, math.sqrt(self.m2 / self.n), self.min, self.max, round(self.mean)]
+
+
+def hub_queries(ref, ports):
+    """
+    The queries one hub's worker makes each sample for the units in ports,
+    {port: units}.  On the reference's hub they start and end with a
+    reference reading, interleaved with the units on its chain.
+    """
+    queries = []
+    if ref is not None:
+        queries.extend(samechain_queries(ref, ports.get(ref[1], [])))
+    for port in sorted(ports):
+        if ref is not None and port == ref[1]:
+            continue
+        addrs = [unit[2] for unit in ports[port]]
+        for i in range(0, len(addrs), midsim.MAX_ADDRS):
+            queries.append(midsim.make_query("pressurewide", port, addrs[i:i + midsim.MAX_ADDRS]))
+    if ref is not None:
+        refq = midsim.make_query("pressurewide", ref[1], [ref[2]])
+        if not queries or queries[0].port != ref[1] or queries[0].addrs[0] != ref[2]:
+            queries.insert(0, refq)
+        if queries[-1] is refq or queries[-1].port != ref[1] or queries[-1].addrs[-1] != ref[2]:
+            queries.append(refq)
+    return queries
+
+
+def hub_worker(hostipport, queries, ref, ticks, results, others_done):
+    """
+    Make queries on hostipport for each sample number put on ticks, putting
+    (hostipport, [(port, address, value, time)], error) on results.  On the
+    reference's hub, ref, the reference is then read until others_done is set
+    so every other hub's readings fall between two reference readings.
+    """
+    c = client(hostipport)
+    while True:
+        tick = ticks.get()
+        if tick is None:
+            return
+        readings = []
+        error = None
+        try:
+            for q in queries:
+                (values, times) = timed_pressures(c, [q], True)
+                readings.extend(zip([q.port] * len(q.addrs), q.addrs, values, times))
+            if ref is not None:
+                refq = midsim.make_query("pressurewide", ref[1], [ref[2]])
+                while not others_done.is_set():
+                    (values, times) = timed_pressures(c, [refq], True)
+                    readings.append((ref[1], ref[2], values[0], times[0]))
+        except Exception, e:
+            # anything, so the sample always gets this hub's result
+            error = e
+        results.put((hostipport, readings, error))
+
+
+def join_readings(ref, hub_readings):
+    """
+    step1 rows from one sample's readings, {hostipport: [(port, address,
+    value, time)]}, each unit paired with the reference readings just before
+    and after it, by time, or the nearest two.
+    """
+    refs = sorted([(t, v) for (port, address, v, t) in hub_readings.get(ref[0], [])
+                   if port == ref[1] and address == ref[2] and v is not None])
+    if len(refs) < 2:
+        return []
+    ref_times = [t for (t, v) in refs]
+    rows = []
+    for (hostipport, readings) in hub_readings.items():
+        for (port, address, v, t) in readings:
+            if v is None or (hostipport == ref[0] and port == ref[1] and address == ref[2]):
+                continue
+            i = min(max(bisect.bisect_right(ref_times, t), 1), len(refs) - 1)
+            ((t1, r1), (t2, r2)) = (refs[i - 1], refs[i])
+            rows.append([hostipport, port, address, r1, v, r2, t1, t, t2])
+    return rows
+
+
+def read_checkpoint(filename, stats):
+    """
+    Add the rows of the samples completed in checkpoint file filename to
+    stats, dropping any partial sample after the last.  Returns the number
+    of samples completed.
+    """
+    done = 0
+    keep = 0
+    rows = []
+    with open(filename, 'r+b') as f:
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            if line.startswith('#'):
+                if not line.endswith('\n'):
+                    # torn marker
+                    break
+                try:
+                    done = int(line.split()[-1])
+                except (ValueError, IndexError):
+                    continue
+                keep = f.tell()
+                for row in rows:
+                    stats[tuple(row[0:3])].add(row)
+                rows = []
+            else:
+                row = line.rstrip().split(',')
+                try:
+                    row = [None if row[0] == 'None' else row[0], int(row[1]), int(row[2]), int(row[3]),
+                           int(row[4]), int(row[5]), float(row[6]), float(row[7]), float(row[8])]
+                except (ValueError, IndexError):
+                    # torn by the run being killed mid write
+                    continue
+                if tuple(row[0:3]) in stats:
+                    rows.append(row)
+        f.truncate(keep)
+    return done
+
+
+def step12_parallel(config, checkpoint=None):
+    """
+    Steps 1 and 2 with one worker per hub (IPHOST), all sampling at once on
+    a shared clock.  Each sample's readings are joined with the reference's
+    by time and added straight to the statistics.  With checkpoint, each
+    completed sample's step1 rows are appended to that file, which a later
+    run resumes from and step2 can read.
+    """
+    print "Gathering Samples on all hubs..."
+    ref = config["ref"]
+    hubs = {ref[0]: {}}
+    stats = {}
+    for unit in config["units"]:
+        hubs.setdefault(unit[0], {}).setdefault(unit[1], []).append(unit)
+        stats[tuple(unit)] = UnitStats(unit)
+
+    done = 0
+    if checkpoint is not None and os.path.exists(checkpoint):
+        done = read_checkpoint(checkpoint, stats)
+        print "Resuming after sample %d from %s" % (done, checkpoint)
+    out = None
+    if checkpoint is not None:
+        out = open(checkpoint, 'ab')
+
+    results = Queue.Queue()
+    others_done = threading.Event()
+    workers = {}
+    threads = []
+    for (hostipport, ports) in hubs.items():
+        client(hostipport)
+        hub_ref = ref if hostipport == ref[0] else None
+        ticks = Queue.Queue()
+        worker = threading.Thread(target=hub_worker, args=(hostipport, hub_queries(hub_ref, ports), hub_ref,
+                                                           ticks, results, others_done))
+        worker.daemon = True
+        worker.start()
+        workers[hostipport] = ticks
+        threads.append(worker)
+
+    try:
+        start = time.time()
+        for i in xrange(done, config["counts"]):
+            sys.stdout.write("Sample %d/%d                  \r" % (i + 1, config["counts"]))
+            sys.stdout.flush()
+            # shared clock
+            wait = start + (i - done) * config["delay"] - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            others_done.clear()
+            for ticks in workers.values():
+                ticks.put(i)
+            hub_readings = {}
+            for n in range(len(workers)):
+                if n == len(workers) - 1:
+                    # only the reference's hub, reading the reference, is left
+                    others_done.set()
+                (hostipport, readings, error) = results.get()
+                if error is not None:
+                    print >> sys.stderr, "ERROR: %s sample %d: %s" % (hostipport, i + 1, str(error))
+                hub_readings[hostipport] = readings
+            rows = join_readings(ref, hub_readings)
+            for row in rows:
+                stats[tuple(row[0:3])].add(row)
+            if out is not None:
+                for row in rows:
+                    out.write("%s,%d,%d,%d,%d,%d,%.3f,%.3f,%.3f\n" % tuple(row))
+                out.write("# sample %d\n" % (i + 1,))
+                out.flush()
+                os.fsync(out.fileno())
+    finally:
+        for ticks in workers.values():
+            ticks.put(None)
+        for worker in threads:
+            worker.join(30)
+        if out is not None:
+            out.close()
+    print
+
+    config["step3"][0] = [stats[tuple(unit)].calculation() for unit in config["units"] if stats[tuple(unit)].n > 0]
+    for unit in config["units"]:
+        if stats[tuple(unit)].n == 0:
+            print >> sys.stderr, "WARNING: no samples from %s;%d:%d" % tuple(unit)
+
+
 def parse_step3in(filename):
     with open(filename, 'rb') as f:
         sr = csv.reader(f, delimiter=',', quotechar='"')
@@ -344,17 +706,7 @@ def parse_step3in(filename):
 
 
 def get_cal(hostipport, port, address):
-    outstream = StringIO.StringIO()
-    remote = ""
-    if hostipport:
-        remote = "-r "+hostipport
-    args = "%s %s -f csv -p %d -a %d -t %s --get-cal" % ("midsim.py", remote, port, address, "pressurewide")
-    args = args.split()
-    midsim.midsim(args, outstream)
-    mout = outstream.getvalue()
-    outstream.close()
-    # real_offset = suggested_offset + current_offset
-    return int(mout.rstrip().split(",")[1])
+    return client(hostipport).get_cal("pressurewide", port, address)
 
 
 def step3(config):
@@ -488,10 +840,13 @@ def step4(config):
     print "Verifying Calibration..."
     config["step1"] = [None, None]
     config["step2"] = [None, None]
-    # Regather data
-    step1(config)
-    # Regather stats
-    step2(config)
+    if config["parallel"]:
+        step12_parallel(config)
+    else:
+        # Regather data
+        step1(config)
+        # Regather stats
+        step2(config)
 
     # Console report
     step4_console_report(config)
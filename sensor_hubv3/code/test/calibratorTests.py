@@ -0,0 +1,230 @@
+#   Copyright 2010-2019 Dan Elliott, Russell Valentine
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+import unittest
+import tempfile
+import shutil
+import struct
+import os
+import time
+import numpy
+import calibrator
+import midsim
+
+REF = [None, 1, 1]
+UNITS = [[None, 1, 2], [None, 1, 3], ["bench2:5200", 2, 7]]
+
+
+class FakeHub:
+    """
+    Serial stand-in answering pressurewide commands with 100000 less the
+    address, or garbage if broken, taking delay seconds per command.  The
+    addresses in errs[n] reply ERR to the n-th command, those of every
+    command are logged in sent.
+    """
+
+    def __init__(self, broken=False, delay=0, errs=None):
+        self.broken = broken
+        self.delay = delay
+        self.errs = errs or {}
+        self.sent = []
+        self.inp = ""
+        self.timeout = None
+
+    def write(self, b):
+        time.sleep(self.delay)
+        n = ord(b[8])
+        addrs = struct.unpack("<%dH" % n, b[9:9 + 2 * n])
+        errs = self.errs.get(len(self.sent), ())
+        self.sent.append(list(addrs))
+        if self.broken:
+            # only a hub error packet
+            body = struct.pack("BBBB", 4, 1, 1, 0)
+        else:
+            body = struct.pack("BBBB", 1, 4 * n + 1, 8, n)
+            body += "".join([struct.pack("<I", 0 if a in errs else 100000 - (a if a != REF[2] else 0))
+                             for a in addrs])
+        self.inp = struct.pack("<H", len(body) + 2) + body
+
+    def read(self, n):
+        (r, self.inp) = (self.inp[:n], self.inp[n:])
+        return r
+
+    def flushInput(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def fakeClient(hub):
+    c = midsim.MidsimClient()
+    c.s = hub
+    c.open = lambda: None
+    return c
+
+
+class ParallelCalibrationTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.tmpDir, "checkpoint.csv")
+        calibrator.CLIENTS.clear()
+        calibrator.CLIENTS[None] = fakeClient(FakeHub())
+        calibrator.CLIENTS["bench2:5200"] = fakeClient(FakeHub())
+
+    def tearDown(self):
+        calibrator.CLIENTS.clear()
+        shutil.rmtree(self.tmpDir)
+
+    def config(self, counts):
+        return {"ref": REF, "units": UNITS, "counts": counts, "delay": 0, "step3": [None, None]}
+
+    def testParallel(self):
+        config = self.config(3)
+        calibrator.step12_parallel(config, self.checkpoint)
+        self.assertEqual([row[0:4] + [row[7]] for row in config["step3"][0]],
+                         [[None, 1, 2, 2.0, 2], [None, 1, 3, 3.0, 3], ["bench2:5200", 2, 7, 7.0, 7]])
+        self.assertEqual(open(self.checkpoint).read().splitlines()[-1], "# sample 3")
+
+    def testResumeTorn(self):
+        calibrator.step12_parallel(self.config(2), self.checkpoint)
+        with open(self.checkpoint, "ab") as f:
+            # a partial third sample, killed mid line
+            f.write("None,1,2,100000,99998,100000,1.0,1.5,2.0\n")
+            f.write("None,1,2,1000,9")
+        stats = dict([(tuple(unit), calibrator.UnitStats(unit)) for unit in UNITS])
+        self.assertEqual(calibrator.read_checkpoint(self.checkpoint, stats), 2)
+        self.assertEqual([stats[tuple(unit)].n for unit in UNITS], [2, 2, 2])
+        self.assertEqual(open(self.checkpoint).read().splitlines()[-1], "# sample 2")
+
+        config = self.config(4)
+        calibrator.step12_parallel(config, self.checkpoint)
+        self.assertEqual([row[3] for row in config["step3"][0]], [2.0, 3.0, 7.0])
+        self.assertEqual(calibrator.parse_step2in(self.checkpoint).shape, (12,))
+
+    def testBrokenHub(self):
+        calibrator.CLIENTS["bench2:5200"] = fakeClient(FakeHub(broken=True))
+        config = self.config(2)
+        calibrator.step12_parallel(config)
+        self.assertEqual([row[0:3] for row in config["step3"][0]], [[None, 1, 2], [None, 1, 3]])
+
+    def testWorkerException(self):
+        def query_many(queries):
+            raise struct.error("unpack requires a string argument of length 4")
+        calibrator.CLIENTS["bench2:5200"].query_many = query_many
+        config = self.config(2)
+        calibrator.step12_parallel(config)
+        self.assertEqual([row[0:3] for row in config["step3"][0]], [[None, 1, 2], [None, 1, 3]])
+
+    def testRefOnOtherPort(self):
+        # one hub, the units on a different port than the reference
+        calibrator.CLIENTS[None] = fakeClient(FakeHub(delay=0.05))
+        units = [[None, 2, 5], [None, 2, 6]]
+        queries = calibrator.hub_queries(REF, {2: units})
+        self.assertEqual([(q.port, q.addrs) for q in queries], [(1, [1]), (2, [5, 6]), (1, [1])])
+        config = {"ref": REF, "units": units, "counts": 2, "delay": 0, "step3": [None, None]}
+        calibrator.step12_parallel(config)
+        self.assertEqual([row[0:4] for row in config["step3"][0]], [[None, 2, 5, 5.0], [None, 2, 6, 6.0]])
+
+class SameChainTests(unittest.TestCase):
+    def tearDown(self):
+        calibrator.CLIENTS.clear()
+
+    def testSplitAndInterleave(self):
+        # 20 units take two commands, unit 18 replies ERR in the second sample
+        hub = FakeHub(errs={3: [18]})
+        calibrator.CLIENTS[None] = fakeClient(hub)
+        units = [[None, 1, a] for a in range(2, 22)]
+        rows = calibrator.step1_samechain({"ref": REF, "units": units, "counts": 2, "delay": 0})
+        self.assertEqual(hub.sent[0], [1] + sum([[a, 1] for a in range(2, 17)], []))
+        self.assertEqual(hub.sent[1], [1] + sum([[a, 1] for a in range(17, 22)], []))
+        self.assertEqual(len(hub.sent), 4)
+        self.assertEqual([row[2] for row in rows], range(2, 22) + range(2, 18) + range(19, 22))
+        for row in rows:
+            self.assertEqual(row[3:6], [100000, 100000 - row[2], 100000])
+            self.assertTrue(row[6] < row[7] < row[8])
+
+
+def nested_step2(rows):
+    """step2's statistics the way it computed them before, a unit at a time."""
+    sorted_data = []
+    for row in rows:
+        for srow in sorted_data:
+            if srow[0:3] == row[0:3]:
+                srow[3].append([row[3], row[4], row[5], calibrator.ref_weight(row)])
+                break
+        else:
+            sorted_data.append([row[0], row[1], row[2], [[row[3], row[4], row[5], calibrator.ref_weight(row)]]])
+    calculations = []
+    for row in sorted_data:
+        zdata = zip(*row[3])
+        r1 = numpy.array(zdata[0], dtype=float)
+        me = r1 + (numpy.array(zdata[2]) - r1) * numpy.array(zdata[3]) - numpy.array(zdata[1])
+        mean_error = numpy.mean(me)
+        calculations.append([row[0], row[1], row[2], mean_error, numpy.std(me), numpy.min(me), numpy.max(me),
+                             round(mean_error)])
+    return sorted(calculations, key=lambda c: (str(c[0]), c[1], c[2]))
+
+
+def random_rows(n, timed=True, seed=7):
+    rs = numpy.random.RandomState(seed)
+    rows = []
+    for i in range(n):
+        r1 = int(rs.randint(99000, 101000))
+        row = [[None, "bench2:5200"][rs.randint(2)], int(rs.randint(1, 4)), int(rs.randint(1, 21)),
+               r1, int(r1 + rs.randint(-300, 300)), int(r1 + rs.randint(-20, 20))]
+        if timed:
+            t = 1000.0 + i
+            row += [t, t + rs.uniform(0, 1), t + 1]
+        rows.append(row)
+    return rows
+
+
+class Step2Tests(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def assertSameStats(self, calculations, expected):
+        self.assertEqual([c[0:3] for c in calculations], [c[0:3] for c in expected])
+        for (c, e) in zip(calculations, expected):
+            for (a, b) in zip(c[3:7], e[3:7]):
+                self.assertAlmostEqual(a, b, 6)
+            self.assertEqual(c[7], e[7])
+
+    def testNestedEquivalence(self):
+        rows = random_rows(2000)
+        calculations = calibrator.unit_stats(calibrator.samples_array(rows))
+        self.assertEqual(len(calculations), 120)
+        # the None host comes back as None, not 'None'
+        self.assertEqual(calculations[0][0:3], [None, 1, 1])
+        self.assertSameStats(calculations, nested_step2(rows))
+
+    def testNpyRoundTrip(self):
+        rows = random_rows(300)
+        filename = os.path.join(self.tmpDir, "step1" + calibrator.SAMPLES_EXT)
+        numpy.save(filename, calibrator.samples_array(rows))
+        self.assertSameStats(calibrator.unit_stats(calibrator.parse_step2in(filename)), nested_step2(rows))
+
+    def testOldCSV(self):
+        # 6 columns, from before sample times were recorded
+        rows = random_rows(300, timed=False)
+        filename = os.path.join(self.tmpDir, "step1.csv")
+        with open(filename, "wb") as f:
+            for row in rows:
+                f.write("%s,%d,%d,%d,%d,%d\n" % tuple(row))
+        samples = calibrator.parse_step2in(filename)
+        self.assertTrue(numpy.isnan(samples['tu']).all())
+        self.assertSameStats(calibrator.unit_stats(samples), nested_step2(rows))
@@ -14,6 +14,13 @@
 #   limitations under the License.
 
 # Simulates a MID to test ethernet board and hub
+#
+# Scripts can use it as a library through MidsimClient, which keeps its
+# serial port, UDP socket or HTTP session to a midsim server open:
+#
+#   client = midsim.MidsimClient(remote="172.16.43.16:5200")
+#   readings = client.read("pressurewide", 1, [4602, 5492])
+#   results = client.query_many([midsim.make_query("pressurewide", 1, [4602]), ...])
 
 import serial
 import socket
@@ -27,6 +34,8 @@ import random
 import datetime
 import os
 import json
+import collections
+import threading
 import requests
 import logging
 from flask import Flask, Response, request, abort
@@ -46,6 +55,19 @@ def flask_midsim_get():
     return Response(json.dumps(ret), mimetype='application/json')
 
 
+@app.route('/midsim/batch', methods=["POST"])
+def flask_midsim_batch():
+    """Run a JSON list of query requests, see Query.request, on the local hub."""
+    results = []
+    for r in json.loads(request.data):
+        try:
+            records = local_client().query(make_query(**dict((str(k), v) for k, v in r.items())))
+            results.append({'records': [encode_record(x) for x in records]})
+        except MidsimError, e:
+            results.append({'error': str(e)})
+    return Response(json.dumps(results), mimetype='application/json')
+
+
 def start_server(host, port):
     fh = logging.FileHandler('flash.log')
     fh.setLevel(logging.WARN)
@@ -103,6 +125,10 @@ CC = {'temphum': [1, 4, False, 0], 'anemometer': [2, 2, False, 0], 'tachometer':
       'multipointc3': [12, 2, True, 0], 'multipointc4': [13, 2, True, 0], 'multipointaddrc1': [14, 8, True, 0],
       'multipointaddrc2': [15, 8, True, 0], 'multipointaddrc3': [16, 8, True, 0], 'multipointaddrc4': [17, 8, True, 0],
       'unitversion': [63, 2, True, 0], 'hubversion': [150, 2, False, 0], 'ping': [130, 2, False, 0]}
+GENERAL_CC = 25
+GET_CAL_CC = 64
+SET_CAL_CC = 65
+MAX_ADDRS = 32
 
 # TODO: Add these as cmd line arguments
 udp_selfip = ("10.0.0.28", 1083)
@@ -114,6 +140,256 @@ justsend = False
 format = "default"
 
 
+class MidsimError(Exception):
+    pass
+
+
+class Query(collections.namedtuple('Query', ['type', 'port', 'addrs', 'general', 'get_cal', 'set_cal',
+                                             'cmd_code', 'cmd_codep', 'cmd_size', 'cal_size'])):
+    """One command to the hub, made and checked by make_query."""
+    __slots__ = ()
+
+    def reply_code(self):
+        """The command code the hub replies with."""
+        if self.cmd_code == GENERAL_CC:
+            return self.cmd_codep
+        return self.cmd_code
+
+    def request(self):
+        """The arguments to make_query for this, to send to a midsim server."""
+        return {'type': self.type, 'port': self.port, 'addrs': self.addrs, 'general': self.general,
+                'get_cal': self.get_cal, 'set_cal': self.set_cal}
+
+
+def make_query(type, port=None, addrs=None, general=True, get_cal=False, set_cal=None):
+    """A Query for type (a key of CC) to addrs on port, set_cal being the value to set."""
+    if type not in CC:
+        raise MidsimError("invalid type")
+    (code, cmd_size, general_only, cal_size) = CC[type]
+    if not general and general_only:
+        raise MidsimError("Direct command code not availible for --type=" + type)
+    if type in ("ping", "hubversion"):
+        cmd_code = code
+        cmd_codep = None
+        addrs = [0]
+    elif general:
+        cmd_code = GENERAL_CC
+        cmd_codep = code
+    else:
+        cmd_code = code
+        cmd_codep = None
+    if cmd_code not in (CC['ping'][0], CC['hubversion'][0]):
+        if port is None:
+            raise MidsimError("Missing port.")
+        if addrs is None:
+            raise MidsimError("Missing addresses.")
+    if len(addrs) > MAX_ADDRS:
+        raise MidsimError("must have <= 32 addresses.")
+    if set_cal is not None and len(addrs) > 1:
+        raise MidsimError("Can only set calibration to one unit at a time.")
+    if get_cal and set_cal is not None:
+        raise MidsimError("Don't both set and get cal at same time.")
+    if get_cal or set_cal is not None:
+        if cmd_code != GENERAL_CC:
+            raise MidsimError("Calibration options need general option.")
+        cmd_code = GET_CAL_CC if get_cal else SET_CAL_CC
+    return Query(type, port, list(addrs), general, get_cal, set_cal, cmd_code, cmd_codep, cmd_size, cal_size)
+
+
+class Reading(collections.namedtuple('Reading', ['index', 'port', 'address', 'values'])):
+    """What one address replied, values being None where it replied ERR."""
+    __slots__ = ()
+
+    def ok_p(self):
+        return None not in self.values.values()
+
+
+Pong = collections.namedtuple('Pong', ['pong'])
+HubVersion = collections.namedtuple('HubVersion', ['version'])
+HubError = collections.namedtuple('HubError', ['index', 'code', 'addr_index'])
+RECORD_TYPES = dict((t.__name__, t) for t in (Reading, Pong, HubVersion, HubError))
+
+
+def encode_record(record):
+    return [type(record).__name__, list(record)]
+
+
+def decode_record(encoded):
+    (name, fields) = encoded
+    if name == 'Reading':
+        fields[3] = dict((str(k), v) for k, v in fields[3].items())
+    return RECORD_TYPES[name](*fields)
+
+
+class MidsimClient:
+    """
+    Queries the hub over one transport kept open from query to query: the
+    serial device, UDP, or if remote is given the midsim server at that
+    IP:PORT over a keep-alive HTTP session.  Any failure closes the
+    transport, to be opened again by the next query.  query_many sends a
+    whole list of queries to a remote server in one request.
+    """
+
+    def __init__(self, device="/dev/ttyAMA0", udp=False, remote=None, selfip=udp_selfip, destip=udp_destip,
+                 timeout=30):
+        self.device = device
+        self.udp = udp
+        self.remote = remote
+        self.selfip = selfip
+        self.destip = destip
+        self.timeout = timeout
+        self.verbose = False
+        self.debugstream = sys.stdout
+        self.lock = threading.Lock()
+        self.s = None
+        self.session = None
+
+    def open(self):
+        if self.s is not None:
+            return
+        if self.udp:
+            self.s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.s.bind(self.selfip)
+        else:
+            self.s = serial.Serial(self.device, 9600, timeout=10)
+
+    def close(self):
+        if self.s is not None:
+            self.s.close()
+            self.s = None
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def query(self, q):
+        """The records replied to Query q."""
+        return self.query_many([q])[0]
+
+    def query_many(self, queries):
+        """The records replied to each of queries, in order."""
+        if self.remote:
+            return self._remote_query(queries)
+        with self.lock:
+            return [self._transact(q) for q in queries]
+
+    def send(self, q):
+        """Send q without waiting for the reply."""
+        with self.lock:
+            self.open()
+            self._write(build_request(q, random.randrange(1, 60000)))
+
+    def read(self, type, port, addrs):
+        return self.query(make_query(type, port, addrs))
+
+    def get_cal(self, type, port, address):
+        return self._cal(make_query(type, port, [address], get_cal=True))
+
+    def set_cal(self, type, port, address, value):
+        """Set the calibration value, returning the value the unit replied with."""
+        return self._cal(make_query(type, port, [address], set_cal=value))
+
+    def _cal(self, q):
+        return [r.values['calibration'] for r in self.query(q) if isinstance(r, Reading)][0]
+
+    def _debug(self, msg):
+        if self.verbose:
+            print >> self.debugstream, msg
+
+    def _write(self, buffer):
+        self._debug("Sending command.\n" + " ".join([str(ord(c)) for c in buffer]))
+        if self.udp:
+            self.s.sendto(buffer, self.destip)
+        else:
+            self.s.write(buffer)
+
+    def _transact(self, q):
+        ping = random.randrange(1, 60000)
+        self._debug("DEBUG: ping = " + str(ping))
+        buffer = build_request(q, ping)
+        try:
+            self.open()
+            timeout = 10 * len(q.addrs)
+            if self.udp:
+                # drop late replies to earlier queries
+                self.s.setblocking(0)
+                try:
+                    while self.s.recv(512):
+                        pass
+                except socket.error:
+                    pass
+                self.s.settimeout(timeout)
+            else:
+                self.s.timeout = timeout
+                self.s.flushInput()
+            self._write(buffer)
+            self._debug("Awaiting reply")
+            if self.udp:
+                rstr = self.s.recv(512)
+            else:
+                # length only Hub to ethernet board
+                lstr = self.s.read(2)
+                if len(lstr) != 2:
+                    raise MidsimError("No reply from hub.")
+                l = struct.unpack("<H", lstr)[0]
+                self._debug("DEBUG: told recieved bytes: " + str(l))
+                rstr = self.s.read(l - 2)
+                if len(rstr) != l - 2:
+                    raise MidsimError("Short reply from hub, %d of %d bytes." % (len(rstr), l - 2))
+        except (socket.error, serial.SerialException, MidsimError), e:
+            self.close()
+            if isinstance(e, MidsimError):
+                raise
+            raise MidsimError("Hub communication failed: " + str(e))
+        self._debug("DEBUG: bytes in reply: " + str(len(rstr)))
+        self._debug("DEBUG: ord contents: " + " ".join([str(ord(c)) for c in rstr]))
+        try:
+            return parse_reply(q, rstr)
+        except (MidsimError, struct.error, TypeError, IndexError, ValueError), e:
+            # the transport may hold the rest of a garbled reply
+            self.close()
+            if isinstance(e, MidsimError):
+                raise
+            raise MidsimError("Bad reply from hub: " + str(e))
+
+    def _remote_query(self, queries):
+        if self.session is None:
+            self.session = requests.Session()
+        try:
+            req = self.session.post('http://%s/midsim/batch' % (self.remote,),
+                                    data=json.dumps([q.request() for q in queries]),
+                                    headers={'Content-Type': 'application/json'},
+                                    timeout=self.timeout + 10 * sum([len(q.addrs) for q in queries]))
+        except requests.RequestException, e:
+            self.close()
+            raise MidsimError("server query: " + str(e))
+        if req.status_code < 200 or req.status_code >= 300:
+            raise MidsimError("server query(%d): %s" % (req.status_code, req.text))
+        try:
+            replies = req.json()
+        except ValueError, e:
+            raise MidsimError("server query: bad reply: " + str(e))
+        results = []
+        for r in replies:
+            if 'error' in r:
+                raise MidsimError(r['error'])
+            results.append([decode_record(x) for x in r['records']])
+        return results
+
+
+LOCAL_CLIENTS = {}
+LOCAL_CLIENTS_LOCK = threading.Lock()
+
+
+def local_client():
+    """The client for the hub given by the device and doUDP settings, kept for later calls."""
+    with LOCAL_CLIENTS_LOCK:
+        key = (device, doUDP)
+        if key not in LOCAL_CLIENTS:
+            LOCAL_CLIENTS[key] = MidsimClient(device, doUDP)
+        return LOCAL_CLIENTS[key]
+
+
 def midsim(argv, outstream=sys.stdout, errstream=sys.stderr):
     global justsend, device, verbose, format, doUDP, device, udp_selfip, udp_destip
     try:
@@ -126,11 +402,10 @@ def midsim(argv, outstream=sys.stdout, errstream=sys.stderr):
         sys.exit(2)
     addrs = None
     port = None
-    cmd_code = None
-    cmd_codep = None
-    cmd_size = None
+    type = None
     general = True
-    cal_opts = {"get_cal": False, "set_cal": False, "cal_val": 0, "cal_size": 0}
+    get_cal = False
+    set_cal = None
     loop = [0, 1]
     for o, a in opts:
         if o in ("-h", "--help"):
@@ -174,31 +449,13 @@ def midsim(argv, outstream=sys.stdout, errstream=sys.stderr):
         elif o in ("-o",):
             general = False
         elif o in ('--get-cal',):
-            cal_opts["get_cal"] = True
+            get_cal = True
         elif o in ('--set-cal',):
-            cal_opts["set_cal"] = True
-            cal_opts["cal_val"] = int(a)
+            set_cal = int(a)
         elif o in ("-a", "--addresses"):
             addrs = [int(a) for a in a.split(",")]
         elif o in ("-t", "--type"):
-            if a in CC:
-                if not general and CC[a][2]:
-                    print >> errstream, "ERROR: Direct command code not availible for --type=" + a
-                    sys.exit()
-                if general:
-                    cmd_code = 25
-                    cmd_codep = CC[a][0]
-                else:
-                    cmd_code = CC[a][0]
-                cmd_size = CC[a][1]
-                cal_opts['cal_size'] = CC[a][3]
-                if a == "ping" or a == "hubversion":
-                    cmd_code = CC[a][0]
-                    addrs = [0]
-            else:
-                print >> errstream, "Error: invalid type"
-                usage(errstream)
-                sys.exit(2)
+            type = a
         elif o in ("-p", "--port"):
             port = int(a)
         elif o in ("-s", "--server"):
@@ -209,51 +466,27 @@ def midsim(argv, outstream=sys.stdout, errstream=sys.stderr):
             print >> errstream, "Error: invalid option"
             usage(errstream)
             sys.exit()
-    if cmd_code == None:
+    if type == None:
         print >> errstream, "Error: Missing type"
         usage(errstream)
         sys.exit(2)
-    if cmd_code != CC['ping'][0] and cmd_code != CC['hubversion'][0] and port == None:
-        print >> errstream, "Error: Missing port."
-        usage(errstream)
-        sys.exit(2)
-    if cmd_code != CC['ping'][0] and cmd_code != CC['hubversion'][0] and addrs == None:
-        print >> errstream, "Error: Missing addresses."
-        usage(errstream)
-        sys.exit(2)
-    if (addrs != None and len(addrs) > 32):
-        print >> errstream, "Error: must have <= 32 addresses."
-        usage(errstream)
-        sys.exit(2)
-    if cal_opts["set_cal"] and len(addrs) > 1:
-        print >> errstream, "Error: Can only set calibration to one unit at a time."
-        sys.exit(2)
-    if cal_opts["get_cal"] and loop[1] != 1:
+    if get_cal and loop[1] != 1:
         print >> errstream, "Error: Don't loop with calibration commands."
         sys.exit(2)
-    if cal_opts["get_cal"] and cal_opts["set_cal"]:
-        print >> errstream, "Error: Don't both set and get cal at same time."
+    try:
+        q = make_query(type, port, addrs, general, get_cal, set_cal)
+    except MidsimError, e:
+        print >> errstream, "Error: " + str(e)
+        usage(errstream)
         sys.exit(2)
-    if cal_opts["get_cal"]:
-        if cmd_code == 25:
-            cmd_code = 64
-        else:
-            print >> errstream, "Error: Calibration options need general option."
-            sys.exit(2)
-    if cal_opts["set_cal"]:
-        if cmd_code == 25:
-            cmd_code = 65
-        else:
-            print >> errstream, "Error: Calibration options need general option."
-            sys.exit(2)
 
     if loop[1] <= 0:
         while True:
-            run(cmd_code, cmd_codep, cmd_size, port, addrs, cal_opts, outstream, errstream)
+            run(q, outstream, errstream)
             time.sleep(loop[0])
     else:
         for i in xrange(loop[1]):
-            run(cmd_code, cmd_codep, cmd_size, port, addrs, cal_opts, outstream, errstream)
+            run(q, outstream, errstream)
             time.sleep(loop[0])
 
 
@@ -305,227 +538,138 @@ def structFormat(calSize):
     return t
 
 
-def run(cmd_code, cmd_codep, cmd_size, port, addrs, cal_opts, outstream, errstream):
-    ping = random.randrange(1, 60000)
+def build_request(q, ping):
+    """The bytes to send the hub for Query q."""
+    cmd_code = q.cmd_code
+    addrs = q.addrs
     buffer = "DERV"
     buffer += struct.pack("B", cmd_code)
     if (cmd_code == 1 or cmd_code == 2 or cmd_code == 3 or cmd_code == 6 or cmd_code == 7):  # temphum, wind, tach, thermo
-        buffer += struct.pack("BB", port, len(addrs))  # port, N
+        buffer += struct.pack("BB", q.port, len(addrs))  # port, N
         for i in addrs:  # Addresses
             buffer += struct.pack("<H", i)
-    elif (cmd_code == 25):  # General
-        buffer += struct.pack("BBBB", cmd_codep, cmd_size, port, len(addrs))
+    elif (cmd_code == GENERAL_CC):  # General
+        buffer += struct.pack("BBBB", q.cmd_codep, q.cmd_size, q.port, len(addrs))
         for i in addrs:  # Addresses
             buffer += struct.pack("<H", i)
-        cmd_code = cmd_codep
-    elif (cmd_code == 64):  # Get cal
-        buffer += struct.pack("BBBB", cmd_codep, cal_opts['cal_size'], port, len(addrs))
+    elif (cmd_code == GET_CAL_CC):  # Get cal
+        buffer += struct.pack("BBBB", q.cmd_codep, q.cal_size, q.port, len(addrs))
         for i in addrs:  # Addresses
             buffer += struct.pack("<H", i)
-    elif (cmd_code == 65):  # Set cal
-        buffer += struct.pack("<BBBH" + structFormat(cal_opts['cal_size']), cmd_codep, cal_opts['cal_size'], port,
-                              addrs[0], cal_opts['cal_val'])
+    elif (cmd_code == SET_CAL_CC):  # Set cal
+        buffer += struct.pack("<BBBH" + structFormat(q.cal_size), q.cmd_codep, q.cal_size, q.port,
+                              addrs[0], q.set_cal)
     elif (cmd_code == CC['ping'][0] or cmd_code == CC['hubversion'][0]):  # Ping or hubversion
-        if (verbose):
-            print >> outstream, "DEBUG: ping = " + str(ping)
         buffer += struct.pack("<H", ping)
-
-    if (doUDP):
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind(udp_selfip)
-    else:
-        s = serial.Serial(device, 9600, timeout=10 * len(addrs))
-
-    if (verbose):
-        print >> outstream, "Sending command."
-        for i in range(len(buffer)):
-            print >> outstream, " " + str(ord(buffer[i])),
-        print >> outstream
-    if (doUDP):
-        s.sendto(buffer, udp_destip)
-    else:
-        s.write(buffer)
-    if justsend:
-        sys.exit(0)
-
-    # s.close()
-    # sys.exit(0)
-    if (verbose):
-        print >> outstream, "Awaiting reply"
-    if (doUDP):
-        rstr = s.recv(512)
-    else:
-        # length only Hub to ethernet board
-        l = struct.unpack("<H", s.read(2))[0]
-        if (verbose):
-            print >> outstream, "DEBUG: told recieved bytes: " + str(l)
-        rstr = s.read(l - 2)
-
-    if (verbose):
-        print >> outstream, "DEBUG: bytes in reply: " + str(len(rstr))
-        print >> outstream, "DEBUG: ord contents: ",
-    if (verbose):
-        for i in range(len(rstr)):
-            print >> outstream, str(ord(rstr[i])),
-            print >> outstream
+    return buffer
+
+
+def read_values(cmd_code, cal_size, rbuf):
+    """The values of one address read from rbuf, None where it replied ERR."""
+    if (cmd_code == CC['temphum'][0]):
+        (temp, hum) = struct.unpack("<HH", rbuf.read(4))
+        if (temp != 0):
+            temp = (-40.2) + 0.018 * temp
+            h = -2.0468 + 0.0367 * hum + -1.5955e-6 * hum ** 2
+            h = (((temp - 32.0) / 1.8) - 25) * (0.01 + 0.00008 * hum) + h
+            return {'temp': temp, 'humidity': h, 'BMEHum': hum / 100.0}
+        return {'temp': None, 'humidity': None}
+    elif (cmd_code == CC['anemometer'][0] or cmd_code == CC['tachometer'][0]):
+        v = struct.unpack("<H", rbuf.read(2))[0]
+        return {'velocity': v if v != 0 else None}
+    elif (cmd_code == CC['thermocouple'][0]):
+        (temp1, temp2) = struct.unpack("<HH", rbuf.read(4))
+        if (temp1 != 0 or temp2 != 0):
+            temp1 = (1023.75 * temp1 / (2 ** 12)) * 9. / 5. + 32.0
+            temp2 = (1023.75 * temp2 / (2 ** 12)) * 9. / 5. + 32.0
+            return {'temp1': temp1, 'temp2': temp2}
+        return {'temp1': None, 'temp2': None}
+    elif (cmd_code == CC['pressure'][0]):
+        p = struct.unpack("<H", rbuf.read(2))[0]
+        return {'pressure': 0.0022888 * p + 50.0 if p != 0 else None}
+    elif (cmd_code == CC['pressurewide'][0]):
+        p = struct.unpack("<I", rbuf.read(4))[0]
+        return {'pressure': p if p != 0 else None}
+    elif (cmd_code == CC['multipointreset'][0]):
+        p = ord(rbuf.read(1))
+        return {'reset': p if p != 0 else None}
+    elif (cmd_code >= CC['multipointc1'][0] and cmd_code <= CC['multipointc4'][0]):
+        p = struct.unpack("<H", rbuf.read(2))[0]
+        return {'temp': 1.8 * ds18b20_conversion(p) + 32 if p != 0 else None}
+    elif (cmd_code >= CC['multipointaddrc1'][0] and cmd_code <= CC['multipointaddrc4'][0]):
+        p = struct.unpack("<Q", rbuf.read(8))[0]
+        return {'saddr': hex(p) if p != 0 else None}
+    elif (cmd_code == CC['unitversion'][0]):
+        v = struct.unpack("<H", rbuf.read(2))[0]
+        return {'unitversion': 3.0 + v / 100.0 if v != 0 else None}
+    elif (cmd_code == GET_CAL_CC or cmd_code == SET_CAL_CC):
+        return {'calibration': struct.unpack("<" + structFormat(cal_size), rbuf.read(cal_size))[0]}
+    raise MidsimError("No reading format for command code %d." % (cmd_code,))
+
+
+def parse_reply(q, rstr):
+    """The records in rstr, the hub's reply to Query q."""
+    records = []
     rbuf = StringIO(rstr)
-
-    do_output_start(datetime.datetime.now(), outstream)
+    cmd_code = q.reply_code()
     codeS = rbuf.read(1)
     while (len(codeS) != 0):
         code = ord(codeS)
-        if (verbose):
-            print >> outstream, "DEBUG: Reply code " + str(code)
         if code == 1:
             s = ord(rbuf.read(1))
             cc = ord(rbuf.read(1))
-            if verbose:
-                print >> outstream, "DEBUG: cc=%d" % (cc)
             if (cc != cmd_code):
-                print >> errstream, "ERROR: Command codes mismatch %d != %d" % (cc, cmd_code)
-                sys.exit(3)
+                raise MidsimError("Command codes mismatch %d != %d" % (cc, cmd_code))
             n = ord(rbuf.read(1))
-            if (n != len(addrs)):
-                print >> errstream, "ERROR: N != len(addrs)"
-                sys.exit(3)
-            if (s != cmd_size * len(addrs) + 1):
-                print >> errstream, "ERROR: weird datasize s=" + str(s)
-                sys.exit(3)
-            if (cmd_code == CC['temphum'][0]):
-                for i in range(n):
-                    (temp, hum) = struct.unpack("<HH", rbuf.read(4))
-                    if (temp != 0):
-                        temp = (-40.2) + 0.018 * temp
-                        h = -2.0468 + 0.0367 * hum + -1.5955e-6 * hum ** 2
-                        h = (((temp - 32.0) / 1.8) - 25) * (0.01 + 0.00008 * hum) + h
-                        data = {'index': (i + 1), 'addr': str(port) + ':' + str(addrs[i]), 'temp': temp, 'humidity': h,
-                                'BMEHum': hum / 100.0}
-                        do_output(data, outstream)
-                    # print "A: "+str(i+1)+", T:"+str(temp)+", H:"+str(h)
-                    else:
-                        do_output({'index': (i + 1), 'addr': str(port) + ':' + str(addrs[i]), 'temp': 'ERR',
-                                   'humidity': 'ERR'}, outstream)
-                    # print "A: "+str(i+1)+", T:ERR, H:ERR"
-            elif (cmd_code == CC['anemometer'][0]):
-                for i in range(n):
-                    v = struct.unpack("<H", rbuf.read(2))[0]
-                    if (v != 0):
-                        do_output({'index': i + 1, 'addr': str(port) + ':' + str(addrs[i]), 'velocity': v}, outstream)
-                    # print "A: "+str(i+1)+", V:"+str(v)
-                    else:
-                        do_output({'index': i + 1, 'addr': str(port) + ':' + str(addrs[i]), 'velocity': 'ERR'},
-                                  outstream)
-                    # print "A: "+str(i+1)+", V:ERR"
-            elif (cmd_code == CC['tachometer'][0]):
-                for i in range(n):
-                    v = struct.unpack("<H", rbuf.read(2))[0]
-                    if (v != 0):
-                        # print "A: "+str(i+1)+", R:"+str(v)
-                        do_output({'index': i + 1, 'addr': str(port) + ':' + str(addrs[i]), 'velocity': v}, outstream)
-                    else:
-                        do_output({'index': i + 1, 'addr': str(port) + ':' + str(addrs[i]), 'velocity': 'ERR'},
-                                  outstream)
-                    # print "A: "+str(i+1)+", R:ERR"
-            elif (cmd_code == CC['thermocouple'][0]):
-                for i in range(n):
-                    (temp1, temp2) = struct.unpack("<HH", rbuf.read(4))
-                    if (temp1 != 0 or temp2 != 0):
-                        temp1 = (1023.75 * temp1 / (2 ** 12)) * 9. / 5. + 32.0
-                        temp2 = (1023.75 * temp2 / (2 ** 12)) * 9. / 5. + 32.0
-                        # print "A: "+str(i+1)+", T1:"+str(temp1)+", T2:"+str(temp2)
-                        do_output(
-                            {'index': i + 1, 'addr': str(port) + ':' + str(addrs[i]), 'temp1': temp1, 'temp2': temp2},
-                            outstream)
-                    else:
-                        # print "A: "+str(i+1)+", T1:ERR, T2:ERR"
-                        do_output(
-                            {'index': i + 1, 'addr': str(port) + ':' + str(addrs[i]), 'temp1': 'ERR', 'temp2': 'ERR'},
-                            outstream)
-            elif (cmd_code == CC['pressure'][0]):
-                for i in range(n):
-                    p = struct.unpack("<H", rbuf.read(2))[0]
-                    if (p != 0):
-                        p = 0.0022888 * p + 50.0
-                        # print "R: "+str(i+1)+", P:"+str(p)
-                        do_output({'index': i + 1, 'addr': str(port) + ':' + str(addrs[i]), 'pressure': p}, outstream)
-                    else:
-                        # print "R: "+str(i+1)+", P:ERR"
-                        do_output({'index': i + 1, 'addr': str(port) + ':' + str(addrs[i]), 'pressure': 'ERR'},
-                                  outstream)
-            elif (cmd_code == CC['pressurewide'][0]):
-                for i in range(n):
-                    p = struct.unpack("<I", rbuf.read(4))[0]
-                    if (p != 0):
-                        p = p
-                        # print "R: "+str(i+1)+", P:"+str(p)
-                        do_output({'index': i + 1, 'addr': str(port) + ':' + str(addrs[i]), 'pressure': p}, outstream)
-                    else:
-                        # print "R: "+str(i+1)+", P:ERR"
-                        do_output({'index': i + 1, 'addr': str(port) + ':' + str(addrs[i]), 'pressure': 'ERR'},
-                                  outstream)
-            elif (cmd_code == CC['multipointreset'][0]):
-                for i in range(n):
-                    p = ord(rbuf.read(1))
-                    if (p != 0):
-                        # print "R: "+str(i+1)+", P:"+str(p)
-                        do_output({'index': i + 1, 'addr': str(port) + ':' + str(addrs[i]), 'reset': p}, outstream)
-                    else:
-                        # print "R: "+str(i+1)+", P:ERR"
-                        do_output({'index': i + 1, 'addr': str(port) + ':' + str(addrs[i]), 'reset': 'ERR'}, outstream)
-            elif (cmd_code >= CC['multipointc1'][0] and cmd_code <= CC['multipointc4'][0]):
-                for i in range(n):
-                    p = struct.unpack("<H", rbuf.read(2))[0]
-                    if (p != 0):
-                        p = 1.8 * ds18b20_conversion(p) + 32
-                        # print "R: "+str(i+1)+", T:"+str(p)
-                        do_output({'index': i + 1, 'addr': str(port) + ':' + str(addrs[i]), 'temp': p}, outstream)
-                    else:
-                        # print "R: "+str(i+1)+", T:ERR"
-                        do_output({'index': i + 1, 'addr': str(port) + ':' + str(addrs[i]), 'temp': 'ERR'}, outstream)
-            elif (cmd_code >= CC['multipointaddrc1'][0] and cmd_code <= CC['multipointaddrc4'][0]):
-                for i in range(n):
-                    p = struct.unpack("<Q", rbuf.read(8))[0]
-                    if (p != 0):
-                        # print "R: "+str(i+1)+", T:"+str(p)
-                        do_output({'index': i + 1, 'addr': str(port) + ':' + str(addrs[i]), 'saddr': hex(p)}, outstream)
-                    else:
-                        # print "R: "+str(i+1)+", T:ERR"
-                        do_output({'index': i + 1, 'addr': str(port) + ':' + str(addrs[i]), 'temp': 'ERR'}, outstream)
-            elif (cmd_code == CC['unitversion'][0]):
-                for i in range(n):
-                    v = struct.unpack("<H", rbuf.read(2))[0]
-                    if (v != 0):
-                        # print "A: "+str(i+1)+", R:"+str(v)
-                        do_output(
-                            {'index': i + 1, 'addr': str(port) + ':' + str(addrs[i]), 'unitversion': 3.0 + v / 100.0},
-                            outstream)
-                    else:
-                        do_output({'index': i + 1, 'addr': str(port) + ':' + str(addrs[i]), 'unitversion': 'ERR'},
-                                  outstream)
-            elif (cmd_code == 64 or cmd_code == 65):
-                for i in range(n):
-                    v = struct.unpack("<" + structFormat(cal_opts['cal_size']), rbuf.read(cal_opts['cal_size']))[0]
-                    # print "A: "+str(i+1)+", R:"+str(v)
-                    do_output({'index': i + 1, 'addr': str(port) + ':' + str(addrs[i]), 'calibration': v}, outstream)
+            if (n != len(q.addrs)):
+                raise MidsimError("N != len(addrs)")
+            if (s != q.cmd_size * len(q.addrs) + 1):
+                raise MidsimError("weird datasize s=" + str(s))
+            for i in range(n):
+                records.append(Reading(i + 1, q.port, q.addrs[i], read_values(cmd_code, q.cal_size, rbuf)))
         elif code == 3:
-            p = struct.unpack("<H", rbuf.read(2))[0]
-            # print "PONG: "+str(p)
-            do_output({'index': 0, 'pong': p}, outstream)
+            records.append(Pong(struct.unpack("<H", rbuf.read(2))[0]))
         elif code == 4:
             l = ord(rbuf.read(1))
             for i in range(l):
                 (c, a) = struct.unpack("BB", rbuf.read(2))
-                if format != 'csv':
-                    print >> errstream, "Error: " + str(i + 1) + ", Code: " + str(c) + ", AddrIdx:" + str(a)
+                records.append(HubError(i + 1, c, a))
         elif code == 5:
             p = struct.unpack("<H", rbuf.read(2))[0]
-            # print "HUB VERSION: "+str(p)
-            do_output({'index': 0, 'hubversion': 3.0 + p / 100.0}, outstream)
+            records.append(HubVersion(3.0 + p / 100.0))
         else:
-            print >> outstream, "BIG error: unknown reply code " + str(code) + "."
-            print >> errstream, "BIG error: unknown reply code " + str(code) + "."
+            raise MidsimError("BIG error: unknown reply code " + str(code) + ".")
         codeS = rbuf.read(1)
+    return records
+
+
+def run(q, outstream, errstream):
+    client = local_client()
+    client.verbose = verbose
+    client.debugstream = outstream
+    if justsend:
+        client.send(q)
+        sys.exit(0)
+    try:
+        records = client.query(q)
+    except MidsimError, e:
+        print >> errstream, "ERROR: " + str(e)
+        sys.exit(3)
+
+    do_output_start(datetime.datetime.now(), outstream)
+    for r in records:
+        if isinstance(r, Reading):
+            data = {'index': r.index, 'addr': str(r.port) + ':' + str(r.address)}
+            for (key, value) in r.values.items():
+                data[key] = 'ERR' if value is None else value
+            do_output(data, outstream)
+        elif isinstance(r, Pong):
+            do_output({'index': 0, 'pong': r.pong}, outstream)
+        elif isinstance(r, HubVersion):
+            do_output({'index': 0, 'hubversion': r.version}, outstream)
+        elif isinstance(r, HubError):
+            if format != 'csv':
+                print >> errstream, "Error: " + str(r.index) + ", Code: " + str(r.code) + ", AddrIdx:" + str(r.addr_index)
     do_output_end(outstream)
 
 
@@ -20,9 +20,9 @@ import datetime
 import csv
 import sys
 import time
+import json
 import traceback
 import midsim
-import StringIO
 
 #sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)
 
@@ -35,9 +35,10 @@ def usage(p):
 	print >> p, "  -s t,c                 Query single unit at a time in batches of c < 32 with t "
 	print >> p, "                         second between each"
 	print >> p, "  -i t                   Query alternating in order given with t seconds between each"
+	print >> p, "                         round, all units in commands of up to 32 addresses per port"
 	print >> p, "  -n s                   Minimum number of samples n per unit until done"
 	print >> p, "  -t type                The type to query"
-	print >> p, "  -f samplefile          Write out samples to samplefile, instead of just keeping in memory"
+	print >> p, "  -f samplefile          Write each sample to samplefile as a line of JSON"
 	print >> p, "  -o reportfile          Write report to reportfile as well as stdout"
 	print >> p, "  -a p1:a1,...,pn:an     Query these units port:address"
         print >> p, "  -l filepath            read addresses from specified file"
@@ -105,35 +106,104 @@ def main():
 	step2(config)
 	step3(config)
 
-def step1_sample(config):
-	#[[Port, Unit_ADDRESS, VALUE1, VALUE2, ...], ...]
-	alldata = []
+# latency histogram bin upper edges, ms, the last bin being everything slower
+LATENCY_BINS_MS = [5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+class UnitCounts:
+	"""A unit's error and sample counts and read latency histogram, kept as samples come in."""
+	def __init__(self, unit):
+		self.unit = unit
+		self.errors = 0
+		self.total = 0
+		self.latency = [0]*(len(LATENCY_BINS_MS)+1)
+		self.latencySum = 0.0
+		self.latencyN = 0
+
+	def add(self, ok_p, latency=None):
+		self.total += 1
+		if not ok_p:
+			self.errors += 1
+		if latency is not None:
+			ms = latency*1000.0
+			i = 0
+			while i < len(LATENCY_BINS_MS) and ms > LATENCY_BINS_MS[i]:
+				i += 1
+			self.latency[i] += 1
+			self.latencySum += ms
+			self.latencyN += 1
+
+	def meanLatency(self):
+		if self.latencyN == 0:
+			return 0.0
+		return self.latencySum/self.latencyN
+
+def sample_queries(config):
+	"""
+	The queries each round makes, with alternate all units in order in
+	commands of up to 32 addresses per port, otherwise a command per unit
+	repeating its address counts times.
+	"""
 	if not config["alternate"]:
-		for unit in config["units"]:
-			count = 0
-			data = []
-			data.extend([unit[0], unit[1]])
-			while count < config["samples_per_unit"]:
-				sys.stdout.write("Unit %d:%d Sample: %d/%d                  \r" % (unit[0], unit[1], count+1, config["samples_per_unit"]))
+		return [midsim.make_query(config["type"], unit[0], [unit[1]]*config["counts"]) for unit in config["units"]]
+	queries = []
+	ports = []
+	for unit in config["units"]:
+		if unit[0] not in ports:
+			ports.append(unit[0])
+	for port in ports:
+		addrs = [unit[1] for unit in config["units"] if unit[0] == port]
+		for i in range(0, len(addrs), midsim.MAX_ADDRS):
+			queries.append(midsim.make_query(config["type"], port, addrs[i:i+midsim.MAX_ADDRS]))
+	return queries
+
+def sample(client, q, counts, out):
+	"""Make query q, adding each address's reading to counts and writing it to out."""
+	t0 = time.time()
+	try:
+		readings = [r for r in client.query(q) if isinstance(r, midsim.Reading)]
+		error = None
+	except midsim.MidsimError, e:
+		print >> sys.stderr, "ERROR: "+str(e)
+		readings = []
+		error = str(e)
+	t1 = time.time()
+	# the hub reads the addresses one after another
+	latency = (t1 - t0)/len(q.addrs)
+	for (i, address) in enumerate(q.addrs):
+		unitCounts = counts[(q.port, address)]
+		if i < len(readings):
+			ok_p = readings[i].ok_p()
+			unitCounts.add(ok_p, latency)
+			values = readings[i].values
+		else:
+			ok_p = False
+			unitCounts.add(False)
+			values = None
+		if out is not None:
+			json.dump({"time": t0 + (i + 0.5)*latency, "port": q.port, "address": address, "ok": ok_p,
+					   "latency": latency, "values": values, "error": error}, out, sort_keys=True)
+			out.write("\n")
+
+def step1_sample(config, counts, out):
+	client = midsim.MidsimClient()
+	if not config["alternate"]:
+		for (unit, q) in zip(config["units"], sample_queries(config)):
+			unitCounts = counts[tuple(unit)]
+			while unitCounts.total < config["samples_per_unit"]:
+				sys.stdout.write("Unit %d:%d Sample: %d/%d                  \r" % (unit[0], unit[1], unitCounts.total+1, config["samples_per_unit"]))
 				sys.stdout.flush()
-				#Get Reference value
-
-				outstream = StringIO.StringIO()
-				mstr="%s -f csv -t %s -p %d -a %d"+",%d"*(config["counts"]-1)
-				mparm = ["midsim.py", config["type"], unit[0]]
-				mparm.extend([unit[1]]*config["counts"])
-				mparm = tuple(mparm)
-				midsim.midsim((mstr % mparm).split(" "), outstream)
-				mout = outstream.getvalue()
-				outstream.close()
-				d = mout.rstrip().split(",")[1:]
-				data.extend(d)
-
-				count = count+len(d)
+				sample(client, q, counts, out)
 				time.sleep(config["delay"])
-			alldata.append(data)
 		print
-	return alldata
+	else:
+		queries = sample_queries(config)
+		for n in xrange(config["samples_per_unit"]):
+			sys.stdout.write("Round: %d/%d                  \r" % (n+1, config["samples_per_unit"]))
+			sys.stdout.flush()
+			for q in queries:
+				sample(client, q, counts, out)
+			time.sleep(config["delay"])
+		print
 
 
 
@@ -142,33 +212,40 @@ def step1(config):
 	#Gather Data
 	print "Gathering Samples..."
 
-	alldata = step1_sample(config)
-	#if config["samplefile"] != None:
-	#	with open(config["samplefile"], 'wb') as f:
-	#		for row in alldata:
-	#			f.write("%d,%d,%d,%d,%d\n" % (row[0], row[1], row[2], row[3], row[4]))
-	config["sampledata"] = alldata
+	# counts by (port, address) in the order given
+	counts = {}
+	for unit in config["units"]:
+		counts.setdefault(tuple(unit), UnitCounts(unit))
+	config["counts_by_unit"] = counts
+	out = None
+	if config["samplefile"] != None:
+		out = open(config["samplefile"], 'wb')
+	try:
+		step1_sample(config, counts, out)
+	finally:
+		if out is not None:
+			out.close()
 
 #analyse
 def step2(config):
-	counts = []
-	for row in config["sampledata"]:
-		total = 0
-		errors = 0
-		for col in row[2:]:
-			if col == '"ERR"':
-				errors = errors+1
-			total = total+1
-		counts.append([str(row[0])+':'+str(row[1]), errors, total])
-	config["stats"] = counts
+	stats = []
+	done = set()
+	for unit in config["units"]:
+		if tuple(unit) in done:
+			continue
+		done.add(tuple(unit))
+		c = config["counts_by_unit"][tuple(unit)]
+		stats.append([str(unit[0])+':'+str(unit[1]), c.errors, c.total, c.meanLatency(), c.latency])
+	config["stats"] = stats
 
 #Report
 def step3(config):
 	print "Results..."
 	f = open(config["reportfile"], 'wb')
 	for row in config["stats"]:
-		f.write("\"%s\",%d,%d\n" % (row[0], row[1], row[2]))
-		print "%s: %d/%d=%.2f" % (row[0], row[1], row[2], float(row[1])/float(row[2]))
+		# errors, total, mean latency ms, latency histogram counts by LATENCY_BINS_MS
+		f.write("\"%s\",%d,%d,%.1f,%s\n" % (row[0], row[1], row[2], row[3], ",".join([str(n) for n in row[4]])))
+		print "%s: %d/%d=%.2f, %.1f ms" % (row[0], row[1], row[2], float(row[1])/float(row[2]), row[3])
 	f.close()
 
 if __name__ == "__main__":
@@ -16,9 +16,11 @@ import struct
 import sys
 from crc_algorithms import Crc
 
+# built once, table_driven uses the 256 entry table made here
+MAXIM_CRC = Crc(width=8, poly=0x31, reflect_in = True, xor_in=0x00, reflect_out = True, xor_out=0x00)
+
 def maxim_ibutton_crc(data):
-	crc = Crc(width=8, poly=0x31, reflect_in = True, xor_in=0x00, reflect_out = True, xor_out=0x00)
-	return crc.bit_by_bit(data)
+	return MAXIM_CRC.table_driven(data)
 
 ser = serial.Serial("/dev/ttyS0", 9600, timeout=5)
 print "Opened: "+ser.portstr